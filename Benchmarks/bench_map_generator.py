@@ -0,0 +1,45 @@
+# compares the poisson-disk map mode with the rejection sampler at growing map sizes
+# PYTHONPATH=. python Benchmarks/bench_map_generator.py --sizes 120 480 1200
+import argparse
+import statistics
+import time
+
+from map_generator import MapGenerator, POISSON_MODE, REJECTION_MODE
+
+SIZES = (120, 240, 480, 960)
+
+
+def measure(screen_scale_multiplier, free_space_radius, players, repeat):
+    results = {POISSON_MODE: [], REJECTION_MODE: []}
+    planets = {POISSON_MODE: [], REJECTION_MODE: []}
+    players_ids = list(range(1, players + 1))
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        poisson = MapGenerator(screen_scale_multiplier, free_space_radius, mode=POISSON_MODE).run(players_ids)
+        results[POISSON_MODE].append(time.perf_counter() - start)
+        planets[POISSON_MODE].append(len(poisson))
+
+        # the rejection sampler is asked for as many planets as the poisson mode fitted
+        start = time.perf_counter()
+        rejection = MapGenerator(screen_scale_multiplier, free_space_radius, mode=REJECTION_MODE,
+                                 max_planet_count=len(poisson)).run(players_ids)
+        results[REJECTION_MODE].append(time.perf_counter() - start)
+        planets[REJECTION_MODE].append(len(rejection))
+
+    return {mode: (statistics.mean(planets[mode]), statistics.median(results[mode]) * 1000) for mode in results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='screen scale multipliers')
+    parser.add_argument('--free-space-radius', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>6} {:>10} {:>9} {:>11} {:>12}'.format('scale', 'mode', 'planets', 'median ms', 'us / planet'))
+    for size in args.sizes:
+        for mode, (planets, elapsed) in measure(size, args.free_space_radius, args.players, args.repeat).items():
+            print('{:>6} {:>10} {:>9.0f} {:>11.1f} {:>12.1f}'.format(size, mode, planets, elapsed,
+                                                                     elapsed * 1000 / planets))
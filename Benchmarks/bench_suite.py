@@ -0,0 +1,331 @@
+# micro-benchmarks of the server's hot paths, the results go to JSON so two runs can be compared
+# PYTHONPATH=. python Benchmarks/bench_suite.py --output before.json
+# PYTHONPATH=. python Benchmarks/bench_suite.py --compare before.json after.json
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from map_generator import MapGenerator
+from planet import PlanetStore
+from protocol import request, encode_event, decode_event, FRAME_HEADER, BINARY_ENCODING
+from room import Room
+from utils import MaxPriorityQueue, generate_id
+
+SEED = 20240601
+REPEAT = 15
+WARMUP = 3
+THRESHOLD = 0.1
+# a sample repeats the benchmark until it lasts this long, short samples are mostly timer and scheduler noise
+SAMPLE_TIME = 0.05
+QUEUE_ITEMS = 20000
+QUEUE_PRODUCERS = (1, 4)
+MAP_PLAYERS = (2, 4, 8)
+FRAMES = 5000
+HANDLER_EVENTS = 5000
+
+MOVE_EVENT = {'name': 'move', 'unit_id': 1234, 'x': 10.5, 'y': -3.25}
+
+
+class FakeClient(object):
+    def __init__(self, address):
+        self.address = address
+
+
+def queue_insert_remove():
+    queue = MaxPriorityQueue()
+    priorities = [random.randrange(2) for _ in range(QUEUE_ITEMS)]
+
+    def run():
+        start = time.perf_counter()
+        for priority in priorities:
+            queue.insert(priority, priority)
+        for _ in priorities:
+            queue.remove()
+        return time.perf_counter() - start
+
+    return QUEUE_ITEMS, run
+
+
+def queue_contention(producers):
+    def run():
+        queue = MaxPriorityQueue()
+        per_producer = QUEUE_ITEMS // producers
+        barrier = threading.Barrier(producers + 1)
+
+        def produce():
+            barrier.wait()
+            for item in range(per_producer):
+                queue.insert(item, item & 1)
+
+        threads = [threading.Thread(target=produce) for _ in range(producers)]
+        for thread in threads:
+            thread.start()
+
+        # the consumer removes while the producers insert, like the handler and the receiver
+        barrier.wait()
+        start = time.perf_counter()
+        for _ in range(per_producer * producers):
+            queue.remove()
+        elapsed = time.perf_counter() - start
+
+        for thread in threads:
+            thread.join()
+        return elapsed
+
+    return QUEUE_ITEMS // producers * producers, run
+
+
+def map_generator_run(players):
+    players_ids = list(range(1, players + 1))
+
+    def run():
+        # own ids, so the generated planets stay out of the global planet cache
+        generator = MapGenerator(ids=generate_id(), seed=SEED)
+        start = time.perf_counter()
+        generator.run(players_ids)
+        return time.perf_counter() - start
+
+    return 1, run
+
+
+def frame_encode_json():
+    def run():
+        start = time.perf_counter()
+        for _ in range(FRAMES):
+            request(json.dumps(MOVE_EVENT))
+        return time.perf_counter() - start
+
+    return FRAMES, run
+
+
+def frame_decode_json():
+    frame = request(json.dumps(MOVE_EVENT))
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(FRAMES):
+            size = FRAME_HEADER.unpack_from(frame)[0]
+            json.loads(frame[FRAME_HEADER.size:FRAME_HEADER.size + size])
+        return time.perf_counter() - start
+
+    return FRAMES, run
+
+
+def frame_encode_binary():
+    def run():
+        start = time.perf_counter()
+        for _ in range(FRAMES):
+            encode_event(MOVE_EVENT, BINARY_ENCODING)
+        return time.perf_counter() - start
+
+    return FRAMES, run
+
+
+def frame_decode_binary():
+    body = encode_event(MOVE_EVENT, BINARY_ENCODING)[4:]
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(FRAMES):
+            decode_event(body, BINARY_ENCODING)
+        return time.perf_counter() - start
+
+    return FRAMES, run
+
+
+def planet_get_dict():
+    planets = PlanetStore.from_planets(MapGenerator(ids=generate_id(), seed=SEED).run([1, 2, 3, 4]))
+
+    def run():
+        start = time.perf_counter()
+        [planet.get_dict() for planet in planets.values()]
+        return time.perf_counter() - start
+
+    return len(planets), run
+
+
+def planet_store_dicts():
+    planets = PlanetStore.from_planets(MapGenerator(ids=generate_id(), seed=SEED).run([1, 2, 3, 4]))
+
+    def run():
+        start = time.perf_counter()
+        planets.dicts()
+        return time.perf_counter() - start
+
+    return len(planets), run
+
+
+def started_room(queue, **options):
+    clients = [FakeClient(('127.0.0.1', port)) for port in (1, 2)]
+    room = Room(1, queue, seed_mapinit=True, **options)
+    for client in clients:
+        room.join(client)
+    for event in ({'name': 'ready', 'ready': True}, {'name': 'rendered'}):
+        for client in clients:
+            room.handle_event(event, client)
+
+    homes = {planet.owner: planet for planet in room.planets.values() if planet.owner is not None}
+    for planet in homes.values():
+        # enough units that thousands of selects never empty the planet
+        planet.units_count = 10 ** 9
+    queue.drain()
+    return room, clients, homes
+
+
+def handler_select():
+    queue = MaxPriorityQueue()
+    room, clients, homes = started_room(queue)
+    event = {'name': 'select', 'from': [homes[1].id], 'percentage': 1}
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(HANDLER_EVENTS):
+            room.handle_event(event, clients[0])
+        elapsed = time.perf_counter() - start
+        queue.drain()
+        return elapsed
+
+    return HANDLER_EVENTS, run
+
+
+def handler_damage(batch_damage=False):
+    queue = MaxPriorityQueue()
+    room, clients, homes = started_room(queue, batch_damage=batch_damage)
+    for client, player_id in zip(clients, (1, 2)):
+        room.handle_event({'name': 'select', 'from': [homes[player_id].id], 'percentage': 50}, client)
+    selected = [message['selected'] for message, _, _ in queue.drain() if message['name'] == 'select']
+    first_unit, count = selected[0][homes[1].id]
+    units = iter(range(first_unit, first_unit + count))
+
+    def run():
+        # damage reinforces the player's own planet, the match never ends
+        events = [{'name': 'damage', 'planet_id': homes[1].id, 'unit_id': next(units), 'hp_count': 1}
+                  for _ in range(HANDLER_EVENTS)]
+        start = time.perf_counter()
+        for event in events:
+            room.handle_event(event, clients[0])
+        if batch_damage:
+            room.tick()
+        elapsed = time.perf_counter() - start
+        queue.drain()
+        return elapsed
+
+    return HANDLER_EVENTS, run
+
+
+def benchmarks():
+    yield 'queue.insert_remove', queue_insert_remove
+    for producers in QUEUE_PRODUCERS:
+        yield 'queue.contention.{}'.format(producers), lambda producers=producers: queue_contention(producers)
+    for players in MAP_PLAYERS:
+        yield 'map_generator.run.{}'.format(players), lambda players=players: map_generator_run(players)
+    yield 'frame.encode.json', frame_encode_json
+    yield 'frame.decode.json', frame_decode_json
+    yield 'frame.encode.binary', frame_encode_binary
+    yield 'frame.decode.binary', frame_decode_binary
+    yield 'planet.get_dict', planet_get_dict
+    yield 'planet_store.dicts', planet_store_dicts
+    yield 'handler.select', handler_select
+    yield 'handler.damage', handler_damage
+    yield 'handler.damage.batched', lambda: handler_damage(batch_damage=True)
+
+
+def measure(setup, repeat, warmup):
+    # the same seeds every run, and no collection pauses inside the measured loops
+    random.seed(SEED)
+    np.random.seed(SEED)
+    ops, run = setup()
+    for _ in range(warmup):
+        run()
+
+    loops = max(1, round(SAMPLE_TIME / max(run(), 1e-9)))
+    gc.collect()
+    gc.disable()
+    try:
+        samples = [sum(run() for _ in range(loops)) / (ops * loops) for _ in range(repeat)]
+    finally:
+        gc.enable()
+
+    median = statistics.median(samples)
+    return {
+        'ops': ops,
+        'loops': loops,
+        'median_ns': median * 1e9,
+        'min_ns': min(samples) * 1e9,
+        # relative spread, a change below it is noise
+        'spread': (statistics.stdev(samples) / median) if len(samples) > 1 and median else 0.0,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'commit': commit}
+
+
+def run_suite(names, repeat, warmup):
+    results = {}
+    for name, setup in benchmarks():
+        if names and not any(part in name for part in names):
+            continue
+        results[name] = measure(setup, repeat, warmup)
+        print('{:<26} {:>12.0f} ns/op  min {:>10.0f}  spread {:>5.1%}'.format(
+            name, results[name]['median_ns'], results[name]['min_ns'], results[name]['spread']))
+    return {'environment': environment(), 'repeat': repeat, 'benchmarks': results}
+
+
+def compare(before, after, threshold):
+    # like timeit, the fastest sample is compared: noise only ever makes a sample slower
+    regressions = []
+    print('{:<26} {:>12} {:>12} {:>8}'.format('benchmark', 'before ns', 'after ns', 'change'))
+    for name, old in before['benchmarks'].items():
+        new = after['benchmarks'].get(name)
+        if new is None:
+            print('{:<26} {:>12.0f} {:>12}'.format(name, old['min_ns'], 'missing'))
+            continue
+
+        change = new['min_ns'] / old['min_ns'] - 1
+        # a change inside the spread of either run isn't flagged
+        limit = max(threshold, old['spread'], new['spread'])
+        verdict = ''
+        if change > limit:
+            verdict = 'REGRESSION'
+            regressions.append(name)
+        elif change < -limit:
+            verdict = 'faster'
+        print('{:<26} {:>12.0f} {:>12.0f} {:>+8.1%} {}'.format(name, old['min_ns'], new['min_ns'], change, verdict))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='file for the JSON results')
+    parser.add_argument('--filter', nargs='+', default=(), help='only benchmarks with these in their name')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two JSON results')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative slowdown flagged as regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            regressions = compare(json.load(before), json.load(after), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    results = run_suite(args.filter, args.repeat, args.warmup)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
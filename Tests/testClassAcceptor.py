@@ -0,0 +1,61 @@
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from shard import Acceptor
+from testClassServer import TestClient
+import unittest
+import time
+
+
+class Test_case_Acceptor(unittest.TestCase):
+
+    def setUp(self):
+        self.acceptor = Acceptor(port=0, workers=2, max_client_count=2)
+        self.acceptor.start()
+        self.address = self.acceptor.server.getsockname()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.acceptor.stop()
+        self.acceptor.server.close()
+
+    def connect(self):
+        client = TestClient(self.address)
+        client.sock.settimeout(30)
+        self.clients.append(client)
+        client.id = client.recv_until('connect')['player']['id']
+        return client
+
+    def wait_stats(self, predicate):
+        deadline = time.monotonic() + 10
+        while not all(predicate(worker.stats) for worker in self.acceptor.workers):
+            self.assertLess(time.monotonic(), deadline, "workers didnt report")
+            time.sleep(0.05)
+
+    def test_matches_are_spread_over_workers(self):
+        first_match = [self.connect(), self.connect()]
+        self.assertEqual([client.id for client in first_match], [1, 2], "match was split between workers")
+        self.wait_stats(lambda stats: not stats['open_rooms'])
+
+        second_match = [self.connect(), self.connect()]
+        self.assertEqual([client.id for client in second_match], [1, 2], "match was split between workers")
+        self.wait_stats(lambda stats: stats['rooms'] == 1 and not stats['open_rooms'])
+
+        for client in first_match + second_match:
+            client.send({'name': 'ready', 'ready': True})
+        for client in first_match + second_match:
+            self.assertEqual(len(client.recv_until('mapinit')['map']) > 0, True, "worker didnt start the match")
+
+    def test_worker_options(self):
+        acceptor = Acceptor(port=0, workers=2, map_pool_size=3, metrics_port=9100)
+        acceptor.server.close()
+        options = acceptor.worker_options(1)
+        self.assertEqual(options['metrics_port'], 9101)
+        self.assertEqual(options['map_pool_workers'], 1, "every worker's map pool would take a process per CPU")
+        self.assertEqual(acceptor.server_options['metrics_port'], 9100)
+
+
+if __name__ == '__main__':
+    unittest.main()
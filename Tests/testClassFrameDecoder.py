@@ -0,0 +1,44 @@
+from connection import FrameDecoder
+from protocol import request, ProtocolError
+import unittest
+import struct
+
+
+class Test_case_FrameDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = FrameDecoder(size=16)
+
+    def feed(self, data):
+        self.decoder.writable(len(data))[:len(data)] = data
+        self.decoder.commit(len(data))
+        return list(self.decoder.frames())
+
+    def test_pipelined_frames(self):
+        data = request('first') + request('second') + request('third')
+        self.assertEqual(self.feed(data), [b'first', b'second', b'third'], "wrong pipelined frames")
+        self.assertEqual(len(self.decoder), 0, "bytes left after complete frames")
+
+    def test_split_frame(self):
+        data = request('splitted frame')
+        self.assertEqual(self.feed(data[:2]), [], "frame from partial header")
+        self.assertEqual(self.feed(data[2:7]), [], "frame from partial body")
+        self.assertEqual(self.feed(data[7:]), [b'splitted frame'], "wrong reassembled frame")
+
+    def test_partial_frame_is_carried(self):
+        data = request('first') + request('second')
+        self.assertEqual(self.feed(data[:-3]), [b'first'], "wrong complete frames")
+        self.assertEqual(len(self.decoder), len(request('second')) - 3, "partial frame lost")
+        self.assertEqual(self.feed(data[-3:]), [b'second'], "wrong carried frame")
+
+    def test_buffer_grows(self):
+        payload = 'x' * 1000
+        self.assertEqual(self.feed(request(payload)), [payload.encode()], "wrong large frame")
+
+    def test_invalid_size(self):
+        with self.assertRaises(ProtocolError):
+            self.feed(struct.pack('i', -1))
+
+
+if __name__ == '__main__':
+    unittest.main()
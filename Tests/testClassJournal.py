@@ -0,0 +1,59 @@
+from journal import Journal, JournalReader, JournalError, OPEN, JOIN, EVENT, TICK, CLOSE
+import os
+import tempfile
+import unittest
+
+
+class Test_case_Journal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.TemporaryDirectory()
+        self.journal=Journal(self.directory.name)
+        self.journal.start()
+
+    def tearDown(self):
+        self.journal.stop()
+        self.directory.cleanup()
+
+    def write_match(self):
+        self.journal.record(7,OPEN,payload={'name': 'options', 'max_players': 2})
+        self.journal.record(7,JOIN,1)
+        self.journal.record(7,EVENT,1,{'name': 'move', 'unit_id': 3, 'x': 1.5, 'y': 2.0})
+        self.journal.record(7,TICK)
+        self.journal.close(7)
+        self.journal.stop()
+        return self.journal.path(7)
+
+    def test_roundtrip(self):
+        path=self.write_match()
+        with JournalReader(path) as reader:
+            self.assertEqual(reader.room_id,7,"wrong room")
+            records=list(reader)
+        self.assertEqual([(kind, player, record) for kind, player, at, record in records],[
+            (OPEN, 0, {'name': 'options', 'max_players': 2}),
+            (JOIN, 1, None),
+            (EVENT, 1, {'name': 'move', 'unit_id': 3, 'x': 1.5, 'y': 2.0}),
+            (TICK, 0, None),
+            (CLOSE, 0, None),
+        ],"wrong records")
+        times=[at for kind, player, at, record in records]
+        self.assertEqual(times,sorted(times),"times go backwards")
+        self.assertEqual(self.journal.paths,[path],"wrong journal files")
+
+    def test_truncated(self):
+        path=self.write_match()
+        with open(path,'r+b') as journal_file:
+            journal_file.truncate(os.path.getsize(path)-3)
+        with JournalReader(path) as reader:
+            self.assertEqual([kind for kind, player, at, record in reader],[OPEN, JOIN, EVENT, TICK],"complete records were lost")
+
+    def test_not_a_journal(self):
+        path=os.path.join(self.directory.name,'other')
+        with open(path,'wb') as other:
+            other.write(b'not a journal at all')
+        with self.assertRaises(JournalError):
+            JournalReader(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
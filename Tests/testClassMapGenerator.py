@@ -1,4 +1,5 @@
-from map_generator import MapGenerator
+from map_generator import MapGenerator, POISSON_MODE, regenerate
+from utils import generate_id
 import unittest
 
 
@@ -25,6 +26,37 @@ class Test_case_MapGenerator(unittest.TestCase):
         for i in range(len(players_ids)-1):
             self.assertEqual(self.mg._MapGenerator__planets[i+1].coords.calc_distance(self.mg._MapGenerator__planets[i+2].coords)-temp<(temp/100),True,"wrong distance to planets")
 
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            MapGenerator(mode='grid')
+
+    def test_poisson_fills_map(self):
+        mg=MapGenerator(480,50,mode=POISSON_MODE)
+        a=mg.run([1,2,3,4,5,6])
+        self.assertEqual(len(a)>200,True,"poisson mode didnt fill the map")
+        homes=a[1:7]
+        self.assertEqual([planet.owner for planet in homes],[1,2,3,4,5,6],"start positions changed")
+        coords=[planet.coords for planet in a]
+        for i in range(len(coords)):
+            for j in range(i+1,len(coords)):
+                self.assertEqual(coords[i].calc_distance(coords[j])>=100,True,"planets are too close")
+
+    def test_poisson_planet_limit(self):
+        a=MapGenerator(480,50,mode=POISSON_MODE,max_planet_count=100).run([1,2])
+        self.assertEqual(len(a),100,"wrong planets count")
+
+    def test_seed_is_deterministic(self):
+        first=[planet.get_dict() for planet in MapGenerator(ids=generate_id(),seed=42).run([3,1])]
+        second=[planet.get_dict() for planet in MapGenerator(ids=generate_id(),seed=42).run([3,1])]
+        other=[planet.get_dict() for planet in MapGenerator(ids=generate_id(),seed=43).run([3,1])]
+        self.assertEqual(first,second,"same seed gave different maps")
+        self.assertNotEqual(first,other,"different seeds gave the same map")
+
+    def test_regenerate(self):
+        mg=MapGenerator(480,50,ids=generate_id(),mode=POISSON_MODE,max_planet_count=150)
+        planets=[planet.get_dict() for planet in mg.run([5,6,7])]
+        self.assertEqual(regenerate(mg.seed,[5,6,7],mg.params),planets,"regenerated map differs")
+
     #def test_check_same_count_of_planets_in_players_area(self):
     #    players_ids=[1,2,3,4,5,6,7,8]
     #    a=self.mg.run(players_ids)
@@ -0,0 +1,42 @@
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from map_generator import regenerate
+from map_pool import MapPool, generate_map
+import unittest
+import time
+
+
+class Test_case_MapPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool=MapPool(pool_size=1,workers=1,players=(2,))
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_generate_map(self):
+        seed,planets=generate_map(3,{})
+        self.assertEqual(planets.owners(),{1,2,3},"wrong placeholder owners")
+        self.assertEqual(sorted(planets.ids.tolist()),list(range(1,len(planets)+1)),"wrong planet ids")
+
+    def test_pop_ready_map(self):
+        self.pool.start()
+        deadline=time.monotonic()+30
+        while not self.pool.ready(2):
+            self.assertLess(time.monotonic(),deadline,"map wasnt generated")
+            time.sleep(0.05)
+
+        seed,planets=self.pool.pop([7,3])
+        self.assertEqual(planets.owners(),{7,3},"owners werent replaced")
+        self.assertEqual(regenerate(seed,[7,3],self.pool.params),[planet.get_dict() for planet in planets.values()],"seed doesnt regenerate the pooled map")
+        self.assertEqual((self.pool.generated,self.pool.missed),(1,0),"map wasnt taken from the pool")
+
+    def test_pop_without_stock(self):
+        seed,planets=self.pool.pop([4,5,6])
+        self.assertEqual(planets.owners(),{4,5,6},"owners werent replaced")
+        self.assertEqual((self.pool.generated,self.pool.missed),(0,1),"missing map wasnt counted")
+
+
+if __name__ == '__main__':
+    unittest.main()
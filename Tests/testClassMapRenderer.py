@@ -0,0 +1,58 @@
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from renderer import MapRenderer, RENDER_QUEUE_SIZE
+from planet import PlanetStore, PlanetType
+import unittest
+import subprocess
+import sys
+import tempfile
+
+
+class Test_case_MapRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.TemporaryDirectory()
+        self.planets=PlanetStore()
+        self.planets.add(1,0,0,PlanetType.BIGGEST,200)
+        self.planets.add(2,300,100,PlanetType.BIG,150,1)
+        self.planets.add(3,-300,-100,PlanetType.BIG,150,2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_renders_files(self):
+        for render_format, magic in (('png', b'\x89PNG'), ('svg', b'<?xml')):
+            renderer=MapRenderer(self.directory.name,render_format)
+            renderer.start()
+            renderer.submit('map',self.planets,120)
+            renderer.stop()
+            self.assertEqual(len(renderer.rendered),1,"map wasnt rendered")
+            with open(renderer.rendered[0],'rb') as rendered:
+                self.assertEqual(rendered.read(len(magic)),magic,"wrong {} file".format(render_format))
+
+    def test_queued_maps_render_on_stop(self):
+        renderer=MapRenderer(self.directory.name)
+        renderer.submit('map',self.planets,120)
+        renderer.start()
+        renderer.stop()
+        self.assertEqual(len(renderer.rendered),1,"queued map wasnt rendered on stop")
+
+    def test_full_queue_drops(self):
+        renderer=MapRenderer(self.directory.name)
+        for _ in range(RENDER_QUEUE_SIZE+3):
+            renderer.submit('map',self.planets,120)
+        self.assertEqual(renderer.dropped,3,"full queue didnt drop maps")
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            MapRenderer(self.directory.name,'gif')
+
+    def test_server_import_is_headless(self):
+        root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output=subprocess.check_output([sys.executable,'-c',"import sys, server; print('matplotlib' in sys.modules)"],cwd=root)
+        self.assertEqual(output.strip(),b'False',"server imports matplotlib")
+
+
+if __name__ == '__main__':
+    unittest.main()
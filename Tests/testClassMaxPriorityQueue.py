@@ -1,7 +1,8 @@
-from utils import MaxPriorityQueue, MaxPriorityItem
+from utils import MaxPriorityQueue, AsyncMaxPriorityQueue
+import asyncio
 import unittest
 import math
-from queue import PriorityQueue
+from queue import Empty, Full
 from threading import Thread, Event, Lock
 
 
@@ -17,7 +18,8 @@ class Test_case_MaxPriorityQueue(unittest.TestCase):
         self.c=MaxPriorityQueue()
 
     def test_right_init(self):
-        self.assertEqual(type(self.c._MaxPriorityQueue__queue),type(PriorityQueue()),"wrong priority queue init")
+        self.assertEqual(len(self.c),0,"wrong priority queue init")
+        self.assertEqual(self.c.closed,False,"new queue is closed")
 
     def test_queue_is_queue(self):
         self.c.insert(self.item1)
@@ -35,6 +37,20 @@ class Test_case_MaxPriorityQueue(unittest.TestCase):
         self.assertEqual(self.c.remove(),self.item2,"wrong second item")
         self.assertEqual(self.c.remove(),self.item1,"wrong third item")
 
+    def test_fifo_within_priority(self):
+        items=[(priority, number) for number in range(50) for priority in (self.priority1,self.priority2)]
+        for item in items:
+            self.c.insert(item,item[0])
+        self.assertEqual(self.c.drain(),sorted(items,key=lambda item: -item[0]),"items of a priority were reordered")
+
+    def test_fair(self):
+        self.c=MaxPriorityQueue(key=lambda item: item[0])
+        for item in ['a1','a2','a3','b1','c1','b2']:
+            self.c.insert(item)
+        self.c.insert('a0',self.priority1)
+        self.assertEqual(self.c.drain(),['a0','a1','b1','c1','a2','b2','a3'],"keys didnt take turns")
+        self.assertEqual(len(self.c),0,"wrong size after drain")
+
     def test_queue_empty(self):
         self.c.insert(self.item2,self.priority2)
         self.c.insert(self.item1,self.priority1)
@@ -46,6 +62,74 @@ class Test_case_MaxPriorityQueue(unittest.TestCase):
         self.c.remove()
         self.assertEqual(self.c.empty(),True,"wrong empty queue (0 elems)")
 
+    def test_get_timeout(self):
+        with self.assertRaises(Empty):
+            self.c.get(timeout=0.01)
+
+    def test_drain_priority_order(self):
+        self.c.insert(self.item1,self.priority1)
+        self.c.insert(self.item3,self.priority3)
+        self.c.insert(self.item2,self.priority2)
+        self.assertEqual(self.c.drain(),[self.item3,self.item2,self.item1],"wrong drain order")
+        self.assertEqual(self.c.empty(),True,"queue is not empty after drain")
+
+    def test_drain_max_items(self):
+        self.c.insert(self.item1,self.priority1)
+        self.c.insert(self.item2,self.priority2)
+        self.c.insert(self.item3,self.priority3)
+        self.assertEqual(self.c.drain(2),[self.item3,self.item2],"wrong drained items")
+        self.assertEqual(self.c.drain(2),[self.item1],"wrong rest of items")
+        self.assertEqual(self.c.drain(2),[],"drained items from empty queue")
+
+    def test_drain_waits_for_item(self):
+        thread=Thread(target=self.c.insert,args=(self.item1,))
+        thread.start()
+        self.assertEqual(self.c.drain(timeout=5),[self.item1],"drain didnt wait for item")
+        thread.join()
+
+    def test_close_wakes_consumer(self):
+        result=[]
+        thread=Thread(target=lambda: result.append(self.c.drain(timeout=10)))
+        thread.start()
+        self.c.close()
+        thread.join(5)
+        self.assertEqual(thread.is_alive(),False,"consumer wasnt woken")
+        self.assertEqual(result,[[]],"closed queue returned items")
+
+    def test_maxsize(self):
+        self.c=MaxPriorityQueue(2)
+        self.c.insert(self.item1,self.priority1)
+        self.c.insert(self.item2,self.priority2)
+        with self.assertRaises(Full):
+            self.c.insert(self.item3,self.priority3)
+        self.c.insert(self.item3,self.priority3,force=True)
+        self.assertEqual(self.c.drain(),[self.item3,self.item2,self.item1],"forced item wasnt queued")
+
+
+class Test_case_AsyncMaxPriorityQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.c=AsyncMaxPriorityQueue()
+
+    def test_get(self):
+        async def get():
+            asyncio.get_running_loop().call_soon(self.c.insert,10,1)
+            self.c.insert(20)
+            return [await self.c.get(), await self.c.get()]
+        self.assertEqual(asyncio.run(get()),[20,10],"wrong items")
+
+    def test_remove(self):
+        self.c.insert(10)
+        self.assertEqual(self.c.remove(),10,"wrong item")
+        with self.assertRaises(Empty):
+            self.c.remove()
+
+    def test_get_closed(self):
+        async def get():
+            self.c.close()
+            return await self.c.get()
+        with self.assertRaises(Empty):
+            asyncio.run(get())
 
 if __name__ == '__main__':
     unittest.main()
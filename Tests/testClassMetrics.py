@@ -0,0 +1,59 @@
+from metrics import Metrics, MetricsEndpoint
+import unittest
+import urllib.error
+import urllib.request
+
+
+class Test_case_Metrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics=Metrics(prefix='test_')
+
+    def test_counter(self):
+        self.metrics.counter('events_total','events')
+        self.metrics.inc('events_total',labels=(('event', 'move'),))
+        self.metrics.inc('events_total',2,labels=(('event', 'move'),))
+        self.assertEqual(self.metrics.value('events_total',(('event', 'move'),)),3,"wrong counter")
+        self.assertEqual(self.metrics.render().splitlines(),[
+            '# HELP test_events_total events',
+            '# TYPE test_events_total counter',
+            'test_events_total{event="move"} 3',
+        ],"wrong exposition")
+
+    def test_histogram(self):
+        self.metrics.histogram('latency_seconds','latency',(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            self.metrics.observe('latency_seconds',value)
+        self.assertEqual(self.metrics.render().splitlines()[2:],[
+            'test_latency_seconds_bucket{le="0.1"} 2',
+            'test_latency_seconds_bucket{le="1"} 3',
+            'test_latency_seconds_bucket{le="+Inf"} 4',
+            'test_latency_seconds_sum 3.65',
+            'test_latency_seconds_count 4',
+        ],"wrong buckets")
+
+    def test_gauge(self):
+        self.metrics.gauge('depth','depth',lambda: 5)
+        self.metrics.gauge('clients','clients',lambda: {(('client', 'a"b'),): 1})
+        lines=self.metrics.render().splitlines()
+        self.assertIn('test_depth 5',lines,"wrong gauge")
+        self.assertIn('test_clients{client="a\\"b"} 1',lines,"label wasnt escaped")
+        with self.assertRaises(ValueError):
+            self.metrics.gauge('depth','depth',lambda: 5)
+
+    def test_endpoint(self):
+        self.metrics.gauge('depth','depth',lambda: 5)
+        endpoint=MetricsEndpoint(self.metrics,0)
+        endpoint.start()
+        try:
+            url='http://{}:{}'.format(*endpoint.address)
+            with urllib.request.urlopen(url+'/metrics',timeout=5) as response:
+                self.assertIn('test_depth 5',response.read().decode('utf-8'),"gauge wasnt served")
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url+'/other',timeout=5)
+        finally:
+            endpoint.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from connection import OutboundBuffer
+import unittest
+import socket
+
+
+class Test_case_OutboundBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.writer, self.reader = socket.socketpair()
+        self.writer.setblocking(False)
+        self.buffer = OutboundBuffer()
+
+    def tearDown(self):
+        self.writer.close()
+        self.reader.close()
+
+    def read_all(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.reader.recv(size - len(data))
+        return data
+
+    def test_flush_coalesces_frames(self):
+        frames = [b'first', b'second', b'third']
+        for frame in frames:
+            self.buffer.append(frame)
+        self.assertEqual(len(self.buffer), sum(map(len, frames)), "wrong pending size")
+        self.assertEqual(self.buffer.flush(self.writer), 0, "frames left after flush")
+        self.assertEqual(self.read_all(sum(map(len, frames))), b''.join(frames), "wrong bytes sent")
+
+    def test_partial_write_is_kept(self):
+        frame = bytes(range(256)) * 4096
+        frames = [frame] * 8
+        for frame in frames:
+            self.buffer.append(frame)
+
+        pending = self.buffer.flush(self.writer)
+        self.assertEqual(pending > 0, True, "socket buffer should be full")
+
+        received = b''
+        total = sum(map(len, frames))
+        while len(received) < total:
+            received += self.reader.recv(65536)
+            pending = self.buffer.flush(self.writer)
+
+        self.assertEqual(pending, 0, "frames left after flush")
+        self.assertEqual(received, b''.join(frames), "frames were truncated or reordered")
+
+
+if __name__ == '__main__':
+    unittest.main()
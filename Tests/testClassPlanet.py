@@ -1,5 +1,5 @@
 from planet import Planet, PlanetType
-from utils import Coord
+from utils import Coords
 import unittest
 
 
@@ -8,18 +8,25 @@ class Test_case_Planet(unittest.TestCase):
     def setUp(self):
         self.coords=Coords(5,10)
         self.planet_type=PlanetType.SMALL
-        self.owner="owner"
+        self.owner=7
         self.p=Planet(self.coords,self.planet_type,self.owner)
 
     def test_right_init(self):
-        self.assertEqual(self.p.coords,self.coords,"wrong coord init")
-        self.assertEqual(self.p.type,self.type,"wrong type init")
+        self.assertEqual(self.p.coords.get_coord(),self.coords.get_coord(),"wrong coord init")
+        self.assertEqual(self.p.type,self.planet_type,"wrong type init")
         self.assertEqual(self.p.units_count,self.planet_type.value*50,"wrong count of units init")
         self.assertEqual(self.p.owner,self.owner,"wrong owner init")
 
     def test_get_dict(self):
-        self.assertEqual(p.get_dict(), {'type': self.type, 'units_count': self.planet_type.value*50, 'owner': self.owner,'coords': self.coords.get_dict(), 'id': self.p.__id}, "wrong dictionary")
+        self.assertEqual(self.p.get_dict(), {'type': self.planet_type, 'units_count': self.planet_type.value*50, 'owner': self.owner,'coords': self.coords.get_dict(), 'id': self.p.id}, "wrong dictionary")
 
+    def test_registered_in_cache(self):
+        self.assertEqual(Planet.cache[self.p.id],self.p,"planet isnt in cache")
+
+    def test_coords_view_writes_back(self):
+        self.p.coords.x=42
+        self.assertEqual(self.p.coords.x,42,"coords change lost")
+        self.assertEqual(self.p.coords.calc_distance(Coords(42,10)),0,"wrong distance from view")
 
 
 if __name__ == '__main__':
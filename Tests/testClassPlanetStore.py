@@ -0,0 +1,56 @@
+from planet import PlanetStore, PlanetType, Planet
+from utils import Coords
+import unittest
+
+
+class Test_case_PlanetStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store=PlanetStore(capacity=2)
+        self.store.add(10,0,0,PlanetType.BIGGEST,200)
+        self.store.add(11,5,5,PlanetType.BIG,150,1)
+        self.store.add(12,-5,5,PlanetType.BIG,150,2)
+        self.store.add(13,1,2,PlanetType.SMALL,50,1)
+
+    def test_grows(self):
+        self.assertEqual(len(self.store),4,"wrong planets count")
+        self.assertEqual(self.store.ids.tolist(),[10,11,12,13],"wrong ids column")
+
+    def test_view(self):
+        planet=self.store[13]
+        self.assertEqual(planet.get_dict(),{'type': PlanetType.SMALL, 'units_count': 50, 'owner': 1, 'coords': {'x': 1, 'y': 2}, 'id': 13},"wrong planet view")
+        planet.units_count-=20
+        planet.owner=None
+        self.assertEqual(self.store.units_count.tolist(),[200,150,150,30],"view didnt write units")
+        self.assertEqual(self.store[13].owner,None,"view didnt write owner")
+
+    def test_dicts(self):
+        dicts=self.store.dicts()
+        self.assertEqual(dicts,[planet.get_dict() for planet in self.store.values()],"dicts differ from the views")
+        self.assertEqual([type(planet['type']) for planet in dicts],[PlanetType]*4,"wrong type of the planet type")
+
+    def test_unknown_planet(self):
+        with self.assertRaises(KeyError):
+            self.store[99]
+        with self.assertRaises(ValueError):
+            self.store.add(10,0,0,PlanetType.SMALL,50)
+
+    def test_queries(self):
+        self.assertEqual(self.store.owned_by(1).tolist(),[11,13],"wrong owned planets")
+        self.assertEqual(self.store.owners(),{1,2},"wrong owners")
+        self.assertEqual(self.store.units_per_owner(),{1: 200, 2: 150},"wrong units per owner")
+        self.assertEqual(self.store.planets_per_owner(),{1: 2, 2: 1},"wrong planets per owner")
+        self.assertEqual(self.store.owns(2),True,"owner not found")
+        self.store[12].owner=1
+        self.assertEqual(self.store.owns(2),False,"player still owns a planet")
+        self.store.replace_owners({1: 2, 2: 1})
+        self.assertEqual(self.store.owner.tolist(),[-1,2,2,2],"wrong replaced owners")
+
+    def test_from_planets(self):
+        planets=[Planet(Coords(1,2),PlanetType.MEDIUM,3,planet_id=1),Planet(Coords(3,4),PlanetType.SMALL,planet_id=2)]
+        store=PlanetStore.from_planets(planets)
+        self.assertEqual([planet.get_dict() for planet in store.values()],[planet.get_dict() for planet in planets],"planets changed when copied")
+
+
+if __name__ == '__main__':
+    unittest.main()
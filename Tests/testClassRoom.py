@@ -0,0 +1,171 @@
+from room import Room, KEYFRAME_INTERVAL
+from map_generator import regenerate
+from utils import MaxPriorityQueue
+import unittest
+
+
+class FakeClient(object):
+
+    def __init__(self, address):
+        self.address=address
+
+
+class Test_case_Room(unittest.TestCase):
+
+    def setUp(self):
+        self.queue=MaxPriorityQueue()
+        self.room=Room(1,self.queue,check_counters=True)
+        self.first=FakeClient(('127.0.0.1', 1))
+        self.second=FakeClient(('127.0.0.1', 2))
+        self.room.join(self.first)
+        self.room.join(self.second)
+
+    def events(self):
+        return [message for message, room, clients in self.queue.drain()]
+
+    def snapshots(self):
+        return {tuple(clients): message for message, room, clients in self.queue.drain()
+                if message['name'] == 'snapshot'}
+
+    def start_game(self, *clients):
+        clients=clients or (self.first, self.second)
+        for client in clients:
+            self.room.handle_event({'name': 'ready', 'ready': True}, client)
+        for client in clients:
+            self.room.handle_event({'name': 'rendered'}, client)
+        game_map=next(event['map'] for event in self.events() if event['name'] == 'mapinit')
+        return {planet['owner']: planet for planet in game_map if planet['owner'] is not None}
+
+    def select(self, client, planet):
+        self.room.handle_event({'name': 'select', 'from': [planet['id']], 'percentage': 50}, client)
+        return next(event for event in self.events() if event['name'] == 'select')['selected'][planet['id']]
+
+    def test_counters_after_start(self):
+        homes=self.start_game()
+        self.assertEqual(self.room.planets_owned(1),1,"wrong planets count")
+        self.assertEqual(self.room.planets_owned(2),1,"wrong planets count")
+        self.assertEqual(self.room.active_players,frozenset(),"players without units are active")
+        self.select(self.first,homes[1])
+        self.assertEqual(self.room.active_players,{1},"selecting units didnt activate the player")
+
+    def test_capture_ends_game(self):
+        homes=self.start_game()
+        start,count=self.select(self.first,homes[1])
+        self.select(self.second,homes[2])
+        self.assertEqual(self.room.active_players,{1, 2},"wrong active players")
+
+        self.room.handle_event({'name': 'damage', 'planet_id': homes[2]['id'], 'unit_id': start, 'hp_count': 1}, self.first)
+        self.assertEqual(self.room.finished,False,"game over before capture")
+
+        self.room.handle_event({'name': 'damage', 'planet_id': homes[2]['id'], 'unit_id': start + 1, 'hp_count': 1000}, self.first)
+        self.assertEqual(self.room.planets_owned(1),2,"captured planet not counted")
+        self.assertEqual(self.room.planets_owned(2),0,"lost planet still counted")
+        self.assertEqual(self.room.active_players,{1},"wrong active players")
+        gameover=[event for event in self.events() if event['name'] == 'gameover']
+        self.assertEqual(gameover,[{'name': 'gameover', 'winner': 1}],"wrong game over")
+        self.assertEqual(self.room.finished,True,"room not finished")
+
+    def test_verify_counters(self):
+        homes=self.start_game()
+        self.room.planets[homes[2]['id']].owner=1
+        with self.assertRaises(RuntimeError):
+            self.room.verify_counters()
+
+    def test_snapshots(self):
+        room=Room(2,self.queue,state_sync=True)
+        self.room=room
+        room.join(self.first)
+        room.join(self.second)
+        homes=self.start_game()
+        self.events()
+
+        room.tick()
+        self.assertEqual(self.events(),[],"snapshot without changes")
+
+        self.select(self.first,homes[1])
+        room.tick()
+        home=room.planets[homes[1]['id']]
+        self.assertEqual(self.snapshots(),{(self.first, self.second): {'name': 'snapshot', 'id': 1, 'base': 0, 'planets': [[home.id, home.units_count, 1]]}},"wrong first delta")
+
+        room.handle_event({'name': 'ack', 'snapshot': 1},self.first)
+        room.handle_event({'name': 'add_hp', 'planet_id': homes[2]['id'], 'hp_count': 5},self.second)
+        self.assertEqual(self.events(),[],"add_hp was sent before the snapshot")
+        room.tick()
+        other=room.planets[homes[2]['id']]
+        self.assertEqual(self.snapshots(),{
+            (self.first,): {'name': 'snapshot', 'id': 2, 'base': 1, 'planets': [[other.id, other.units_count, 2]]},
+            (self.second,): {'name': 'snapshot', 'id': 2, 'base': 0, 'planets': [[home.id, home.units_count, 1], [other.id, other.units_count, 2]]},
+        },"wrong deltas for different acks")
+
+    def test_keyframe(self):
+        room=Room(2,self.queue,state_sync=True)
+        self.room=room
+        room.join(self.first)
+        room.join(self.second)
+        homes=self.start_game()
+        for snapshot in range(1,KEYFRAME_INTERVAL+1):
+            room.handle_event({'name': 'add_hp', 'planet_id': homes[1]['id'], 'hp_count': 1},self.first)
+            room.handle_event({'name': 'ack', 'snapshot': snapshot-1},self.first)
+            self.events()
+            room.tick()
+        snapshots=self.snapshots()
+        self.assertEqual(set(snapshots),{(self.first, self.second)},"keyframe wasnt sent to everybody")
+        keyframe=snapshots[(self.first, self.second)]
+        self.assertEqual((keyframe['id'],keyframe.get('keyframe')),(KEYFRAME_INTERVAL,True),"wrong keyframe")
+        self.assertEqual(len(keyframe['planets']),len(room.planets),"keyframe isnt full")
+
+    def batch_room(self):
+        self.room=Room(2,self.queue,check_counters=True,batch_damage=True)
+        self.third=FakeClient(('127.0.0.1', 3))
+        clients=(self.first, self.second, self.third)
+        for client in clients:
+            self.room.join(client)
+        homes=self.start_game(*clients)
+        return homes, [self.select(client, homes[player_id]) for player_id, client in enumerate(clients, 1)]
+
+    def test_batched_damage_tie(self):
+        homes, units=self.batch_room()
+        neutral=next(planet for planet in self.room.planets.values() if planet.owner is None)
+        hp=neutral.units_count
+
+        self.room.handle_event({'name': 'damage', 'planet_id': neutral.id, 'unit_id': units[1][0], 'hp_count': hp},self.second)
+        self.room.handle_event({'name': 'damage', 'planet_id': neutral.id, 'unit_id': units[0][0], 'hp_count': hp},self.first)
+        self.room.handle_event({'name': 'damage', 'planet_id': neutral.id, 'unit_id': units[0][0], 'hp_count': hp},self.first)
+        self.assertEqual((neutral.units_count,neutral.owner),(hp,None),"damage resolved before the tick")
+        self.assertEqual(self.events(),[],"damage sent before the tick")
+
+        self.room.tick()
+        self.assertEqual(self.events(),[{'name': 'damages', 'units': sorted([units[0][0], units[1][0]]), 'planets': [[neutral.id, hp, 1]]}],"tie didnt go to the lowest player id")
+        self.assertEqual(self.room.planets_owned(1),2,"captured planet not counted")
+
+    def test_batched_damage_strongest_attacker(self):
+        homes, units=self.batch_room()
+        target=self.room.planets[homes[3]['id']]
+        hp=target.units_count
+
+        self.room.handle_event({'name': 'damage', 'planet_id': target.id, 'unit_id': units[0][0], 'hp_count': hp},self.first)
+        self.room.handle_event({'name': 'damage', 'planet_id': target.id, 'unit_id': units[1][0], 'hp_count': hp + 10},self.second)
+        self.room.handle_event({'name': 'damage', 'planet_id': target.id, 'unit_id': units[2][0], 'hp_count': 4},self.third)
+        self.room.tick()
+        self.assertEqual(self.events()[0]['planets'],[[target.id, hp + 6, 2]],"strongest attacker didnt take the planet")
+
+    def test_ready_twice(self):
+        self.room=Room(2,self.queue,seed_mapinit=True)
+        self.room.join(self.first)
+        self.room.join(self.second)
+        for client in (self.first, self.second, self.first):
+            self.room.handle_event({'name': 'ready', 'ready': True}, client)
+        mapinits=[event for event in self.events() if event['name'] == 'mapinit']
+        self.assertEqual(len(mapinits),1,"ready after the mapinit made another map")
+        game_map=regenerate(mapinits[0]['seed'],mapinits[0]['players'],mapinits[0]['params'])
+        self.assertEqual(game_map,[planet.get_dict() for planet in self.room.planets.values()],"seed doesnt give the room's map")
+
+    def test_leave(self):
+        homes=self.start_game()
+        self.select(self.first,homes[1])
+        self.room.leave(self.first)
+        self.assertEqual(self.room.active_players,frozenset(),"left player is active")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,466 @@
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from server import Server, ASYNCIO_ENGINE, THREADS_ENGINE
+from map_generator import regenerate
+from replay import replay
+from protocol import encode_event, decode_event, frame_header, hello, BINARY_ENCODING, JSON_ENCODING
+import unittest
+import json
+import socket
+import tempfile
+import time
+import urllib.request
+
+
+class TestClient(object):
+    def __init__(self, address):
+        self.sock = socket.create_connection(address, timeout=5)
+        self.encoding = JSON_ENCODING
+
+    def send(self, event):
+        self.sock.sendall(encode_event(event, self.encoding))
+
+    def recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('server closed connection')
+            data += chunk
+        return data
+
+    def recv(self):
+        header = frame_header(self.encoding)
+        data_size = header.unpack(self.recv_exactly(header.size))[0]
+        event = decode_event(self.recv_exactly(data_size), self.encoding)
+        if event['name'] == 'hello' and 'encoding' in event:
+            self.encoding = event['encoding']
+        return event
+
+    def recv_until(self, name):
+        while True:
+            event = self.recv()
+            if event['name'] == name:
+                return event
+
+    def close(self):
+        self.sock.close()
+
+
+class Test_case_Server(unittest.TestCase):
+    engine = ASYNCIO_ENGINE
+
+    def setUp(self):
+        self.start_server()
+
+    def tearDown(self):
+        self.stop_server()
+
+    def start_server(self, **kwargs):
+        self.server = Server(port=0, engine=self.engine, **kwargs)
+        self.server.start()
+        self.address = self.server.server.getsockname()
+        self.clients = []
+
+    def stop_server(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+        self.server.server.close()
+
+    def connect(self, encoding=JSON_ENCODING):
+        client = TestClient(self.address)
+        self.clients.append(client)
+        self.assertEqual(client.recv()['name'], 'hello', "hello isnt the first frame")
+        if encoding != JSON_ENCODING:
+            client.send(hello(encoding))
+
+        client.id = None
+        while client.id is None or client.encoding != encoding:
+            event = client.recv()
+            if event['name'] == 'connect' and client.id is None:
+                client.id = event['player']['id']
+        return client
+
+    def start_game(self, *clients):
+        for client in clients:
+            client.send({'name': 'ready', 'ready': True})
+        mapinit = [client.recv_until('mapinit') for client in clients][0]
+        for client in clients:
+            client.send({'name': 'rendered'})
+        for client in clients:
+            client.recv_until('game_started')
+        return mapinit['map']
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            Server(port=0, engine='fibers')
+
+    def test_game_start(self):
+        first = self.connect()
+        second = self.connect()
+
+        first.send({'name': 'ready', 'ready': True})
+        second.send({'name': 'ready', 'ready': True})
+
+        mapinit = first.recv_until('mapinit')
+        self.assertEqual(mapinit, second.recv_until('mapinit'), "players got different maps")
+        owners = {planet['owner'] for planet in mapinit['map']} - {None}
+        self.assertEqual(len(owners), 2, "every player should own a start planet")
+
+        first.send({'name': 'rendered'})
+        second.send({'name': 'rendered'})
+
+        self.assertEqual(first.recv_until('game_started'), {'name': 'game_started'})
+        self.assertEqual(second.recv_until('game_started'), {'name': 'game_started'})
+
+    def test_nodelay(self):
+        self.connect()
+        sock = self.server.clients[0].sock
+        self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), "small frames wait for acks")
+
+    def test_game_start_with_map_pool(self):
+        self.stop_server()
+        self.start_server(map_pool_size=1)
+
+        first = self.connect()
+        second = self.connect()
+        game_map = self.start_game(first, second)
+        owners = {planet['owner'] for planet in game_map} - {None}
+        self.assertEqual(owners, {first.id, second.id}, "pooled map wasnt given to the players")
+
+    def test_seed_mapinit(self):
+        self.stop_server()
+        self.start_server(seed_mapinit=True)
+
+        first = self.connect()
+        second = self.connect()
+        first.send({'name': 'ready', 'ready': True})
+        second.send({'name': 'ready', 'ready': True})
+
+        mapinit = first.recv_until('mapinit')
+        self.assertEqual(set(mapinit), {'name', 'seed', 'players', 'params'}, "mapinit carries the planets")
+        self.assertEqual(mapinit['players'], [first.id, second.id], "wrong players")
+        game_map = regenerate(mapinit['seed'], mapinit['players'], mapinit['params'])
+        owners = {planet['owner'] for planet in game_map} - {None}
+        self.assertEqual(owners, {first.id, second.id}, "regenerated map doesnt belong to the players")
+        room = next(iter(self.server.rooms.values()))
+        self.assertEqual(game_map, [planet.get_dict() for planet in room.planets.values()],
+                         "regenerated map differs from the server's")
+
+    def test_binary_client(self):
+        binary = self.connect(BINARY_ENCODING)
+        plain = self.connect()
+        game_map = self.start_game(binary, plain)
+
+        home = next(planet for planet in game_map if planet['owner'] == binary.id)
+        binary.send({'name': 'select', 'from': [home['id']], 'percentage': 50})
+        selected = binary.recv_until('select')['selected']
+        start, count = selected[home['id']]
+        self.assertEqual(count, round(home['units_count'] / 2), "wrong selected units count")
+        self.assertEqual(plain.recv_until('select')['selected'], {str(home['id']): [start, count]},
+                         "json and binary clients got different selections")
+
+        move = {'name': 'move', 'unit_id': start + count - 1, 'x': 10.5, 'y': 20.0}
+        binary.send(move)
+        self.assertEqual(binary.recv_until('move'), move, "wrong binary move")
+        self.assertEqual(plain.recv_until('move'), move, "wrong json move")
+
+    def test_moves_coalesced_per_tick(self):
+        self.stop_server()
+        self.start_server(tick_rate=5)
+
+        first = self.connect(BINARY_ENCODING)
+        second = self.connect()
+        game_map = self.start_game(first, second)
+
+        home = next(planet for planet in game_map if planet['owner'] == first.id)
+        first.send({'name': 'select', 'from': [home['id']], 'percentage': 50})
+        start, _ = first.recv_until('select')['selected'][home['id']]
+        units = [start, start + 1]
+
+        moves = []
+        for step in range(3):
+            step_moves = [{'name': 'move', 'unit_id': unit_id, 'x': float(step), 'y': 0.0} for unit_id in units]
+            first.sock.sendall(b''.join(encode_event(move, first.encoding) for move in step_moves))
+            moves += step_moves
+            time.sleep(0.01)
+
+        expected = {move['unit_id']: move for move in moves}
+        received = {}
+        broadcast_count = 0
+        while received != expected:
+            frame = second.recv_until('moves')['moves']
+            self.assertEqual(len(frame), len({move['unit_id'] for move in frame}), "unit moved twice in a tick")
+            broadcast_count += len(frame)
+            for move in frame:
+                # moves of a unit are handled in the order they were sent, a tick never goes back
+                self.assertGreaterEqual(move['x'], received.get(move['unit_id'], move)['x'], "move went back")
+                received[move['unit_id']] = move
+        self.assertLess(broadcast_count, len(moves), "moves werent coalesced")
+
+    def test_wrong_tick_rate(self):
+        with self.assertRaises(ValueError):
+            Server(port=0, tick_rate=0)
+
+    def test_state_sync(self):
+        with self.assertRaises(ValueError):
+            Server(port=0, state_sync=True)
+        with self.assertRaises(ValueError):
+            Server(port=0, batch_damage=True)
+
+        self.stop_server()
+        self.start_server(tick_rate=50, state_sync=True)
+
+        binary = self.connect(BINARY_ENCODING)
+        plain = self.connect()
+        game_map = self.start_game(binary, plain)
+
+        home = next(planet for planet in game_map if planet['owner'] == binary.id)
+        binary.send({'name': 'add_hp', 'planet_id': home['id'], 'hp_count': 5})
+        expected = {'name': 'snapshot', 'id': 1, 'base': 0, 'planets': [[home['id'], home['units_count'] + 5, binary.id]]}
+        self.assertEqual(binary.recv_until('snapshot'), expected, "wrong binary snapshot")
+        self.assertEqual(plain.recv_until('snapshot'), expected, "wrong json snapshot")
+
+    def test_rooms_are_isolated(self):
+        self.stop_server()
+        self.start_server(max_client_count=2)
+
+        first_room = [self.connect(), self.connect()]
+        second_room = [self.connect(), self.connect()]
+        self.assertEqual([client.id for client in first_room + second_room], [1, 2, 1, 2], "wrong player ids")
+        self.assertEqual(len(self.server.rooms), 2, "wrong rooms count")
+
+        first_map = self.start_game(*first_room)
+        for client in second_room:
+            client.send({'name': 'ready', 'ready': True})
+        events = [second_room[0].recv() for _ in range(4)]
+        self.assertEqual([event['name'] for event in events], ['connect', 'ready', 'ready', 'mapinit'],
+                         "events leaked between rooms")
+        self.assertNotEqual(events[-1]['map'], first_map, "rooms share a map")
+
+        first_room[0].close()
+        self.clients.remove(first_room[0])
+        self.assertEqual(self.connect().id, 1, "started room accepted a player")
+        self.assertEqual(len(self.server.rooms), 3, "new client should open a new room")
+
+    def test_bad_event_doesnt_stop_rooms(self):
+        self.stop_server()
+        self.start_server(max_client_count=2)
+
+        first_room = [self.connect(), self.connect()]
+        second_room = [self.connect(), self.connect()]
+        self.start_game(*first_room)
+        for event in ({'name': 'damage', 'planet_id': 99999, 'unit_id': 1}, {'name': 'move'},
+                      {'name': 'ack'}, {'name': 'select', 'from': 3, 'percentage': 50}):
+            first_room[0].send(event)
+        self.start_game(*second_room)
+
+        first_room[0].send({'name': 'select', 'from': [], 'percentage': 50})
+        self.assertEqual(first_room[1].recv_until('select')['selected'], {}, "first room stopped")
+        self.assertEqual(self.server.metrics.value('rejected_events_total', (('event', 'damage'),)), 1,
+                         "bad damage wasnt counted")
+
+    def test_max_rooms(self):
+        self.stop_server()
+        self.start_server(max_client_count=1, max_rooms=1)
+
+        self.connect()
+        client = TestClient(self.address)
+        self.clients.append(client)
+        self.assertEqual(client.recv()['name'], 'hello', "hello isnt the first frame")
+        self.assertEqual(client.recv()['name'], 'server_full', "full server accepted a player")
+
+    def test_not_an_event(self):
+        for payload in (b'[1,2]', b'{}'):
+            client = self.connect()
+            client.sock.sendall(frame_header(JSON_ENCODING).pack(len(payload)) + payload)
+            with self.assertRaises(ConnectionError):
+                client.recv_until('never')
+
+        first = self.connect()
+        second = self.connect()
+        self.start_game(first, second)
+        self.assertEqual(len(self.server.clients), 2, "broken clients werent disconnected")
+
+    def test_metrics(self):
+        self.stop_server()
+        self.start_server(metrics_port=0)
+
+        first = self.connect()
+        second = self.connect()
+        self.start_game(first, second)
+        first.send({'name': 'move', 'unit_id': 1, 'x': 0, 'y': 0})
+        first.send({'name': 'nonsense'})
+        first.send({'name': 'select', 'from': [], 'percentage': 50})
+        first.recv_until('select')
+
+        host, port = self.server.metrics_endpoint.address
+        with urllib.request.urlopen('http://{}:{}/metrics'.format(host, port), timeout=5) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'), "wrong content type")
+            lines = response.read().decode('utf-8').splitlines()
+
+        self.assertIn('servachok_events_total{event="move"} 1', lines, "move wasnt counted")
+        self.assertIn('servachok_events_total{event="other"} 1', lines, "unknown event wasnt counted as other")
+        self.assertIn('servachok_handler_seconds_count{event="join"} 2', lines, "joins werent timed")
+        self.assertIn('servachok_map_generation_seconds_count 1', lines, "map generation wasnt timed")
+        self.assertIn('servachok_clients 2', lines, "wrong clients gauge")
+        self.assertIn('# TYPE servachok_handler_queue_depth gauge', lines, "no handler queue gauge")
+        received = {line.split(' ')[0]: int(line.split(' ')[1]) for line in lines
+                    if line.startswith('servachok_client_received_frames{')}
+        self.assertEqual(sorted(received.values()), [2, 5], "wrong frames per client")
+
+    def test_trace_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            self.stop_server()
+            self.start_server(trace_sample_rate=1, trace_file=path)
+
+            first = self.connect()
+            second = self.connect()
+            self.start_game(first, second)
+            first.send({'name': 'select', 'from': [], 'percentage': 50})
+            second.recv_until('select')
+            # the trace file is written when the server stops
+            self.stop_server()
+            self.start_server()
+
+            with open(path) as trace_file:
+                events = json.load(trace_file)['traceEvents']
+
+        select = next(event['tid'] for event in events if event['name'] == 'select')
+        self.assertEqual([event['name'] for event in events if event['tid'] == select],
+                         ['select', 'decode', 'handler_queue', 'handle', 'sender_queue', 'send'],
+                         "select wasnt traced to the socket")
+
+    def test_journal_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.stop_server()
+            self.start_server(journal_dir=directory, tick_rate=50)
+
+            first = self.connect()
+            second = self.connect()
+            homes = {planet['owner']: planet['id'] for planet in self.start_game(first, second)}
+            first.send({'name': 'select', 'from': [homes[first.id]], 'percentage': 50})
+            start, count = first.recv_until('select')['selected'][str(homes[first.id])]
+            first.send({'name': 'move', 'unit_id': start, 'x': 10, 'y': 20})
+            first.send({'name': 'damage', 'planet_id': homes[first.id], 'unit_id': start, 'hp_count': 1})
+            second.recv_until('damage')
+            # the journal is complete once the room is gone
+            self.stop_server()
+            self.start_server()
+
+            paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+            self.assertEqual(len(paths), 1, "wrong journal files")
+            stats = replay(paths[0])
+
+        self.assertEqual(stats['events'], 7, "wrong replayed events")
+        self.assertGreater(stats['broadcasts'], 0, "broadcasts werent journaled")
+        self.assertEqual((stats['missing'], stats['unexpected']), (0, 0), "replay desynced")
+
+
+class Test_case_Server_threads(Test_case_Server):
+    engine = THREADS_ENGINE
+
+
+class Test_case_Server_overload(unittest.TestCase):
+    # the server isn't started, what it dispatches stays in the handler queue
+
+    def start_server(self, **kwargs):
+        self.server = Server(port=None, **kwargs)
+        self.sock, self.peer = socket.socketpair()
+        self.client = self.server._Server__connect(self.sock, ('pair', 1))
+        self.queue = self.server._Server__handler_queue
+
+    def tearDown(self):
+        self.server.stop()
+        self.sock.close()
+        self.peer.close()
+
+    def dispatch(self, *events):
+        for event in events:
+            self.server._Server__dispatch(event, self.client)
+
+    def shed(self, policy, event):
+        return self.server.metrics.value('shed_events_total', (('policy', policy), ('event', event)))
+
+    def join(self):
+        for event, client in self.queue.drain():
+            self.server.handle_event(event, client)
+        return self.client.room
+
+    def test_rate_limit(self):
+        self.start_server(client_rate=0.001, client_burst=2)
+        self.dispatch(hello(BINARY_ENCODING), *[{'name': 'select', 'from': [], 'percentage': 50}] * 3)
+        self.assertEqual(self.client.encoding, BINARY_ENCODING, "hello was rate limited")
+        self.assertEqual(self.shed('rate_limit', 'select'), 1, "wrong rate limited events")
+        self.assertEqual(len(self.queue), 3, "wrong queued events")
+
+    def test_queue_full(self):
+        self.start_server(handler_queue_size=2, supersede_moves=True)
+        self.dispatch({'name': 'select', 'from': [], 'percentage': 50}, {'name': 'move', 'unit_id': 1, 'x': 0, 'y': 0})
+        self.assertEqual(self.shed('queue_full', 'move'), 1, "move got into a full queue")
+        self.assertEqual(self.server._Server__pending_moves, {}, "shed move is pending")
+        self.server._Server__disconnect(self.client)
+        self.assertEqual(len(self.queue), 3, "leave was shed")
+
+    def test_fair_queue(self):
+        self.start_server(fair_queue=True)
+        sock, peer = socket.socketpair()
+        self.addCleanup(sock.close)
+        self.addCleanup(peer.close)
+        other = self.server._Server__connect(sock, ('pair', 2))
+        self.join()
+        self.dispatch(*[{'name': 'select', 'from': [], 'percentage': percentage} for percentage in (1, 2, 3)])
+        self.server._Server__dispatch({'name': 'select', 'from': [], 'percentage': 4}, other)
+        self.assertEqual([(client is other, event['percentage']) for event, client in self.queue.drain()],
+                         [(False, 1), (True, 4), (False, 2), (False, 3)], "clients didnt take turns")
+
+    def test_superseded_moves(self):
+        self.start_server(supersede_moves=True)
+        self.join()
+        moves = ((1, 0), (1, 1), (2, 0), (1, 2))
+        self.dispatch(*[{'name': 'move', 'unit_id': unit_id, 'x': x, 'y': 0} for unit_id, x in moves])
+        self.assertEqual(self.shed('superseded', 'move'), 2, "wrong superseded moves")
+
+        queued = sorted((event for event, _ in self.queue.drain()), key=lambda event: event['unit_id'])
+        latest = [self.server._Server__latest_move(event, self.client) for event in queued]
+        self.assertEqual([(event['unit_id'], event['x']) for event in latest], [(1, 2), (2, 0)], "wrong latest moves")
+        self.assertEqual(self.server._Server__pending_moves, {}, "handled moves are still pending")
+
+    def test_slow_consumer_downgrade(self):
+        self.start_server(max_outbound=100, slow_consumer='downgrade')
+        room = self.join()
+        broadcast = self.server._Server__broadcast
+        self.client.outbound.append(bytes(200))
+
+        broadcast({'name': 'moves', 'moves': []}, room)
+        self.assertEqual(len(self.client.outbound), 200, "move was sent to a slow client")
+        self.assertEqual(self.server.metrics.value('shed_messages_total', (('message', 'moves'),)), 1,
+                         "move wasnt counted")
+        broadcast({'name': 'select', 'selected': {}}, room)
+        self.assertGreater(len(self.client.outbound), 200, "select wasnt sent to a slow client")
+
+        self.client.outbound.append(bytes(400))
+        broadcast({'name': 'moves', 'moves': []}, room)
+        self.assertEqual((self.client.slow, self.client.closing, len(self.client.outbound)), (True, True, 0),
+                         "client past the hard limit wasnt dropped")
+        broadcast({'name': 'select', 'selected': {}}, room)
+        self.assertEqual(len(self.client.outbound), 0, "dropped client got a frame")
+        self.assertEqual(self.server.metrics.value('slow_consumers_total'), 1, "drop wasnt counted")
+
+    def test_slow_consumer_disconnect(self):
+        with self.assertRaises(ValueError):
+            Server(port=None, slow_consumer='ignore')
+
+        self.start_server(max_outbound=100)
+        room = self.join()
+        self.client.outbound.append(bytes(200))
+        self.server._Server__broadcast({'name': 'select', 'selected': {}}, room)
+        self.assertEqual((self.client.slow, len(self.client.outbound)), (True, 0), "slow client wasnt dropped")
+        self.assertEqual(self.server.metrics.value('slow_consumers_total'), 1, "drop wasnt counted")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+from map_generator import SpatialGrid, MapGenerator
+import unittest
+
+
+class Test_case_SpatialGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.grid=SpatialGrid(10,100,50)
+        self.grid.add(0,0)
+        self.grid.add(25,-3)
+
+    def test_is_free(self):
+        self.assertEqual(self.grid.is_free(9,0),False,"close point not found")
+        self.assertEqual(self.grid.is_free(-8,-8),True,"far point found")
+        self.assertEqual(self.grid.is_free(19.5,1),False,"point two cells away not found")
+        self.assertEqual(self.grid.is_free(10,0),True,"distance limit is inclusive")
+        self.assertEqual(len(self.grid),2,"wrong points count")
+
+    def test_free_batch(self):
+        self.assertEqual(self.grid.free([9,-8,60,-60],[0,-8,30,-30]).tolist(),[False,True,True,True],"wrong batch mask")
+
+    def test_add_too_close(self):
+        with self.assertRaises(ValueError):
+            self.grid.add(1,1)
+
+    def test_generated_planets_are_separated(self):
+        mg=MapGenerator(planet_free_space_radius=40)
+        planets=mg.run([1,2,3,4])
+        for i, planet in enumerate(planets):
+            for other in planets[i+1:]:
+                self.assertEqual(planet.coords.calc_distance(other.coords)>=80,True,"planets overlap")
+        self.assertEqual(len({planet.id for planet in planets}),len(planets),"rejected planets got ids")
+
+
+if __name__ == '__main__':
+    unittest.main()
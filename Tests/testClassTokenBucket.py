@@ -0,0 +1,27 @@
+from utils import TokenBucket
+import unittest
+
+
+class Test_case_TokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.now=0.0
+        self.c=TokenBucket(10,burst=3,clock=lambda: self.now)
+
+    def test_burst(self):
+        self.assertEqual([self.c.take() for _ in range(4)],[True,True,True,False],"wrong burst")
+
+    def test_refill(self):
+        for _ in range(3):
+            self.c.take()
+        self.now=0.15
+        self.assertEqual([self.c.take() for _ in range(2)],[True,False],"wrong refill")
+        self.now=10.0
+        self.assertEqual([self.c.take() for _ in range(4)],[True,True,True,False],"refilled over the burst")
+
+    def test_default_burst(self):
+        self.assertEqual(TokenBucket(5).burst,5,"burst isnt the rate")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+from metrics import Metrics
+from tracing import Tracer, TracedQueue, DECODE, HANDLER_QUEUE, HANDLE, SENDER_QUEUE, SEND
+from utils import MaxPriorityQueue
+from threading import Thread
+import time
+import unittest
+
+
+class Test_case_Tracer(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics=Metrics()
+        self.tracer=Tracer(1,slowest=2,metrics=self.metrics)
+        self.queue=MaxPriorityQueue()
+        self.room_queue=TracedQueue(self.queue,self.tracer)
+
+    def trace(self, event, messages=1):
+        self.tracer.sample(event,time.monotonic_ns(),(('event', event['name']),))
+        trace=self.tracer.handling(event)
+        for _ in range(messages):
+            self.room_queue.insert(({'name': 'echo'}, None, None))
+        self.tracer.handled(trace)
+        traces=[self.tracer.broadcasting(message) for message, room, clients in self.queue.drain()]
+        self.tracer.sent(traces)
+        return trace
+
+    def test_spans(self):
+        trace=self.trace({'name': 'move'})
+        self.assertEqual([span for span, begin, end in trace.spans()],[DECODE, HANDLER_QUEUE, HANDLE, SENDER_QUEUE, SEND],"wrong spans")
+        self.assertEqual(self.tracer.finished,1,"trace didnt finish")
+        self.assertEqual(self.metrics.value('trace_span_seconds',(('event', 'move'), ('span', SEND)))[0],1,"span wasnt aggregated")
+
+    def test_finishes_after_last_message(self):
+        event={'name': 'damage'}
+        self.tracer.sample(event,time.monotonic_ns())
+        trace=self.tracer.handling(event)
+        self.room_queue.insert(({'name': 'damage'}, None, None))
+        self.room_queue.insert(({'name': 'gameover'}, None, None))
+        self.tracer.handled(trace)
+        first, second=[self.tracer.broadcasting(message) for message, room, clients in self.queue.drain()]
+        self.tracer.sent([first])
+        self.assertEqual(self.tracer.finished,0,"trace finished before its last message")
+        self.tracer.sent([second])
+        self.assertEqual(self.tracer.finished,1,"trace didnt finish")
+
+    def test_untraced(self):
+        self.room_queue.insert(({'name': 'moves'}, None, None))
+        self.assertEqual([self.tracer.broadcasting(message) for message, room, clients in self.queue.drain()],[None],"tick message was traced")
+        self.assertIsNone(self.tracer.handling({'name': 'move'}),"unsampled event was traced")
+        with self.assertRaises(ValueError):
+            Tracer(0)
+
+    def test_threads(self):
+        # traces finish on the handler and the sender thread at the same time
+        def finish(name, count):
+            for _ in range(count):
+                event={'name': name}
+                self.tracer.sample(event,time.monotonic_ns(),(('event', 'move'),))
+                self.tracer.handled(self.tracer.handling(event))
+        threads=[Thread(target=finish,args=(name, 2000)) for name in ('move', 'damage')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.tracer.finished,4000,"traces were lost")
+        self.assertEqual(self.metrics.value('trace_span_seconds',(('event', 'move'), ('span', HANDLE)))[0],4000,"spans were lost")
+
+    def test_slowest(self):
+        traces=[self.trace({'name': 'move'}) for _ in range(3)]
+        slowest=sorted(traces,key=lambda trace: trace.duration,reverse=True)[:2]
+        self.assertEqual(self.tracer.slowest(),slowest,"wrong slowest traces")
+
+        events=self.tracer.chrome_trace()['traceEvents']
+        self.assertEqual([event['name'] for event in events if event['tid'] == 0],['move', DECODE, HANDLER_QUEUE, HANDLE, SENDER_QUEUE, SEND],"wrong trace events")
+        self.assertTrue(all(event['ph'] == 'X' and event['dur'] >= 0 for event in events),"wrong complete events")
+
+
+if __name__ == '__main__':
+    unittest.main()
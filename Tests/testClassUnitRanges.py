@@ -0,0 +1,45 @@
+from utils import UnitRanges
+import unittest
+
+
+class Test_case_UnitRanges(unittest.TestCase):
+
+    def setUp(self):
+        self.r=UnitRanges()
+        self.r.add(1,10)
+        self.r.add(20,5)
+
+    def test_membership(self):
+        self.assertEqual([i in self.r for i in (0,1,10,11,19,20,24,25)],[False,True,True,False,False,True,True,False],"wrong membership")
+        self.assertEqual(len(self.r),15,"wrong units count")
+
+    def test_adjacent_ranges_merge(self):
+        self.r.add(11,9)
+        self.assertEqual(self.r.ranges(),[(1,24)],"adjacent ranges werent merged")
+
+    def test_overlap(self):
+        with self.assertRaises(ValueError):
+            self.r.add(5,2)
+        with self.assertRaises(ValueError):
+            self.r.add(15,6)
+
+    def test_remove_splits_range(self):
+        self.r.remove(1)
+        self.r.remove(10)
+        self.r.remove(5)
+        self.assertEqual(self.r.ranges(),[(2,3),(6,4),(20,5)],"wrong ranges after remove")
+        self.assertEqual(5 in self.r,False,"removed unit still owned")
+        self.assertEqual(len(self.r),12,"wrong units count after remove")
+
+    def test_remove_unknown(self):
+        with self.assertRaises(ValueError):
+            self.r.remove(15)
+
+    def test_remove_whole_range(self):
+        for unit_id in range(20,25):
+            self.r.remove(unit_id)
+        self.assertEqual(self.r.ranges(),[(1,10)],"empty range wasnt dropped")
+
+
+if __name__ == '__main__':
+    unittest.main()
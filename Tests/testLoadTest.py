@@ -0,0 +1,50 @@
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from load_test import run, parse_mix, percentile
+from protocol import BINARY_ENCODING, JSON_ENCODING
+from server import Server, ASYNCIO_ENGINE, THREADS_ENGINE
+import asyncio
+import unittest
+
+
+class Test_case_LoadTest(unittest.TestCase):
+
+    def load(self, encoding, **kwargs):
+        server = Server(port=0, max_client_count=2, **kwargs)
+        server.start()
+        try:
+            stats = asyncio.run(run(server.server.getsockname(), bots=4, players=2, rate=40, duration=0.5,
+                                    encoding=encoding))
+        finally:
+            server.stop()
+            server.server.close()
+        return stats.report()
+
+    def check(self, report):
+        self.assertEqual((report['matches'], report['failed_bots']), (2, 0), "matches didnt start")
+        self.assertEqual((report['dropped'], report['malformed'], report['gameovers']), (0, 0, 0), "bad frames")
+        for kind, latency in report['latency_ms'].items():
+            self.assertGreater(latency['count'], 0, "no {} answered".format(kind))
+            self.assertLessEqual(latency['p50'], latency['max'], "wrong percentiles")
+
+    def test_json_threads(self):
+        self.check(self.load(JSON_ENCODING, engine=THREADS_ENGINE))
+
+    def test_binary_ticks(self):
+        self.check(self.load(BINARY_ENCODING, engine=ASYNCIO_ENGINE, tick_rate=20, seed_mapinit=True,
+                             state_sync=True, batch_damage=True))
+
+    def test_mix(self):
+        self.assertEqual(parse_mix('move:3,damage'), {'select': 0.0, 'move': 3.0, 'damage': 1.0}, "wrong mix")
+        with self.assertRaises(ValueError):
+            parse_mix('add_hp:1')
+
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        self.assertEqual([percentile(ordered, percent) for percent in (50, 90, 99, 100)], [50, 90, 99, 100],
+                         "wrong nearest rank")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from protocol import encode_event, decode_event, negotiate, hello, BINARY_ENCODING, JSON_ENCODING, \
+    BINARY_FRAME_HEADER, FRAME_HEADER, JSON_CODE, PROTOCOL_VERSION, ProtocolError
+import unittest
+
+
+def roundtrip(event, encoding=BINARY_ENCODING):
+    frame = encode_event(event, encoding)
+    header = BINARY_FRAME_HEADER if encoding == BINARY_ENCODING else FRAME_HEADER
+    size = header.unpack_from(frame)[0]
+    body = frame[header.size:]
+    assert size == len(body)
+    return body, decode_event(body, encoding)
+
+
+class Test_case_Protocol(unittest.TestCase):
+
+    def test_json_roundtrip(self):
+        event = {'name': 'ready', 'ready': True}
+        self.assertEqual(roundtrip(event, JSON_ENCODING)[1], event, "wrong json roundtrip")
+
+    def test_binary_hot_events(self):
+        events = [
+            {'name': 'move', 'unit_id': 7, 'x': 1.5, 'y': -2.25},
+            {'name': 'moves', 'moves': [{'name': 'move', 'unit_id': 7, 'x': 1.5, 'y': -2.25},
+                                        {'name': 'move', 'unit_id': 8, 'x': 0.0, 'y': 4.0}]},
+            {'name': 'damage', 'planet_id': 3, 'unit_id': 9, 'hp_count': 2},
+            {'name': 'damage', 'planet_change': {'id': 3, 'units_count': 40, 'owner': None}, 'unit_id': 9},
+            {'name': 'add_hp', 'planet_id': 3, 'hp_count': 5},
+            {'name': 'select', 'from': [1, 2], 'percentage': 50},
+            {'name': 'select', 'selected': {1: [10, 3], 2: [13, 0]}},
+            {'name': 'snapshot', 'id': 4, 'base': 2, 'planets': [[1, 20, 2], [5, 0, None]]},
+            {'name': 'snapshot', 'id': 30, 'keyframe': True, 'planets': [[1, 20, 2]]},
+            {'name': 'damages', 'units': [3, 9], 'planets': [[1, 20, 2], [5, 0, None]]},
+        ]
+        for event in events:
+            with self.subTest(event=event):
+                body, decoded = roundtrip(event)
+                self.assertNotEqual(body[0], JSON_CODE, "hot event fell back to json")
+                self.assertEqual(decoded, event, "wrong binary roundtrip")
+
+    def test_binary_damage_default_hp(self):
+        _, decoded = roundtrip({'name': 'damage', 'planet_id': 3, 'unit_id': 9})
+        self.assertEqual(decoded['hp_count'], 1, "wrong default hp_count")
+
+    def test_binary_json_fallback(self):
+        events = [
+            {'name': 'mapinit', 'map': []},
+            {'name': 'move', 'unit_id': 7, 'x': 1.5, 'y': 2.5, 'speed': 3},
+            {'name': 'add_hp', 'planet_id': -1, 'hp_count': 5},
+        ]
+        for event in events:
+            with self.subTest(event=event):
+                body, decoded = roundtrip(event)
+                self.assertEqual(body[0], JSON_CODE, "event should fall back to json")
+                self.assertEqual(decoded, event, "wrong fallback roundtrip")
+
+    def test_binary_is_smaller(self):
+        event = {'name': 'move', 'unit_id': 7, 'x': 1.5, 'y': -2.25}
+        self.assertLess(len(encode_event(event, BINARY_ENCODING)), len(encode_event(event)), "binary isnt smaller")
+
+    def test_unknown_binary_event(self):
+        with self.assertRaises(ProtocolError):
+            decode_event(b'\xff', BINARY_ENCODING)
+        with self.assertRaises(ProtocolError):
+            decode_event(b'\x01\x00', BINARY_ENCODING)
+
+    def test_not_an_event(self):
+        for payload in (b'[1, 2]', b'{}', b'{"name": 7}', b'"move"'):
+            with self.assertRaises(ProtocolError):
+                decode_event(payload)
+        with self.assertRaises(ProtocolError):
+            decode_event(bytes([JSON_CODE]) + b'[1, 2]', BINARY_ENCODING)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate({'name': 'hello', 'protocol': PROTOCOL_VERSION, 'encoding': BINARY_ENCODING}),
+                         BINARY_ENCODING, "binary wasnt negotiated")
+        self.assertEqual(negotiate({'name': 'hello', 'protocol': PROTOCOL_VERSION + 1, 'encoding': BINARY_ENCODING}),
+                         JSON_ENCODING, "unknown protocol version accepted")
+        self.assertEqual(negotiate({'name': 'hello', 'protocol': PROTOCOL_VERSION, 'encoding': 'xml'}),
+                         JSON_ENCODING, "unknown encoding accepted")
+        self.assertEqual(hello(BINARY_ENCODING)['encoding'], BINARY_ENCODING, "wrong hello ack")
+
+
+if __name__ == '__main__':
+    unittest.main()
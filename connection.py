@@ -0,0 +1,178 @@
+from collections import deque
+from threading import Lock
+
+from protocol import FRAME_HEADER, MAX_FRAME_SIZE, JSON_ENCODING, ProtocolError, encode_event, decode_event, \
+    frame_header
+
+# sendmsg() is limited by IOV_MAX (1024 on Linux), stay well below it
+SENDMSG_MAX_FRAMES = 512
+RECV_BUFFER_SIZE = 1 << 16
+
+
+class FrameDecoder(object):
+    def __init__(self, header=FRAME_HEADER, size=RECV_BUFFER_SIZE):
+        self.header = header
+        self.__buffer = bytearray(size)
+        self.__start = 0
+        self.__end = 0
+        self.received_bytes = 0
+        self.received_frames = 0
+
+    def __len__(self):
+        return self.__end - self.__start
+
+    def writable(self, min_size=RECV_BUFFER_SIZE):
+        if len(self.__buffer) - self.__end < min_size:
+            pending = self.__end - self.__start
+            if len(self.__buffer) - pending < min_size:
+                # never resize in place: a memoryview handed out earlier may still be alive
+                buffer = bytearray(max(2 * len(self.__buffer), pending + min_size))
+                buffer[:pending] = self.__buffer[self.__start:self.__end]
+                self.__buffer = buffer
+            else:
+                self.__buffer[:pending] = self.__buffer[self.__start:self.__end]
+            self.__start, self.__end = 0, pending
+
+        return memoryview(self.__buffer)[self.__end:]
+
+    def commit(self, size):
+        self.__end += size
+        self.received_bytes += size
+
+    def recv_into(self, sock):
+        received = sock.recv_into(self.writable())
+        self.commit(received)
+        return received
+
+    def frames(self):
+        while self.__end - self.__start >= self.header.size:
+            frame_size = self.header.unpack_from(self.__buffer, self.__start)[0]
+            if not 0 <= frame_size <= MAX_FRAME_SIZE:
+                raise ProtocolError('invalid frame size {}'.format(frame_size))
+
+            frame_start = self.__start + self.header.size
+            frame_end = frame_start + frame_size
+            if frame_end > self.__end:
+                break
+
+            self.__start = frame_end
+            self.received_frames += 1
+            yield bytes(self.__buffer[frame_start:frame_end])
+
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+
+
+class OutboundBuffer(object):
+    def __init__(self):
+        self.__frames = deque()
+        self.__size = 0
+        self.__mutex = Lock()
+        self.sent_bytes = 0
+        self.sent_frames = 0
+
+    def __len__(self):
+        return self.__size
+
+    def append(self, frame):
+        with self.__mutex:
+            self.__frames.append(memoryview(frame))
+            self.__size += len(frame)
+            self.sent_frames += 1
+
+    def clear(self):
+        # frames of a client that is dropped, a partly sent one included
+        with self.__mutex:
+            self.__frames.clear()
+            self.__size = 0
+
+    def __send(self, sock):
+        if len(self.__frames) == 1:
+            return sock.send(self.__frames[0])
+
+        if hasattr(sock, 'sendmsg'):
+            frames = [self.__frames[i] for i in range(min(len(self.__frames), SENDMSG_MAX_FRAMES))]
+            return sock.sendmsg(frames)
+
+        # no scatter-gather on this platform: coalesce queued frames into one write
+        frame = b''.join(self.__frames)
+        self.__frames.clear()
+        self.__frames.append(memoryview(frame))
+        return sock.send(frame)
+
+    def flush(self, sock):
+        with self.__mutex:
+            while self.__frames:
+                try:
+                    sent = self.__send(sock)
+                except (BlockingIOError, InterruptedError):
+                    break
+
+                self.__size -= sent
+                self.sent_bytes += sent
+                while sent:
+                    frame = self.__frames[0]
+                    if sent >= len(frame):
+                        self.__frames.popleft()
+                        sent -= len(frame)
+                    else:
+                        self.__frames[0] = frame[sent:]
+                        sent = 0
+
+            return self.__size
+
+
+class Connection(object):
+    def __init__(self, sock, address, bucket=None):
+        self.sock = sock
+        self.address = address
+        # TokenBucket limiting the events the client may send, None for no limit
+        self.bucket = bucket
+        self.encoding = JSON_ENCODING
+        self.decoder = FrameDecoder()
+        self.outbound = OutboundBuffer()
+        self.room = None
+        self.closing = False
+        # dropped for not reading its frames, nothing more is sent to it
+        self.slow = False
+        self.__mutex = Lock()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def traffic(self):
+        return {
+            'received_bytes': self.decoder.received_bytes,
+            'received_frames': self.decoder.received_frames,
+            'sent_bytes': self.outbound.sent_bytes,
+            'sent_frames': self.outbound.sent_frames,
+        }
+
+    def send_event(self, event, frames=None):
+        # frames caches the encoded event per encoding, so a broadcast encodes it once per encoding
+        frames = {} if frames is None else frames
+        with self.__mutex:
+            frame = frames.get(self.encoding)
+            if frame is None:
+                frame = frames[self.encoding] = encode_event(event, self.encoding)
+            self.outbound.append(frame)
+
+    def switch_encoding(self, encoding, ack):
+        # ack is the last frame in the old encoding, so the peer knows where the switch happens
+        with self.__mutex:
+            self.outbound.append(encode_event(ack, self.encoding))
+            self.encoding = encoding
+            self.decoder.header = frame_header(encoding)
+
+    def decode(self, frame):
+        return decode_event(frame, self.encoding)
+
+    def flush(self):
+        return self.outbound.flush(self.sock) == 0
+
+    @property
+    def pending(self):
+        return len(self.outbound) > 0
+
+    def close(self):
+        self.sock.close()
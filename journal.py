@@ -0,0 +1,139 @@
+import mmap
+import os
+import struct
+import time
+from queue import SimpleQueue, Empty
+
+from protocol import encode_binary, decode_event, BINARY_ENCODING, BINARY_FRAME_HEADER
+from utils import StoppedThread
+
+JOURNAL_MAGIC = b'SVJ1'
+JOURNAL_VERSION = 1
+JOURNAL_TIMEOUT = 0.5
+JOURNAL_BUFFER_SIZE = 1 << 16
+
+# magic, version, room id
+JOURNAL_HEADER = struct.Struct('!4sBI')
+# kind, player id (0 for the whole room), ns since the journal was opened; a binary protocol frame follows
+RECORD = struct.Struct('!BIQ')
+EMPTY_FRAME = BINARY_FRAME_HEADER.pack(0)
+
+OPEN = 1
+JOIN = 2
+LEAVE = 3
+EVENT = 4
+TICK = 5
+SEED = 6
+BROADCAST = 7
+CLOSE = 8
+
+
+class JournalError(ValueError):
+    pass
+
+
+class Journal(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.written = 0
+        # files of different server runs don't overwrite each other, room ids start over every run
+        self.prefix = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.paths = []
+        self.__queue = SimpleQueue()
+        self.__seeds = {}
+        self.__thread = None
+
+    def path(self, room_id):
+        return os.path.join(self.directory, '{}-room-{}.journal'.format(self.prefix, room_id))
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.__thread = StoppedThread(name='journal', target=self.__write, args=())
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__thread.stop()
+            self.__thread.join()
+            self.__thread = None
+
+    def record(self, room_id, kind, player=0, payload=None):
+        # the caller only pays for the put, encoding and writing happen on the journal thread
+        self.__queue.put((room_id, kind, player, time.monotonic_ns(), payload))
+
+    def seed(self, room):
+        if room.seed is not None and self.__seeds.get(room.id) != room.seed:
+            self.__seeds[room.id] = room.seed
+            self.record(room.id, SEED, payload={'name': 'seed', 'seed': room.seed, 'params': room.map_params})
+
+    def close(self, room_id):
+        self.__seeds.pop(room_id, None)
+        self.record(room_id, CLOSE)
+
+    def __write(self, is_alive):
+        files = {}
+        try:
+            while is_alive() or not self.__queue.empty():
+                try:
+                    room_id, kind, player, at, payload = self.__queue.get(timeout=JOURNAL_TIMEOUT)
+                except Empty:
+                    continue
+
+                if kind == OPEN:
+                    path = self.path(room_id)
+                    journal_file = open(path, 'wb', buffering=JOURNAL_BUFFER_SIZE)
+                    journal_file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, room_id))
+                    files[room_id] = (journal_file, at)
+                    self.paths.append(path)
+
+                if room_id not in files:
+                    continue
+                journal_file, opened = files[room_id]
+                journal_file.write(RECORD.pack(kind, player, at - opened))
+                journal_file.write(EMPTY_FRAME if payload is None else encode_binary(payload))
+                self.written += 1
+
+                if kind == CLOSE:
+                    files.pop(room_id)[0].close()
+        finally:
+            for journal_file, _ in files.values():
+                journal_file.close()
+
+
+class JournalReader(object):
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, 'rb')
+        if os.fstat(self.__file.fileno()).st_size < JOURNAL_HEADER.size:
+            self.__file.close()
+            raise JournalError('{} is not a journal'.format(path))
+
+        self.__data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.room_id = JOURNAL_HEADER.unpack_from(self.__data)
+        if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+            self.close()
+            raise JournalError('{} is not a version {} journal'.format(path, JOURNAL_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.__data.close()
+        self.__file.close()
+
+    def __iter__(self):
+        data = self.__data
+        offset = JOURNAL_HEADER.size
+        while offset + RECORD.size + BINARY_FRAME_HEADER.size <= len(data):
+            kind, player, at = RECORD.unpack_from(data, offset)
+            size = BINARY_FRAME_HEADER.unpack_from(data, offset + RECORD.size)[0]
+            start = offset + RECORD.size + BINARY_FRAME_HEADER.size
+            if start + size > len(data):
+                # the server died in the middle of a record, everything before it is still good
+                break
+
+            yield kind, player, at, decode_event(data[start:start + size], BINARY_ENCODING) if size else None
+            offset = start + size
@@ -0,0 +1,382 @@
+# plays matches against a server with asyncio bots speaking the real framing protocol
+# python load_test.py --bots 200 --players 4 --rate 20 --duration 30 --encoding binary
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+from map_generator import regenerate
+from protocol import encode_event, decode_event, frame_header, hello, ProtocolError, MAX_FRAME_SIZE, \
+    JSON_ENCODING, ENCODINGS
+
+EVENT_KINDS = ('select', 'move', 'damage')
+DEFAULT_MIX = 'select:1,move:8,damage:1'
+PERCENTILES = (50, 90, 99)
+SELECT_PERCENTAGE = 50
+JOIN_TIMEOUT = 10
+DRAIN_TIMEOUT = 2
+MOVE_RANGE = 1 << 16
+
+
+def parse_mix(mix):
+    weights = dict.fromkeys(EVENT_KINDS, 0.0)
+    for part in mix.split(','):
+        kind, _, weight = part.partition(':')
+        if kind not in weights:
+            raise ValueError('unknown event {!r}, expected one of {}'.format(kind, EVENT_KINDS))
+        weights[kind] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError('event mix {!r} has no weights'.format(mix))
+    return weights
+
+
+def percentile(ordered, percent):
+    # nearest rank, ordered is sorted
+    return ordered[max(0, -(-len(ordered) * percent // 100) - 1)]
+
+
+class LoadStats(object):
+    def __init__(self):
+        self.sent = dict.fromkeys(EVENT_KINDS, 0)
+        self.latencies = {kind: [] for kind in EVENT_KINDS}
+        self.bytes_sent = 0
+        self.frames = 0
+        self.bytes_received = 0
+        # replies that never came, frames that didn't decode
+        self.dropped = 0
+        self.malformed = 0
+        # moves replaced by a later move of the unit within a tick
+        self.superseded = 0
+        # sent after the match was over, nobody answers those
+        self.abandoned = 0
+        self.matches = 0
+        self.failed_bots = 0
+        self.gameovers = 0
+        self.ramp = 0.0
+        self.started = None
+        self.stopped = None
+
+    def report(self):
+        elapsed = (self.stopped - self.started) if self.started is not None else 0.0
+        sent = sum(self.sent.values())
+        latencies = {}
+        for kind, values in self.latencies.items():
+            ordered = sorted(values)
+            latencies[kind] = {'count': len(ordered)}
+            if ordered:
+                latencies[kind].update({'p{}'.format(percent): percentile(ordered, percent) * 1000
+                                        for percent in PERCENTILES})
+                latencies[kind]['max'] = ordered[-1] * 1000
+        return {
+            'ramp': self.ramp,
+            'elapsed': elapsed,
+            'matches': self.matches,
+            'failed_bots': self.failed_bots,
+            'gameovers': self.gameovers,
+            'sent': dict(self.sent),
+            'events_per_second': sent / elapsed if elapsed else 0.0,
+            'frames': self.frames,
+            'frames_per_second': self.frames / elapsed if elapsed else 0.0,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency_ms': latencies,
+            'dropped': self.dropped,
+            'malformed': self.malformed,
+            'superseded': self.superseded,
+            'abandoned': self.abandoned,
+        }
+
+
+class Bot(object):
+    def __init__(self, address, stats, encoding=JSON_ENCODING):
+        self.address = address
+        self.stats = stats
+        self.target_encoding = encoding
+        self.encoding = JSON_ENCODING
+        self.id = None
+        self.home = None
+        self.owners = {}
+        self.players = set()
+        # players seen holding units, damage before everybody has some could end the match
+        self.armed = set()
+        self.units = []
+        self.finished = False
+        self.__reader = None
+        self.__writer = None
+        self.__read_task = None
+        self.__control = asyncio.Queue()
+        # (kind, key) -> deque of (sent at, tag) waiting for the server's echo
+        self.__pending = {}
+        self.__moves = 0
+
+    async def connect(self):
+        self.__reader, self.__writer = await asyncio.open_connection(*self.address)
+        self.__read_task = asyncio.ensure_future(self.__read())
+
+        await self.expect('hello')
+        if self.target_encoding != JSON_ENCODING:
+            await self.send(hello(self.target_encoding))
+
+        # the encoding ack and the bot's own connect come in either order
+        while self.id is None or self.encoding != self.target_encoding:
+            event = await self.expect('connect', 'hello')
+            if event['name'] == 'connect' and self.id is None:
+                self.id = event['player']['id']
+
+    async def expect(self, *names):
+        while True:
+            event = await self.__control.get()
+            if event is None:
+                raise ConnectionError('server closed connection')
+            if event['name'] in names:
+                return event
+
+    async def send(self, event):
+        frame = encode_event(event, self.encoding)
+        self.__writer.write(frame)
+        self.stats.bytes_sent += len(frame)
+        await self.__writer.drain()
+
+    def start_map(self, mapinit):
+        if 'map' in mapinit:
+            planets = mapinit['map']
+        else:
+            planets = regenerate(mapinit['seed'], mapinit['players'], mapinit['params'])
+        self.owners = {planet['id']: planet['owner'] for planet in planets if planet['owner'] is not None}
+        self.players = set(self.owners.values())
+        self.home = next(planet['id'] for planet in planets if planet['owner'] == self.id)
+
+    async def play(self, deadline, rate, weights):
+        loop = asyncio.get_running_loop()
+        kinds, kind_weights = zip(*weights.items())
+        interval = 1 / rate
+        next_at = loop.time() + random.uniform(0, interval)
+
+        while not self.finished and loop.time() < deadline:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            # open loop: a slow server gets the events in bursts, not fewer of them
+            next_at += interval
+
+            kind = random.choices(kinds, kind_weights)[0]
+            if not self.units:
+                kind = 'select'
+            # a bot keeps one unit, a player without units counts as lost
+            elif kind == 'damage' and (len(self.units) < 2 or self.armed < self.players):
+                kind = 'move'
+
+            if kind == 'select':
+                await self.__request('select', self.home, None,
+                                     {'name': 'select', 'from': [self.home], 'percentage': SELECT_PERCENTAGE})
+            elif kind == 'move':
+                unit_id = random.choice(self.units)
+                self.__moves += 1
+                # integer coordinates survive the binary float32 exactly, so the echo names the move it answers
+                tag = (self.__moves % MOVE_RANGE, random.randrange(MOVE_RANGE))
+                await self.__request('move', unit_id, tag, {'name': 'move', 'unit_id': unit_id,
+                                                            'x': tag[0], 'y': tag[1]})
+            else:
+                # damage goes to the bot's own planet, reinforcing it keeps the match from ending
+                unit_id = self.units.pop(random.randrange(len(self.units)))
+                await self.__request('damage', unit_id, None, {'name': 'damage', 'planet_id': self.home,
+                                                               'unit_id': unit_id, 'hp_count': 1})
+
+    async def __request(self, kind, key, tag, event):
+        self.__pending.setdefault((kind, key), deque()).append((time.perf_counter(), tag))
+        self.stats.sent[kind] += 1
+        await self.send(event)
+
+    async def drain(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.__pending and not self.finished and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def close(self):
+        unanswered = sum(len(sends) for sends in self.__pending.values())
+        if self.finished:
+            self.stats.abandoned += unanswered
+        else:
+            self.stats.dropped += unanswered
+        self.__pending.clear()
+
+        if self.__writer is not None:
+            self.__writer.close()
+        if self.__read_task is not None:
+            self.__read_task.cancel()
+            try:
+                await self.__read_task
+            except asyncio.CancelledError:
+                pass
+
+    def __answer(self, kind, key, tag=None):
+        sends = self.__pending.get((kind, key))
+        if not sends:
+            return
+        now = time.perf_counter()
+
+        if tag is not None:
+            # coalescing only broadcasts the latest move of a tick, the older ones are answered by it
+            if all(sent_tag != tag for _, sent_tag in sends):
+                return
+            while sends[0][1] != tag:
+                sends.popleft()
+                self.stats.superseded += 1
+
+        sent_at, _ = sends.popleft()
+        self.stats.latencies[kind].append(now - sent_at)
+        if not sends:
+            del self.__pending[(kind, key)]
+
+    def __handle(self, event):
+        name = event['name']
+        if name == 'select':
+            for planet_id, (start, count) in event['selected'].items():
+                planet_id = int(planet_id)
+                if count and planet_id in self.owners:
+                    self.armed.add(self.owners[planet_id])
+                if planet_id == self.home:
+                    self.units.extend(range(start, start + count))
+                    self.__answer('select', planet_id)
+        elif name == 'move':
+            self.__answer('move', event['unit_id'], (event['x'], event['y']))
+        elif name == 'moves':
+            for move in event['moves']:
+                self.__answer('move', move['unit_id'], (move['x'], move['y']))
+        elif name == 'damage':
+            self.__answer('damage', event['unit_id'])
+        elif name == 'damages':
+            for unit_id in event['units']:
+                self.__answer('damage', unit_id)
+        elif name == 'snapshot':
+            frame = encode_event({'name': 'ack', 'snapshot': event['id']}, self.encoding)
+            self.__writer.write(frame)
+            self.stats.bytes_sent += len(frame)
+        else:
+            if name == 'gameover':
+                self.finished = True
+                self.stats.gameovers += 1
+            elif name == 'hello' and 'encoding' in event:
+                self.encoding = event['encoding']
+            self.__control.put_nowait(event)
+
+    async def __read(self):
+        try:
+            while True:
+                header = frame_header(self.encoding)
+                size = header.unpack(await self.__reader.readexactly(header.size))[0]
+                if not 0 <= size <= MAX_FRAME_SIZE:
+                    # the framing is lost, nothing after this can be trusted
+                    self.stats.malformed += 1
+                    break
+
+                frame = await self.__reader.readexactly(size)
+                self.stats.frames += 1
+                self.stats.bytes_received += header.size + size
+                try:
+                    event = decode_event(frame, self.encoding)
+                    self.__handle(event)
+                except (ProtocolError, ValueError, KeyError, TypeError):
+                    self.stats.malformed += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.__control.put_nowait(None)
+
+
+async def start_match(address, stats, players, encoding, join_lock):
+    bots = [Bot(address, stats, encoding) for _ in range(players)]
+    try:
+        # one match joins at a time, so its bots end up in the same room
+        async with join_lock:
+            for bot in bots:
+                await asyncio.wait_for(bot.connect(), JOIN_TIMEOUT)
+            for bot in bots:
+                await bot.send({'name': 'ready', 'ready': True})
+            mapinits = await asyncio.wait_for(asyncio.gather(*(bot.expect('mapinit') for bot in bots)),
+                                              JOIN_TIMEOUT)
+
+        for bot, mapinit in zip(bots, mapinits):
+            bot.start_map(mapinit)
+            await bot.send({'name': 'rendered'})
+        await asyncio.wait_for(asyncio.gather(*(bot.expect('game_started') for bot in bots)), JOIN_TIMEOUT)
+    except (asyncio.TimeoutError, OSError) as error:
+        print('match did not start: {!r}'.format(error))
+        stats.failed_bots += players
+        await asyncio.gather(*(bot.close() for bot in bots))
+        return None
+
+    stats.matches += 1
+    return bots
+
+
+async def play_match(bots, deadline, rate, weights, drain):
+    try:
+        await asyncio.gather(*(bot.play(deadline, rate, weights) for bot in bots))
+        await asyncio.gather(*(bot.drain(drain) for bot in bots))
+    except OSError as error:
+        print('match was interrupted: {!r}'.format(error))
+    finally:
+        await asyncio.gather(*(bot.close() for bot in bots))
+
+
+async def run(address, bots=100, players=2, rate=10, duration=10, mix=DEFAULT_MIX, encoding=JSON_ENCODING,
+              drain=DRAIN_TIMEOUT):
+    if bots < players or players < 2:
+        raise ValueError('need at least two players per match and enough bots for one match')
+
+    stats = LoadStats()
+    weights = parse_mix(mix)
+    join_lock = asyncio.Lock()
+    joining = time.perf_counter()
+    matches = await asyncio.gather(*(start_match(address, stats, players, encoding, join_lock)
+                                     for _ in range(bots // players)))
+    stats.ramp = time.perf_counter() - joining
+
+    # every match is in game before the measured window opens
+    stats.started = time.perf_counter()
+    deadline = asyncio.get_running_loop().time() + duration
+    await asyncio.gather(*(play_match(match, deadline, rate, weights, drain) for match in matches if match))
+    stats.stopped = time.perf_counter()
+    return stats
+
+
+def print_report(report, encoding):
+    print('{} matches ({} bots failed to start) joined in {:.1f} s, played {:.1f} s, {} encoding'.format(
+        report['matches'], report['failed_bots'], report['ramp'], report['elapsed'], encoding))
+    print('sent {} events ({:.0f}/s, {} B), received {} frames ({:.0f}/s, {} B)'.format(
+        sum(report['sent'].values()), report['events_per_second'], report['bytes_sent'],
+        report['frames'], report['frames_per_second'], report['bytes_received']))
+    for kind, latency in report['latency_ms'].items():
+        if latency['count']:
+            print('{:<7} {:>8} answered  {}  max {:.2f} ms'.format(
+                kind, latency['count'],
+                '  '.join('p{} {:.2f} ms'.format(percent, latency['p{}'.format(percent)])
+                          for percent in PERCENTILES),
+                latency['max']))
+    print('dropped {}, malformed {}, superseded {}, abandoned {}, gameovers {}'.format(
+        report['dropped'], report['malformed'], report['superseded'], report['abandoned'], report['gameovers']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=10800)
+    parser.add_argument('--bots', type=int, default=100)
+    parser.add_argument('--players', type=int, default=2, help='bots per match')
+    parser.add_argument('--rate', type=float, default=10, help='events per second of every bot')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='event weights, e.g. ' + DEFAULT_MIX)
+    parser.add_argument('--duration', type=float, default=10, help='seconds of play')
+    parser.add_argument('--drain', type=float, default=DRAIN_TIMEOUT,
+                        help='seconds to wait for the last answers before counting them as dropped')
+    parser.add_argument('--encoding', choices=ENCODINGS, default=JSON_ENCODING)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(run((args.host, args.port), args.bots, args.players, args.rate, args.duration, args.mix,
+                             args.encoding, args.drain)).report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.encoding)
@@ -2,11 +2,10 @@
 import math
 import random
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-from planet import Planet, PlanetType
-from utils import Coords
+from planet import Planet, PlanetType, PlanetStore
+from utils import Coords, generate_id
 
 SCREEN_MULTIPLIER = 120
 
@@ -14,21 +13,108 @@ PLAYERS = random.randint(2, 8)
 
 # PLAYERS = 8
 
+REJECTION_MODE = 'rejection'
+# fills the map completely, but it is 3-5x slower than the rejection sampler asked for as many planets at every size
+# Benchmarks/bench_map_generator.py measures: pick it for the fill, not for big maps
+POISSON_MODE = 'poisson'
+MODES = (REJECTION_MODE, POISSON_MODE)
+
+CANDIDATES_BATCH_SIZE = 64
+# Bridson's k: candidates tried around an active point before it is retired
+POISSON_CANDIDATES = 30
+# active points expanded together in one vectorised step
+POISSON_ACTIVE_BATCH = 32
+PLANET_TYPES = (PlanetType.SMALL, PlanetType.MEDIUM, PlanetType.BIG)
+PLANET_TYPE_WEIGHTS = np.array([600, 300, 200]) / 1100
+# seeds stay below 2 ** 53 so clients parsing JSON numbers as doubles get them exactly
+SEED_BITS = 53
+
+
+class SpatialGrid(object):
+    # Bridson's background grid: cells are distance / sqrt(2) wide, so a cell holds at most one point
+    # and points closer than distance are at most two cells away
+    NEIGHBOURHOOD = np.arange(-2, 3)
+
+    def __init__(self, distance, length, height):
+        self.distance = distance
+        self.cell_size = distance / math.sqrt(2)
+        self.__left = -length / 2
+        self.__bottom = -height / 2
+        self.__size = 0
+        self.__columns = int(length / self.cell_size) + 1
+        self.__rows = int(height / self.cell_size) + 1
+        # two empty cells around the map keep neighbourhood lookups in range, nan never compares as too close
+        self.__x = np.full((self.__columns + 4, self.__rows + 4), np.nan)
+        self.__y = np.full((self.__columns + 4, self.__rows + 4), np.nan)
+
+    def __len__(self):
+        return self.__size
+
+    def __cells(self, xs, ys):
+        columns = np.minimum(np.maximum((xs - self.__left) // self.cell_size, 0), self.__columns - 1)
+        rows = np.minimum(np.maximum((ys - self.__bottom) // self.cell_size, 0), self.__rows - 1)
+        return columns.astype(int) + 2, rows.astype(int) + 2
+
+    def add(self, x, y):
+        column = min(max(math.floor((x - self.__left) / self.cell_size), 0), self.__columns - 1) + 2
+        row = min(max(math.floor((y - self.__bottom) / self.cell_size), 0), self.__rows - 1) + 2
+        if not np.isnan(self.__x[column, row]):
+            raise ValueError('point ({}, {}) is closer than {} to another one'.format(x, y, self.distance))
+        self.__x[column, row] = x
+        self.__y[column, row] = y
+        self.__size += 1
+
+    def free(self, xs, ys):
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        columns, rows = self.__cells(xs, ys)
+        # a taken cell is closer than distance anyway, only the rest needs the 5x5 lookup
+        free = np.isnan(self.__x[columns, rows])
+        xs, ys, columns, rows = xs[free], ys[free], columns[free], rows[free]
+        columns = columns[:, None, None] + self.NEIGHBOURHOOD[:, None]
+        rows = rows[:, None, None] + self.NEIGHBOURHOOD
+        distances = (self.__x[columns, rows] - xs[:, None, None]) ** 2 + \
+            (self.__y[columns, rows] - ys[:, None, None]) ** 2
+        free[free] = ~np.any(distances < self.distance ** 2, axis=(1, 2))
+        return free
+
+    def is_free(self, x, y):
+        return bool(self.free([x], [y])[0])
+
 
 class MapGenerator(object):
     LENGTH_MULTIPLIER = 16
     HEIGHT_MULTIPLIER = 9
 
-    def __init__(self, screen_scale_multiplier=120, planet_free_space_radius=None):
+    def __init__(self, screen_scale_multiplier=120, planet_free_space_radius=None, ids=None, mode=REJECTION_MODE,
+                 max_planet_count=None, seed=None):
+        if mode not in MODES:
+            raise ValueError('unknown mode {!r}, expected one of {}'.format(mode, MODES))
+
+        # the map only depends on the seed, the players ids and these params
+        self.seed = random.SystemRandom().getrandbits(SEED_BITS) if seed is None else seed
+        self.params = {'screen_scale_multiplier': screen_scale_multiplier,
+                       'planet_free_space_radius': planet_free_space_radius,
+                       'mode': mode,
+                       'max_planet_count': max_planet_count}
+        self.__random = random.Random(self.seed)
+        self.__rng = np.random.default_rng(self.__random.getrandbits(64))
+
+        self.__mode = mode
+        self.__ids = ids
+        self.__store = PlanetStore()
         self.__screen_length = self.LENGTH_MULTIPLIER * screen_scale_multiplier
         self.__screen_height = self.HEIGHT_MULTIPLIER * screen_scale_multiplier
         self.__border_angle = math.atan(self.HEIGHT_MULTIPLIER / self.LENGTH_MULTIPLIER) * 180 / math.pi
         self.__planets = []
-        self.__max_planet_count = random.randint(40, 55)
+        self.__max_planet_count = max_planet_count or self.__random.randint(40, 55)
+        # poisson mode without a planet limit fills the whole map
+        self.__fill = mode == POISSON_MODE and max_planet_count is None
         # self.__max_planet_count = 45
         # print(self.__max_planet_count)
         self.__players = -1
         self.__start_position_radius = 0
+        self.__homes = None
         self.__max_gen_try = 25
 
         if planet_free_space_radius:
@@ -36,19 +122,28 @@ class MapGenerator(object):
         else:
             self.__planet_free_space_radius = round(50/120 * screen_scale_multiplier)
 
+        self.__grid = SpatialGrid(2 * self.__planet_free_space_radius, self.__screen_length, self.__screen_height)
+
+    def __planet(self, coords, planet_type, owner=None):
+        return Planet(coords, planet_type, owner, next(self.__ids) if self.__ids is not None else None,
+                      self.__store)
+
     def run(self, players_ids):
         self.__players = len(players_ids)
         self.__generate_start_position(players_ids)
         self.__generate_subplanet()
-        self.__generate_separated_planet()
+        if self.__mode == POISSON_MODE:
+            self.__generate_poisson_planets()
+        else:
+            self.__generate_separated_planet()
         return self.__planets
 
     def __generate_start_position(self, players_ids):
         players_count = len(players_ids)
 
-        planets = [[0, Planet(Coords(0, 0), PlanetType.BIGGEST), 0]]
+        planets = [[0, self.__planet(Coords(0, 0), PlanetType.BIGGEST), 0]]
 
-        alpha = random.randint(0, int(360 / players_count))
+        alpha = self.__random.randint(0, int(360 / players_count))
         for player_id in players_ids:
             coord = Coords()
             tang = math.tan(alpha * math.pi / 180)
@@ -99,7 +194,7 @@ class MapGenerator(object):
                     coord.y = height_border * tang
                     coord.x = self.__screen_length / 2
 
-            planets.append([coord.radius_calculation(), Planet(coord, PlanetType.BIG, player_id), alpha])
+            planets.append([coord.radius_calculation(), self.__planet(coord, PlanetType.BIG, player_id), alpha])
             alpha += 360 / players_count
 
         min_rad = min(planets[1:], key=lambda x: x[0])
@@ -111,104 +206,140 @@ class MapGenerator(object):
             i[0] = self.__start_position_radius
 
         self.__planets += [planet[1] for planet in planets]
-
-    def __generate_subplanet(self):
-        subplanet_max_count = round((self.__max_planet_count - self.__players - 1) * 0.6 / self.__players)
-        max_try = 25
-        for planet in self.__planets[1:]:
-            subplanet_num = 0
-            try_num = 0
-            subplanets = []
-            while True:
-                sub_alpha = random.randint(0, 359)
-                sub_radius = random.randint(2 * self.__planet_free_space_radius,
-                                            int(self.__start_position_radius * math.sin(
-                                                math.pi / self.__players)) - self.__planet_free_space_radius)
-                check = True
-                new_planet = Planet(Coords(sub_radius * math.cos(sub_alpha * math.pi / 180) + planet.coords.x,
-                                           sub_radius * math.sin(sub_alpha * math.pi / 180) + planet.coords.y),
-                                    random.choices([PlanetType.SMALL, PlanetType.MEDIUM, PlanetType.BIG],
-                                                   [600, 300, 200])[0])
-
-                if abs(new_planet.coords.x) > self.__screen_length / 2 - self.__planet_free_space_radius or \
-                        abs(new_planet.coords.y) > self.__screen_height / 2 - self.__planet_free_space_radius:
-                    try_num += 1
-                    if try_num > max_try:
-                        break
-                    continue
-
-                for i in subplanets:
-                    if new_planet.coords.calc_distance(i.coords) < 2 * self.__planet_free_space_radius:
-                        check = False
-                        break
-
-                if check:
-                    subplanets.append(new_planet)
+        for planet in self.__planets:
+            self.__grid.add(planet.coords.x, planet.coords.y)
+        self.__homes = np.array([planet.coords.get_coord() for planet in self.__planets[1:1 + self.__players]],
+                                dtype=float)
+
+    def __in_screen(self, xs, ys):
+        return (np.abs(xs) <= self.__screen_length / 2 - self.__planet_free_space_radius) & \
+            (np.abs(ys) <= self.__screen_height / 2 - self.__planet_free_space_radius)
+
+    def __outside_homes(self, xs, ys):
+        # separated planets keep clear of the players' home areas
+        subradius = self.__start_position_radius * math.sin(math.pi / self.__players)
+        distances = (xs[:, None] - self.__homes[:, 0]) ** 2 + (ys[:, None] - self.__homes[:, 1]) ** 2
+        return np.all(distances >= subradius ** 2, axis=1)
+
+    def __draw_separated(self, count):
+        xs = self.__rng.integers(int(-self.__screen_length / 2), int(self.__screen_length / 2) + 1, count)
+        ys = self.__rng.integers(int(-self.__screen_height / 2), int(self.__screen_height / 2) + 1, count)
+        return xs, ys, self.__in_screen(xs, ys) & self.__outside_homes(xs, ys)
+
+    def __place(self, draw, max_count, max_try):
+        # draw() returns a batch of candidates and a mask of those passing the vectorised checks;
+        # max_try counts consecutive rejections, like one candidate at a time did
+        placed = []
+        try_num = 0
+        limit = self.__grid.distance ** 2
+
+        while len(placed) < max_count:
+            xs, ys, valid = draw(CANDIDATES_BATCH_SIZE)
+            valid[valid] = self.__grid.free(xs[valid], ys[valid])
+            types = self.__rng.choice(len(PLANET_TYPES), len(xs), p=PLANET_TYPE_WEIGHTS)
+            batch = []
+
+            for x, y, ok, planet_type in zip(xs.tolist(), ys.tolist(), valid.tolist(), types.tolist()):
+                # the grid was checked for the whole batch, only this batch's planets are left
+                if ok and all((x - other_x) ** 2 + (y - other_y) ** 2 >= limit for other_x, other_y in batch):
+                    self.__grid.add(x, y)
+                    batch.append((x, y))
+                    placed.append(self.__planet(Coords(x, y), PLANET_TYPES[planet_type]))
                     try_num = 0
+                    if len(placed) >= max_count:
+                        break
                 else:
                     try_num += 1
                     if try_num > max_try:
-                        break
-                    continue
-
-                subplanet_num += 1
-                if subplanet_num >= subplanet_max_count:
-                    break
+                        return placed
 
-            self.__planets += subplanets
+        return placed
 
-    def __generate_separated_planet(self):
-        separated_max_count = self.__max_planet_count - len(self.__planets)
-        separated_num = 0
-        try_num = 0
-        separated = [self.__planets[0]]
-        while True:
-            x = random.randint(-self.__screen_length / 2, self.__screen_length / 2)
-            y = random.randint(-self.__screen_height / 2, self.__screen_height / 2)
-
-            check = True
-            new_planet = Planet(Coords(x, y),
-                                random.choices([PlanetType.SMALL, PlanetType.MEDIUM, PlanetType.BIG],
-                                               [600, 300, 200])[0])
-
-            if abs(new_planet.coords.x) > self.__screen_length / 2 - self.__planet_free_space_radius or \
-                    abs(new_planet.coords.y) > self.__screen_height / 2 - self.__planet_free_space_radius:
-                check = False
+    def __generate_subplanet(self):
+        subplanet_max_count = round((self.__max_planet_count - self.__players - 1) * 0.6 / self.__players)
+        max_try = 25
+        min_radius = 2 * self.__planet_free_space_radius
+        max_radius = int(self.__start_position_radius * math.sin(math.pi / self.__players)) - \
+            self.__planet_free_space_radius
 
-            subradius = self.__start_position_radius * math.sin(math.pi / self.__players)
+        for planet in self.__planets[1:1 + self.__players]:
+            center_x, center_y = planet.coords.x, planet.coords.y
 
-            for i in self.__planets[1:1 + self.__players]:
-                if new_planet.coords.calc_distance(i.coords) < subradius:
-                    check = False
-                    break
+            def draw(count):
+                alpha = np.radians(self.__rng.integers(0, 360, count))
+                radius = self.__rng.integers(min_radius, max_radius + 1, count)
+                xs = radius * np.cos(alpha) + center_x
+                ys = radius * np.sin(alpha) + center_y
+                return xs, ys, self.__in_screen(xs, ys)
 
-            # for i in self.__planets:
-            #     # print(new_planet.coords.calc_distance(i[1].coords), i[0])
-            #     if new_planet.coords.calc_distance(i.coords) < 2 * PLANET_FREE_SPACE_RADIUS:
-            #         check = False
-            #         break
+            self.__planets += self.__place(draw, subplanet_max_count, max_try)
 
-            for i in separated:
-                if new_planet.coords.calc_distance(i.coords) < 2 * self.__planet_free_space_radius:
-                    check = False
+    def __generate_separated_planet(self):
+        separated_max_count = self.__max_planet_count - len(self.__planets)
+        self.__planets += self.__place(self.__draw_separated, separated_max_count, self.__max_gen_try * 200)
+
+    def __free_point(self):
+        # one vectorised draw of as many tries as __place would make, on a full map they all miss
+        xs, ys, valid = self.__draw_separated(self.__max_gen_try * 200)
+        valid[valid] = self.__grid.free(xs[valid], ys[valid])
+        free = np.flatnonzero(valid)
+        return (float(xs[free[0]]), float(ys[free[0]])) if len(free) else None
+
+    def __generate_poisson_planets(self):
+        # Bridson's sampling grown from the planets already placed
+        max_count = math.inf if self.__fill else self.__max_planet_count - len(self.__planets)
+        distance = self.__grid.distance
+        limit = distance ** 2
+        active = [planet.coords.get_coord() for planet in self.__planets]
+        placed = []
+
+        while len(placed) < max_count:
+            if not active:
+                # home areas can cut the map into parts no active point reaches, seed them at random
+                point = self.__free_point()
+                if point is None:
                     break
-
-            if check:
-                separated.append(new_planet)
-                try_num = 0
+                points = [point]
             else:
-                try_num += 1
-                if try_num > self.__max_gen_try * 200:
-                    break
-                continue
-
-            separated_num += 1
-            if separated_num >= separated_max_count:
-                break
-
-        self.__planets += separated[1:]
+                indexes = np.unique(self.__rng.integers(len(active), size=min(len(active), POISSON_ACTIVE_BATCH)))
+                centers = np.array([active[index] for index in indexes.tolist()])
+                # candidates uniform in angle and in radius over [distance, 2 * distance)
+                angle, radius = self.__rng.random((2, len(indexes), POISSON_CANDIDATES))
+                angle *= 2 * math.pi
+                radius = distance * (1 + radius)
+                xs = centers[:, 0, None] + radius * np.cos(angle)
+                ys = centers[:, 1, None] + radius * np.sin(angle)
+                valid = self.__in_screen(xs, ys)
+                valid[valid] = self.__outside_homes(xs[valid], ys[valid])
+                valid[valid] = self.__grid.free(xs[valid], ys[valid])
+
+                # the first free candidate of every active point, the ones without any are done
+                found = valid.any(axis=1)
+                rows = np.flatnonzero(found)
+                columns = valid[rows].argmax(axis=1)
+                xs, ys = xs[rows, columns], ys[rows, columns]
+                # candidates of different active points may clash, the later ones get another step
+                clash = np.triu((xs[:, None] - xs) ** 2 + (ys[:, None] - ys) ** 2 < limit, 1).any(axis=0)
+                points = list(zip(xs[~clash].tolist(), ys[~clash].tolist()))
+
+                for index in sorted(indexes[~found].tolist(), reverse=True):
+                    active[index] = active[-1]
+                    active.pop()
+
+            if not self.__fill:
+                points = points[:max_count - len(placed)]
+            types = self.__rng.choice(len(PLANET_TYPES), len(points), p=PLANET_TYPE_WEIGHTS).tolist()
+            for (x, y), planet_type in zip(points, types):
+                self.__grid.add(x, y)
+                placed.append(self.__planet(Coords(x, y), PLANET_TYPES[planet_type]))
+                active.append((x, y))
+
+        self.__planets += placed
 
     def display(self):
+        # interactive debugging only, the server renders maps off-thread through renderer.MapRenderer
+        import matplotlib.pyplot as plt
+
         # print(len(self.__planets))
         coords = []
 
@@ -250,6 +381,12 @@ class MapGenerator(object):
 
         plt.show()
 
+
+def regenerate(seed, players_ids, params=None):
+    # reference for clients getting a seed only mapinit: the same planets the server generated
+    generator = MapGenerator(ids=generate_id(), seed=seed, **(params or {}))
+    return [planet.get_dict() for planet in generator.run(players_ids)]
+
 #
 # test = MapGenerator(SCREEN_MULTIPLIER)
 # print(test.run(PLAYERS))
@@ -0,0 +1,85 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from map_generator import MapGenerator
+from planet import PlanetStore
+from utils import generate_id
+
+MIN_PLAYERS = 2
+MAX_PLAYERS = 8
+POOL_SIZE = 2
+
+
+def generate_map(players_count, generator_options):
+    # players are numbered 1..players_count, MapPool.pop gives the planets to the real ones
+    generator = MapGenerator(ids=generate_id(), **generator_options)
+    return generator.seed, PlanetStore.from_planets(generator.run(list(range(1, players_count + 1))))
+
+
+class MapPool(object):
+    def __init__(self, pool_size=POOL_SIZE, workers=None, players=range(MIN_PLAYERS, MAX_PLAYERS + 1),
+                 **generator_options):
+        self.pool_size = pool_size
+        self.workers = workers
+        self.players = tuple(players)
+        self.generator_options = generator_options
+        self.params = MapGenerator(**generator_options).params
+        self.generated = 0
+        self.missed = 0
+        self.__stock = {players_count: deque() for players_count in self.players}
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def start(self):
+        # spawn, so the generator processes don't inherit the server's sockets
+        self.__executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        with self.__lock:
+            for players_count in self.players:
+                self.__refill(players_count)
+
+    def stop(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+            self.__executor = None
+
+    def __refill(self, players_count):
+        stock = self.__stock[players_count]
+        while self.__executor is not None and len(stock) < self.pool_size:
+            stock.append(self.__executor.submit(generate_map, players_count, self.generator_options))
+
+    def ready(self, players_count):
+        with self.__lock:
+            return sum(future.done() and not future.exception() for future in self.__stock.get(players_count, ()))
+
+    def __take(self, players_count):
+        with self.__lock:
+            stock = self.__stock.get(players_count)
+            if not stock:
+                return None
+
+            generated = None
+            for future in tuple(stock):
+                if future.done():
+                    stock.remove(future)
+                    if not future.exception():
+                        generated = future.result()
+                        break
+
+            self.__refill(players_count)
+            return generated
+
+    def pop(self, players_ids):
+        generated = self.__take(len(players_ids))
+        if generated is None:
+            # nothing generated yet for this many players, build it here like without a pool
+            self.missed += 1
+            generated = generate_map(len(players_ids), self.generator_options)
+        else:
+            self.generated += 1
+
+        # owners only depend on the players order, so the seed regenerates the map for the real ids as well
+        seed, planets = generated
+        planets.replace_owners(dict(zip(range(1, len(players_ids) + 1), players_ids)))
+        return seed, planets
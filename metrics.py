@@ -0,0 +1,162 @@
+from bisect import bisect_left
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from utils import StoppedThread
+
+METRICS_PREFIX = 'servachok_'
+METRICS_PATH = '/metrics'
+METRICS_TIMEOUT = 0.5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# seconds, from a cheap handler call to a map generated on the handler thread
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is above every bucket, rendered as +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        # name -> (kind, help, callback, buckets), rendered in the order they were declared
+        self.__declared = {}
+        # (name, labels) -> value or Histogram, labels are a tuple of (key, value) pairs.
+        # No lock: every metric has one writing thread, and a scrape only copies what is there under the GIL
+        self.__values = {}
+
+    def __declare(self, name, kind, help_text, callback=None, buckets=None):
+        if name in self.__declared:
+            raise ValueError('metric {!r} is already declared'.format(name))
+        self.__declared[name] = (kind, help_text, callback, buckets)
+
+    def counter(self, name, help_text, callback=None):
+        self.__declare(name, COUNTER, help_text, callback)
+
+    def gauge(self, name, help_text, callback):
+        # gauges are read when scraped, nothing is paid for them in between
+        self.__declare(name, GAUGE, help_text, callback)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.__declare(name, HISTOGRAM, help_text, buckets=tuple(buckets))
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        self.__values[key] = self.__values.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        histogram = self.__values.get((name, labels))
+        if histogram is None:
+            histogram = self.__values[(name, labels)] = Histogram(self.__declared[name][3])
+        histogram.observe(value)
+
+    def value(self, name, labels=()):
+        value = self.__values.get((name, labels), 0)
+        return (sum(value.counts), value.sum) if isinstance(value, Histogram) else value
+
+    def __samples(self, name, kind, callback):
+        if callback is not None:
+            collected = callback()
+            # a callback returns one value, or a {labels: value} dict for labelled samples
+            return sorted(collected.items()) if isinstance(collected, dict) else [((), collected)]
+
+        samples = [(labels, value) for (metric, labels), value in tuple(self.__values.items()) if metric == name]
+        if kind == HISTOGRAM:
+            samples = [(labels, (list(value.counts), value.sum)) for labels, value in samples]
+        return sorted(samples)
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, callback, buckets) in tuple(self.__declared.items()):
+            full_name = self.prefix + name
+            lines.append('# HELP {} {}'.format(full_name, help_text))
+            lines.append('# TYPE {} {}'.format(full_name, kind))
+
+            for labels, value in self.__samples(name, kind, callback):
+                if kind != HISTOGRAM:
+                    lines.append('{}{} {}'.format(full_name, format_labels(labels), format_value(value)))
+                    continue
+
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), counts):
+                    cumulative += count
+                    bucket_labels = format_labels(labels + (('le', format_value(bound)),))
+                    lines.append('{}_bucket{} {}'.format(full_name, bucket_labels, cumulative))
+                lines.append('{}_sum{} {}'.format(full_name, format_labels(labels), format_value(total)))
+                lines.append('{}_count{} {}'.format(full_name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != METRICS_PATH:
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes come every few seconds, they don't belong in the server's output
+        pass
+
+
+class MetricsEndpoint(object):
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        self.metrics = metrics
+        self.__http = HTTPServer((host, port), MetricsHandler)
+        self.__http.metrics = metrics
+        self.__http.timeout = METRICS_TIMEOUT
+        self.__thread = None
+
+    @property
+    def address(self):
+        return self.__http.server_address
+
+    def start(self):
+        self.__thread = StoppedThread(name='metrics', target=self.__serve, args=())
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__thread.stop()
+            self.__thread.join()
+            self.__thread = None
+        self.__http.server_close()
+
+    def __serve(self, is_alive):
+        while is_alive():
+            self.__http.handle_request()
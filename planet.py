@@ -1,6 +1,10 @@
 from enum import IntEnum
 
-from utils import id_generator
+import numpy as np
+
+from utils import Coords, id_generator
+
+NO_OWNER = -1
 
 
 class PlanetType(IntEnum):
@@ -10,19 +14,214 @@ class PlanetType(IntEnum):
     BIGGEST = 4
 
 
-class Planet:
+PLANET_TYPES = {planet_type.value: planet_type for planet_type in PlanetType}
+
+
+def _column(name):
+    return property(lambda self: self.column(name)[:len(self)])
+
+
+class PlanetStore(object):
+    COLUMNS = (('ids', np.int64, 0), ('x', np.float64, 0), ('y', np.float64, 0), ('type', np.int8, 0),
+               ('units_count', np.int64, 0), ('owner', np.int64, NO_OWNER))
+
+    def __init__(self, capacity=64):
+        self.__size = 0
+        self.__columns = {name: np.full(capacity, default, dtype=dtype) for name, dtype, default in self.COLUMNS}
+        self.__indexes = {}
+
+    ids = _column('ids')
+    x = _column('x')
+    y = _column('y')
+    type = _column('type')
+    units_count = _column('units_count')
+    owner = _column('owner')
+
+    @classmethod
+    def from_planets(cls, planets):
+        store = cls(max(len(planets), 1))
+        for planet in planets:
+            store.add(planet.id, planet.coords.x, planet.coords.y, planet.type, planet.units_count, planet.owner)
+        return store
+
+    def __len__(self):
+        return self.__size
+
+    def __contains__(self, planet_id):
+        return planet_id in self.__indexes
+
+    def __getitem__(self, planet_id):
+        return Planet.view(self, self.__indexes[planet_id])
+
+    def __iter__(self):
+        return iter(self.__indexes)
+
+    def column(self, name):
+        return self.__columns[name]
+
+    def __grow(self):
+        for name, dtype, default in self.COLUMNS:
+            column = self.__columns[name]
+            grown = np.full(2 * len(column), default, dtype=dtype)
+            grown[:len(column)] = column
+            self.__columns[name] = grown
+
+    def add(self, planet_id, x, y, planet_type, units_count, owner=None):
+        if planet_id in self.__indexes:
+            raise ValueError('planet {} is already stored'.format(planet_id))
+        if self.__size == len(self.__columns['ids']):
+            self.__grow()
+
+        index = self.__size
+        self.__size += 1
+        self.__indexes[planet_id] = index
+
+        columns = self.__columns
+        columns['ids'][index] = planet_id
+        columns['x'][index] = x
+        columns['y'][index] = y
+        columns['type'][index] = planet_type
+        columns['units_count'][index] = units_count
+        columns['owner'][index] = NO_OWNER if owner is None else owner
+        return index
+
+    def index(self, planet_id):
+        return self.__indexes[planet_id]
+
+    def values(self):
+        return [Planet.view(self, index) for index in range(self.__size)]
+
+    def dicts(self):
+        # what Planet.get_dict gives for every planet, a tolist() per column instead of a view per field
+        size = self.__size
+        columns = [self.__columns[name][:size].tolist() for name in ('ids', 'x', 'y', 'type', 'units_count', 'owner')]
+        return [{'type': PLANET_TYPES[planet_type], 'units_count': units_count,
+                 'owner': None if owner == NO_OWNER else owner, 'coords': {'x': x, 'y': y}, 'id': planet_id}
+                for planet_id, x, y, planet_type, units_count, owner in zip(*columns)]
+
+    def replace_owners(self, owners):
+        owner = self.owner
+        replaced = owner.copy()
+        for old, new in owners.items():
+            replaced[owner == old] = NO_OWNER if new is None else new
+        owner[:] = replaced
+
+    def owns(self, player_id):
+        return bool(np.any(self.owner == player_id))
+
+    def owned_by(self, player_id):
+        return self.ids[self.owner == player_id]
+
+    def owners(self):
+        owners = np.unique(self.owner)
+        return set(owners[owners != NO_OWNER].tolist())
+
+    def planets_per_owner(self):
+        owner = self.owner
+        owners, counts = np.unique(owner[owner != NO_OWNER], return_counts=True)
+        return dict(zip(owners.tolist(), counts.tolist()))
+
+    def units_per_owner(self):
+        owner = self.owner
+        owned = owner != NO_OWNER
+        owners, inverse = np.unique(owner[owned], return_inverse=True)
+        totals = np.bincount(inverse, weights=self.units_count[owned], minlength=len(owners))
+        return dict(zip(owners.tolist(), totals.astype(np.int64).tolist()))
+
+
+class PlanetCoords(Coords):
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def x(self):
+        return float(self.store.column('x')[self.index])
+
+    @x.setter
+    def x(self, value):
+        self.store.column('x')[self.index] = value
+
+    @property
+    def y(self):
+        return float(self.store.column('y')[self.index])
+
+    @y.setter
+    def y(self, value):
+        self.store.column('y')[self.index] = value
+
+
+class Planet(object):
+    __slots__ = ('store', 'index')
+
     cache = {}
 
-    def __init__(self, coords, planet_type, owner=None):
-        self.coords = coords
-        self.type = planet_type
-        self.units_count = 50 * planet_type.value
-        self.owner = owner
-        self.__id = next(id_generator)
+    def __init__(self, coords, planet_type, owner=None, planet_id=None, store=None):
+        # planets with an explicit id belong to a room, the others share the global cache
+        register = planet_id is None
+        if register:
+            planet_id = next(id_generator)
+
+        self.store = PlanetStore(1) if store is None else store
+        self.index = self.store.add(planet_id, coords.x, coords.y, planet_type, 50 * planet_type.value, owner)
+
+        if register:
+            self.cache[planet_id] = self
+
+    @classmethod
+    def view(cls, store, index):
+        planet = cls.__new__(cls)
+        planet.store = store
+        planet.index = index
+        return planet
+
+    def __eq__(self, other):
+        return isinstance(other, Planet) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    @property
+    def id(self):
+        return int(self.store.column('ids')[self.index])
+
+    @property
+    def coords(self):
+        return PlanetCoords(self.store, self.index)
+
+    @coords.setter
+    def coords(self, coords):
+        self.store.column('x')[self.index] = coords.x
+        self.store.column('y')[self.index] = coords.y
+
+    @property
+    def type(self):
+        return PlanetType(int(self.store.column('type')[self.index]))
+
+    @type.setter
+    def type(self, planet_type):
+        self.store.column('type')[self.index] = planet_type
+
+    @property
+    def units_count(self):
+        return int(self.store.column('units_count')[self.index])
+
+    @units_count.setter
+    def units_count(self, units_count):
+        self.store.column('units_count')[self.index] = units_count
+
+    @property
+    def owner(self):
+        owner = int(self.store.column('owner')[self.index])
+        return None if owner == NO_OWNER else owner
 
-        self.cache[self.__id] = self
+    @owner.setter
+    def owner(self, owner):
+        self.store.column('owner')[self.index] = NO_OWNER if owner is None else owner
 
     def get_dict(self):
         result_dict = {'type': self.type, 'units_count': self.units_count, 'owner': self.owner,
-                       'coords': self.coords.get_dict(), 'id': self.__id}
+                       'coords': self.coords.get_dict(), 'id': self.id}
         return result_dict
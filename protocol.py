@@ -0,0 +1,275 @@
+import json
+import struct
+
+PROTOCOL_VERSION = 1
+
+JSON_ENCODING = 'json'
+BINARY_ENCODING = 'binary'
+ENCODINGS = (JSON_ENCODING, BINARY_ENCODING)
+
+FRAME_HEADER = struct.Struct('i')
+BINARY_FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20
+
+# first byte of a binary frame body
+JSON_CODE = 0
+MOVE_CODE = 1
+DAMAGE_CODE = 2
+DAMAGE_RESULT_CODE = 3
+ADD_HP_CODE = 4
+SELECT_CODE = 5
+SELECT_RESULT_CODE = 6
+MOVES_CODE = 7
+SNAPSHOT_CODE = 8
+DAMAGES_CODE = 9
+
+NO_OWNER = 0
+
+MOVE = struct.Struct('!BIff')
+MOVES = struct.Struct('!BH')
+MOVE_RECORD = struct.Struct('!Iff')
+DAMAGE = struct.Struct('!BIIi')
+DAMAGE_RESULT = struct.Struct('!BIIII')
+ADD_HP = struct.Struct('!BIi')
+SELECT = struct.Struct('!BBH')
+SELECT_RESULT = struct.Struct('!BH')
+SELECTED_PLANET = struct.Struct('!III')
+UNIT_ID = struct.Struct('!I')
+SNAPSHOT = struct.Struct('!B?IIH')
+SNAPSHOT_PLANET = struct.Struct('!III')
+DAMAGES = struct.Struct('!BHH')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def request(string):
+    return struct.pack('i', len(string)) + string.encode('utf-8')
+
+
+def hello(encoding=None):
+    message = {'name': 'hello', 'protocol': PROTOCOL_VERSION}
+    if encoding is None:
+        message['encodings'] = list(ENCODINGS)
+    else:
+        message['encoding'] = encoding
+    return message
+
+
+def negotiate(event):
+    encoding = event.get('encoding', JSON_ENCODING)
+    if event.get('protocol') != PROTOCOL_VERSION or encoding not in ENCODINGS:
+        return JSON_ENCODING
+    return encoding
+
+
+def frame_header(encoding):
+    return BINARY_FRAME_HEADER if encoding == BINARY_ENCODING else FRAME_HEADER
+
+
+def _encode_move(event):
+    if event.keys() == {'name', 'unit_id', 'x', 'y'}:
+        return MOVE.pack(MOVE_CODE, int(event['unit_id']), event['x'], event['y'])
+
+
+def _encode_moves(event):
+    if event.keys() == {'name', 'moves'} and all(move.keys() == {'name', 'unit_id', 'x', 'y'}
+                                                 for move in event['moves']):
+        return MOVES.pack(MOVES_CODE, len(event['moves'])) + \
+            b''.join(MOVE_RECORD.pack(int(move['unit_id']), move['x'], move['y']) for move in event['moves'])
+
+
+def _encode_damage(event):
+    if {'name', 'planet_id', 'unit_id'} <= event.keys() <= {'name', 'planet_id', 'unit_id', 'hp_count'}:
+        return DAMAGE.pack(DAMAGE_CODE, int(event['planet_id']), int(event['unit_id']),
+                           int(event.get('hp_count', 1)))
+
+    if event.keys() == {'name', 'planet_change', 'unit_id'}:
+        change = event['planet_change']
+        owner = NO_OWNER if change['owner'] is None else change['owner']
+        return DAMAGE_RESULT.pack(DAMAGE_RESULT_CODE, change['id'], change['units_count'], owner,
+                                  event['unit_id'])
+
+
+def _encode_add_hp(event):
+    if event.keys() == {'name', 'planet_id', 'hp_count'}:
+        return ADD_HP.pack(ADD_HP_CODE, int(event['planet_id']), int(event['hp_count']))
+
+
+def _encode_select(event):
+    if event.keys() == {'name', 'from', 'percentage'}:
+        planets = event['from']
+        return SELECT.pack(SELECT_CODE, int(event['percentage']), len(planets)) + \
+            b''.join(UNIT_ID.pack(int(planet_id)) for planet_id in planets)
+
+    if event.keys() == {'name', 'selected'}:
+        return SELECT_RESULT.pack(SELECT_RESULT_CODE, len(event['selected'])) + \
+            b''.join(SELECTED_PLANET.pack(int(planet_id), start, count)
+                     for planet_id, (start, count) in event['selected'].items())
+
+
+def _encode_snapshot(event):
+    keyframe = event.keys() == {'name', 'id', 'keyframe', 'planets'} and event['keyframe'] is True
+    if keyframe or event.keys() == {'name', 'id', 'base', 'planets'}:
+        return SNAPSHOT.pack(SNAPSHOT_CODE, keyframe, event['id'], 0 if keyframe else event['base'],
+                             len(event['planets'])) + \
+            b''.join(SNAPSHOT_PLANET.pack(planet_id, units_count, NO_OWNER if owner is None else owner)
+                     for planet_id, units_count, owner in event['planets'])
+
+
+def _encode_damages(event):
+    if event.keys() == {'name', 'units', 'planets'}:
+        return DAMAGES.pack(DAMAGES_CODE, len(event['units']), len(event['planets'])) + \
+            struct.pack('!{}I'.format(len(event['units'])), *event['units']) + \
+            b''.join(SNAPSHOT_PLANET.pack(planet_id, units_count, NO_OWNER if owner is None else owner)
+                     for planet_id, units_count, owner in event['planets'])
+
+
+def _decode_move(body):
+    _, unit_id, x, y = MOVE.unpack(body)
+    return {'name': 'move', 'unit_id': unit_id, 'x': x, 'y': y}
+
+
+def _decode_moves(body):
+    _, count = MOVES.unpack_from(body)
+    if len(body) != MOVES.size + count * MOVE_RECORD.size:
+        raise ProtocolError('wrong moves frame size')
+    return {
+        'name': 'moves',
+        'moves': [{'name': 'move', 'unit_id': unit_id, 'x': x, 'y': y}
+                  for unit_id, x, y in MOVE_RECORD.iter_unpack(body[MOVES.size:])],
+    }
+
+
+def _decode_damage(body):
+    _, planet_id, unit_id, hp_count = DAMAGE.unpack(body)
+    return {'name': 'damage', 'planet_id': planet_id, 'unit_id': unit_id, 'hp_count': hp_count}
+
+
+def _decode_damage_result(body):
+    _, planet_id, units_count, owner, unit_id = DAMAGE_RESULT.unpack(body)
+    return {
+        'name': 'damage',
+        'planet_change': {'id': planet_id,
+                          'units_count': units_count,
+                          'owner': None if owner == NO_OWNER else owner},
+        'unit_id': unit_id,
+    }
+
+
+def _decode_add_hp(body):
+    _, planet_id, hp_count = ADD_HP.unpack(body)
+    return {'name': 'add_hp', 'planet_id': planet_id, 'hp_count': hp_count}
+
+
+def _decode_select(body):
+    _, percentage, count = SELECT.unpack_from(body)
+    planets = struct.unpack_from('!{}I'.format(count), body, SELECT.size)
+    return {'name': 'select', 'from': list(planets), 'percentage': percentage}
+
+
+def _decode_select_result(body):
+    _, count = SELECT_RESULT.unpack_from(body)
+    if len(body) != SELECT_RESULT.size + count * SELECTED_PLANET.size:
+        raise ProtocolError('wrong select frame size')
+    return {
+        'name': 'select',
+        'selected': {planet_id: [start, units_count]
+                     for planet_id, start, units_count in SELECTED_PLANET.iter_unpack(body[SELECT_RESULT.size:])},
+    }
+
+
+def _decode_snapshot(body):
+    _, keyframe, snapshot_id, base, count = SNAPSHOT.unpack_from(body)
+    if len(body) != SNAPSHOT.size + count * SNAPSHOT_PLANET.size:
+        raise ProtocolError('wrong snapshot frame size')
+
+    event = {
+        'name': 'snapshot',
+        'id': snapshot_id,
+        'planets': [[planet_id, units_count, None if owner == NO_OWNER else owner]
+                    for planet_id, units_count, owner in SNAPSHOT_PLANET.iter_unpack(body[SNAPSHOT.size:])],
+    }
+    if keyframe:
+        event['keyframe'] = True
+    else:
+        event['base'] = base
+    return event
+
+
+def _decode_damages(body):
+    _, units_count, planets_count = DAMAGES.unpack_from(body)
+    planets_offset = DAMAGES.size + units_count * UNIT_ID.size
+    if len(body) != planets_offset + planets_count * SNAPSHOT_PLANET.size:
+        raise ProtocolError('wrong damages frame size')
+    return {
+        'name': 'damages',
+        'units': list(struct.unpack_from('!{}I'.format(units_count), body, DAMAGES.size)),
+        'planets': [[planet_id, units, None if owner == NO_OWNER else owner]
+                    for planet_id, units, owner in SNAPSHOT_PLANET.iter_unpack(body[planets_offset:])],
+    }
+
+
+def _decode_json(body):
+    return json.loads(body[1:])
+
+
+BINARY_ENCODERS = {
+    'move': _encode_move,
+    'moves': _encode_moves,
+    'damage': _encode_damage,
+    'add_hp': _encode_add_hp,
+    'select': _encode_select,
+    'snapshot': _encode_snapshot,
+    'damages': _encode_damages,
+}
+
+BINARY_DECODERS = {
+    JSON_CODE: _decode_json,
+    MOVE_CODE: _decode_move,
+    MOVES_CODE: _decode_moves,
+    DAMAGE_CODE: _decode_damage,
+    DAMAGE_RESULT_CODE: _decode_damage_result,
+    ADD_HP_CODE: _decode_add_hp,
+    SELECT_CODE: _decode_select,
+    SELECT_RESULT_CODE: _decode_select_result,
+    SNAPSHOT_CODE: _decode_snapshot,
+    DAMAGES_CODE: _decode_damages,
+}
+
+
+def encode_binary(event):
+    encoder = BINARY_ENCODERS.get(event['name'])
+    try:
+        body = encoder(event) if encoder else None
+    except (struct.error, TypeError, ValueError):
+        # out of range or unexpected values, the JSON fallback carries them as is
+        body = None
+
+    if body is None:
+        body = bytes((JSON_CODE,)) + json.dumps(event).encode('utf-8')
+    return BINARY_FRAME_HEADER.pack(len(body)) + body
+
+
+def encode_event(event, encoding=JSON_ENCODING):
+    if encoding == BINARY_ENCODING:
+        return encode_binary(event)
+    return request(json.dumps(event))
+
+
+def decode_event(frame, encoding=JSON_ENCODING):
+    if encoding != BINARY_ENCODING:
+        event = json.loads(frame)
+    elif not frame or frame[0] not in BINARY_DECODERS:
+        raise ProtocolError('unknown binary event')
+    else:
+        try:
+            event = BINARY_DECODERS[frame[0]](frame)
+        except struct.error as error:
+            raise ProtocolError(str(error))
+
+    # valid JSON isn't an event yet, everything past here looks events up by name
+    if not isinstance(event, dict) or not isinstance(event.get('name'), str):
+        raise ProtocolError('an event is an object with a string name')
+    return event
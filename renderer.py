@@ -0,0 +1,81 @@
+import os
+from queue import Queue, Empty, Full
+
+from map_generator import MapGenerator
+from planet import NO_OWNER
+from utils import StoppedThread
+
+RENDER_FORMATS = ('png', 'svg')
+RENDER_QUEUE_SIZE = 16
+RENDER_TIMEOUT = 0.5
+
+OWNER_COLORS = ['blue', 'green', 'cyan', 'magenta', 'olive', 'pink', 'gray', 'black']
+TYPE_COLORS = ['red', 'orange', 'brown', 'purple']
+
+
+def render_map(path, xs, ys, types, owners, length, height):
+    # matplotlib is only loaded once a map is actually drawn, Figure keeps pyplot's global state out of it
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Rectangle
+
+    figure = Figure(figsize=(16, 9))
+    axes = figure.add_subplot()
+    axes.set_aspect('equal')
+    axes.set_xlim(-length / 2 - 150, length / 2 + 150)
+    axes.set_ylim(-height / 2 - 150, height / 2 + 150)
+    axes.add_patch(Rectangle((-length / 2, -height / 2), length, height, fill=False, color='black'))
+
+    colors = [TYPE_COLORS[planet_type - 1] if owner == NO_OWNER else OWNER_COLORS[owner % len(OWNER_COLORS)]
+              for planet_type, owner in zip(types, owners)]
+    axes.scatter(xs, ys, s=[20 * planet_type for planet_type in types], color=colors)
+    figure.savefig(path)
+
+
+class MapRenderer(object):
+    def __init__(self, directory, render_format='png'):
+        if render_format not in RENDER_FORMATS:
+            raise ValueError('unknown format {!r}, expected one of {}'.format(render_format, RENDER_FORMATS))
+
+        self.directory = directory
+        self.render_format = render_format
+        self.rendered = []
+        self.dropped = 0
+        self.__queue = Queue(RENDER_QUEUE_SIZE)
+        self.__thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.__thread = StoppedThread(name='renderer', target=self.__render, args=())
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__thread.stop()
+            self.__thread.join()
+            self.__thread = None
+
+    def submit(self, name, planets, screen_scale_multiplier):
+        # the columns are copied here, the match goes on changing the store while the map is drawn
+        snapshot = (name, planets.x.tolist(), planets.y.tolist(), planets.type.tolist(), planets.owner.tolist(),
+                    MapGenerator.LENGTH_MULTIPLIER * screen_scale_multiplier,
+                    MapGenerator.HEIGHT_MULTIPLIER * screen_scale_multiplier)
+        try:
+            self.__queue.put_nowait(snapshot)
+        except Full:
+            # rendering is a debugging aid, a match never waits for it
+            self.dropped += 1
+
+    def __render(self, is_alive):
+        while is_alive() or not self.__queue.empty():
+            try:
+                name, *snapshot = self.__queue.get(timeout=RENDER_TIMEOUT)
+            except Empty:
+                continue
+
+            path = os.path.join(self.directory, '{}.{}'.format(name, self.render_format))
+            try:
+                render_map(path, *snapshot)
+            except Exception as error:
+                print('map {} was not rendered: {}'.format(name, error))
+            else:
+                self.rendered.append(path)
@@ -0,0 +1,114 @@
+# plays a match journal back through a room, at full speed or at the recorded pace
+# python replay.py journals/20240601-120000-4242-room-1.journal --speed 1
+import argparse
+import json
+import time
+from collections import Counter
+
+from journal import JournalReader, JournalError, OPEN, JOIN, LEAVE, EVENT, TICK, SEED, BROADCAST
+from map_generator import MapGenerator
+from planet import PlanetStore
+from protocol import encode_binary
+from room import Room, EVENT_ERRORS
+from utils import MaxPriorityQueue, generate_id
+
+
+class ReplayClient(object):
+    def __init__(self, player_id):
+        self.address = ('replay', player_id)
+
+
+class JournalMaps(object):
+    # stands in for the map pool, the room gets the journaled maps back in order
+    def __init__(self, seeds):
+        self.__seeds = list(seeds)
+        self.params = None
+
+    def pop(self, players_ids):
+        if not self.__seeds:
+            raise JournalError('the journal has no map left for this mapinit')
+        seed, self.params = self.__seeds.pop(0)
+        generator = MapGenerator(ids=generate_id(), seed=seed, **(self.params or {}))
+        return seed, PlanetStore.from_planets(generator.run(players_ids))
+
+
+def replay(path, speed=0):
+    with JournalReader(path) as journal:
+        seeds = [(record['seed'], record['params']) for kind, _, _, record in journal if kind == SEED]
+
+        queue = MaxPriorityQueue()
+        room = None
+        clients = {}
+        # what the server sent against what the replayed room sends, by (player, frame)
+        recorded = Counter()
+        replayed = Counter()
+        stats = {'records': 0, 'events': 0, 'rejected': 0, 'ticks': 0, 'handler_seconds': 0.0}
+        started = time.perf_counter()
+
+        for kind, player, at, record in journal:
+            stats['records'] += 1
+            if speed:
+                delay = started + at / 1e9 / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            handling = time.perf_counter()
+            if kind == OPEN:
+                options = {key: value for key, value in record.items() if key != 'name'}
+                room = Room(journal.room_id, queue, map_pool=JournalMaps(seeds), **options)
+            elif kind == JOIN:
+                clients[player] = ReplayClient(player)
+                if room.join(clients[player])['id'] != player:
+                    raise JournalError('player {} joined under another id'.format(player))
+            elif kind == LEAVE:
+                room.leave(clients.pop(player))
+            elif kind == EVENT:
+                try:
+                    room.handle_event(record, clients[player])
+                except EVENT_ERRORS:
+                    # the server rejected it too
+                    stats['rejected'] += 1
+                stats['events'] += 1
+            elif kind == TICK:
+                room.tick()
+                stats['ticks'] += 1
+            elif kind == BROADCAST:
+                recorded[(player, encode_binary(record))] += 1
+                continue
+            else:
+                continue
+            stats['handler_seconds'] += time.perf_counter() - handling
+
+            for message, _, recipients in queue.drain():
+                # the server's copy went through the encoding, so compare both encoded
+                frame = encode_binary(message)
+                if recipients is None:
+                    replayed[(0, frame)] += 1
+                for client in recipients or ():
+                    replayed[(client.address[1], frame)] += 1
+
+    stats['elapsed'] = time.perf_counter() - started
+    stats['events_per_second'] = stats['events'] / stats['handler_seconds'] if stats['handler_seconds'] else 0.0
+    stats['broadcasts'] = sum(recorded.values())
+    # a desync shows up as broadcasts only one of the two runs made
+    stats['missing'] = sum((recorded - replayed).values())
+    stats['unexpected'] = sum((replayed - recorded).values())
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('journals', nargs='+')
+    parser.add_argument('--speed', type=float, default=0, help='1 for the recorded pace, 0 for as fast as possible')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    for path in args.journals:
+        stats = replay(path, args.speed)
+        if args.json:
+            print(json.dumps(dict(stats, journal=path)))
+        else:
+            print('{}: {} records, {} events and {} ticks in {:.3f} s, handler {:.0f} events/s, '
+                  '{} broadcasts, {} missing, {} unexpected'.format(
+                      path, stats['records'], stats['events'], stats['ticks'], stats['elapsed'],
+                      stats['events_per_second'], stats['broadcasts'], stats['missing'], stats['unexpected']))
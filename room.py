@@ -0,0 +1,436 @@
+import time
+
+import numpy as np
+
+from map_generator import MapGenerator
+from planet import Planet, PlanetStore, NO_OWNER
+from utils import generate_id, UnitRanges
+
+# every that many snapshots all clients get the full planets state
+KEYFRAME_INTERVAL = 30
+# what handle_event raises on a malformed event: a missing field, an unknown planet or unit, a wrong type
+EVENT_ERRORS = (KeyError, IndexError, ValueError, TypeError)
+
+
+class Room(object):
+    def __init__(self, room_id, sender_queue, max_players=8, coalesce_moves=False, check_counters=False,
+                 map_pool=None, seed_mapinit=False, renderer=None, state_sync=False, batch_damage=False,
+                 metrics=None):
+        self.id = room_id
+        self.max_players = max_players
+        self.coalesce_moves = coalesce_moves
+        # planet changes are sent as snapshots on tick instead of with every event
+        self.state_sync = state_sync
+        self.snapshot_id = 0
+        # damage is resolved once per tick for all the hits since the last one
+        self.batch_damage = batch_damage
+        # mapinit carries the seed to regenerate the map from instead of the planets
+        self.seed_mapinit = seed_mapinit
+        # compare the maintained counters against a full scan after every change
+        self.check_counters = check_counters
+        self.players = {}
+        self.planets = PlanetStore()
+        self.next_player_id = 0
+        self.readiness = False
+        self.game_started = False
+        self.finished = False
+        # the current map regenerates from them
+        self.seed = None
+        self.map_params = None
+
+        self.__sender_queue = sender_queue
+        self.__map_pool = map_pool
+        self.__renderer = renderer
+        self.__metrics = metrics
+        self.__next_unit_id = 1
+        self.__pending_moves = {}
+        self.__pending_damages = []
+
+        # player id -> player, planets owned per player id, and players with planets and units in flight
+        self.__players_by_id = {}
+        self.__planets_owned = {}
+        self.__active_players = set()
+
+        # planets changed since the last snapshot, and the snapshot each planet last changed in
+        self.__dirty = set()
+        self.__versions = np.zeros(0, dtype=np.int64)
+
+    @property
+    def clients(self):
+        return tuple(self.players)
+
+    def is_open(self):
+        return not self.finished and not self.game_started and not self.readiness and \
+            len(self.players) < self.max_players
+
+    def empty(self):
+        return not self.players
+
+    def emit(self, message, priority=1, clients=None):
+        # clients is None for everybody in the room
+        self.__sender_queue.insert((message, self, clients), priority)
+
+    def join(self, client):
+        self.next_player_id += 1
+        player = {
+            'id': self.next_player_id,
+            'address': client.address,
+            'ready': False,
+            'rendered': False,
+            'object_ids': UnitRanges(),
+            'acked': 0,
+            'name': 'client {}'.format(self.next_player_id),
+        }
+
+        self.players[client] = player
+        self.__players_by_id[player['id']] = player
+
+        self.emit({
+            'name': 'connect',
+            'player': {
+                'id': player['id'],
+                'name': player['name'],
+                'ready': player['ready'],
+            },
+        })
+
+        return player
+
+    def leave(self, client):
+        player = self.players.pop(client, None)
+        if player is not None:
+            self.__players_by_id.pop(player['id'], None)
+            self.__active_players.discard(player['id'])
+
+    def all_clients(self, field):
+        return all(player[field] for player in self.players.values())
+
+    @property
+    def active_players(self):
+        return frozenset(self.__active_players)
+
+    def planets_owned(self, player_id):
+        return self.__planets_owned.get(player_id, 0)
+
+    def __refresh_player(self, player_id):
+        player = self.__players_by_id.get(player_id)
+        if player is not None and self.planets_owned(player_id) and len(player['object_ids']):
+            self.__active_players.add(player_id)
+        else:
+            self.__active_players.discard(player_id)
+
+    def __change_owner(self, planet, owner):
+        previous = planet.owner
+        planet.owner = owner
+
+        if previous is not None:
+            self.__planets_owned[previous] -= 1
+            self.__refresh_player(previous)
+        self.__planets_owned[owner] = self.planets_owned(owner) + 1
+        self.__refresh_player(owner)
+
+    def __reset_counters(self):
+        self.__planets_owned = self.planets.planets_per_owner()
+        self.__active_players = set()
+        for player_id in self.__players_by_id:
+            self.__refresh_player(player_id)
+
+    def scan_active_players(self):
+        planets_owned = self.planets.planets_per_owner()
+        return {player['id'] for player in self.players.values()
+                if planets_owned.get(player['id'], 0) and len(player['object_ids'])}
+
+    def verify_counters(self):
+        planets_owned = self.planets.planets_per_owner()
+        for player_id in self.__players_by_id:
+            if self.planets_owned(player_id) != planets_owned.get(player_id, 0):
+                raise RuntimeError('player {} owns {} planets, counted {}'.format(
+                    player_id, planets_owned.get(player_id, 0), self.planets_owned(player_id)))
+
+        active_players = self.scan_active_players()
+        if active_players != self.__active_players:
+            raise RuntimeError('active players are {}, counted {}'.format(
+                sorted(active_players), sorted(self.__active_players)))
+
+    def __changed(self, planet):
+        if self.state_sync:
+            self.__dirty.add(planet.index)
+
+    def snapshot(self, base=None):
+        # planets changed after snapshot base, or all of them for a keyframe
+        if base is None:
+            indexes = slice(None)
+        else:
+            indexes = np.flatnonzero(self.__versions > base)
+
+        owners = self.planets.owner[indexes].tolist()
+        planets = [[planet_id, units_count, None if owner == NO_OWNER else owner]
+                   for planet_id, units_count, owner in zip(self.planets.ids[indexes].tolist(),
+                                                            self.planets.units_count[indexes].tolist(), owners)]
+
+        message = {'name': 'snapshot', 'id': self.snapshot_id, 'planets': planets}
+        if base is None:
+            message['keyframe'] = True
+        else:
+            message['base'] = base
+        return message
+
+    def __sync_state(self):
+        if not self.__dirty:
+            return
+
+        self.snapshot_id += 1
+        self.__versions[list(self.__dirty)] = self.snapshot_id
+        self.__dirty = set()
+
+        # clients acked different snapshots, the ones with the same base share a frame
+        keyframe = self.snapshot_id % KEYFRAME_INTERVAL == 0
+        bases = {}
+        for client, player in self.players.items():
+            lagging = self.snapshot_id - player['acked'] >= KEYFRAME_INTERVAL
+            bases.setdefault(None if keyframe or lagging else player['acked'], []).append(client)
+
+        for base, clients in bases.items():
+            self.emit(self.snapshot(base), clients=clients)
+
+    def __resolve_damages(self):
+        indexes, attackers, units, hps = (np.array(column, dtype=np.int64)
+                                          for column in zip(*self.__pending_damages))
+        self.__pending_damages = []
+
+        # hits of the owner reinforce a planet, all the others damage it
+        owners = self.planets.column('owner')[indexes]
+        friendly = attackers == owners
+        planets, inverse = np.unique(indexes, return_inverse=True)
+        change = np.bincount(inverse, weights=np.where(friendly, hps, -hps), minlength=len(planets))
+        units_count = self.planets.column('units_count')[planets] + change.astype(np.int64)
+
+        # a lost planet goes to its strongest attacker, the lowest player id on a tie
+        hostile = ~friendly
+        keys = inverse[hostile] * (attackers.max() + 1) + attackers[hostile]
+        pairs, pair_inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(pair_inverse, weights=hps[hostile], minlength=len(pairs))
+        pair_planets, pair_attackers = np.divmod(pairs, attackers.max() + 1)
+        order = np.lexsort((pair_attackers, -totals, pair_planets))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair_planets[order][1:] != pair_planets[order][:-1]
+        strongest = np.full(len(planets), NO_OWNER, dtype=np.int64)
+        strongest[pair_planets[order][first]] = pair_attackers[order][first]
+
+        self.planets.column('units_count')[planets] = np.abs(units_count)
+        for position in np.flatnonzero(units_count < 0).tolist():
+            self.__change_owner(Planet.view(self.planets, int(planets[position])), int(strongest[position]))
+
+        for index in planets.tolist():
+            self.__changed(Planet.view(self.planets, index))
+
+        self.emit({
+            'name': 'damages',
+            'units': sorted(units.tolist()),
+            # with state sync the planets come with the next snapshot
+            'planets': [] if self.state_sync else [
+                [planet.id, planet.units_count, planet.owner]
+                for planet in sorted((Planet.view(self.planets, index) for index in planets.tolist()),
+                                     key=lambda planet: planet.id)],
+        })
+
+        self.__check_game_over()
+
+    def __check_game_over(self):
+        if self.check_counters:
+            self.verify_counters()
+
+        if len(self.__active_players) < 2:
+            # the final planets go out before the game over
+            if self.state_sync:
+                self.__sync_state()
+
+            self.emit({
+                'name': 'gameover',
+                'winner': next(iter(self.__active_players), None)
+            })
+
+            self.readiness = False
+            self.game_started = False
+            self.finished = True
+            self.__pending_moves = {}
+            self.__pending_damages = []
+
+    def tick(self):
+        if self.__pending_moves:
+            self.emit({
+                'name': 'moves',
+                'moves': list(self.__pending_moves.values()),
+            }, 0)
+            self.__pending_moves = {}
+
+        if self.__pending_damages:
+            self.__resolve_damages()
+
+        if self.state_sync:
+            self.__sync_state()
+
+    def handle_event(self, event, client):
+        if self.finished or client not in self.players:
+            return
+
+        if event['name'] == "ready":
+            if self.readiness:
+                # the map is out, another one would leave the clients with planets nobody else has
+                return
+            self.players[client]['ready'] = event['ready']
+
+            message = {
+                'name': 'ready',
+                'player': self.players[client]['id'],
+                'ready': event['ready']
+            }
+
+            self.emit(message)
+
+            ready = self.all_clients('ready')
+
+            if ready and len(self.players) > 1:
+                players_ids = [player['id'] for player in self.players.values()]
+                start = time.perf_counter()
+                if self.__map_pool is not None:
+                    seed, self.planets = self.__map_pool.pop(players_ids)
+                    params = self.__map_pool.params
+                else:
+                    # ids start over with every map, so its seed alone gives the same planets
+                    gen = MapGenerator(ids=generate_id())
+                    map = gen.run(players_ids)
+                    seed, params = gen.seed, gen.params
+                    self.planets = PlanetStore.from_planets(map)
+                if self.__metrics is not None:
+                    self.__metrics.observe('map_generation_seconds', time.perf_counter() - start)
+                self.seed, self.map_params = seed, params
+                self.__reset_counters()
+                # the map itself is snapshot 0
+                self.__versions = np.zeros(len(self.planets), dtype=np.int64)
+
+                if self.__renderer is not None:
+                    self.__renderer.submit('room-{}-{}'.format(self.id, seed), self.planets,
+                                           params['screen_scale_multiplier'])
+
+                self.readiness = True
+
+                if self.seed_mapinit:
+                    message = {
+                        'name': 'mapinit',
+                        'seed': seed,
+                        'players': players_ids,
+                        'params': params,
+                    }
+                else:
+                    message = {
+                        'name': 'mapinit',
+                        'map': self.planets.dicts(),
+                    }
+
+                self.emit(message)
+
+        elif event['name'] == 'rendered':
+            self.players[client]['rendered'] = True
+
+            if self.all_clients('rendered'):
+                # TODO game start event
+                self.emit({'name': 'game_started'})
+                self.game_started = True
+
+        elif event['name'] == 'ack':
+            # a client skipping snapshots only acks the latest one it applied
+            player = self.players[client]
+            player['acked'] = max(player['acked'], min(int(event['snapshot']), self.snapshot_id))
+
+        if self.game_started:
+            if event['name'] == 'move':
+                unit_id = int(event['unit_id'])
+                if unit_id in self.players[client]['object_ids']:
+                    if self.coalesce_moves:
+                        # only the latest move of a unit within a tick is broadcast
+                        self.__pending_moves[unit_id] = event
+                    else:
+                        self.emit(event, 0)
+
+            elif event['name'] == 'select':
+                planets_ids = event['from']
+                percentage = event['percentage']
+
+                punits = {}
+
+                for planet_id in planets_ids:
+                    planet_id = int(planet_id)
+                    planet = self.planets[planet_id]
+
+                    if planet.owner == self.players[client]['id']:
+                        units_count = planet.units_count
+                        new_ships_count = round(units_count * int(percentage) / 100.0)
+                        planet.units_count = units_count - new_ships_count
+                        self.__changed(planet)
+                        # units of one selection get consecutive ids and travel as a [start, count] range
+                        punits[planet_id] = [self.__next_unit_id, new_ships_count]
+                        self.players[client]['object_ids'].add(self.__next_unit_id, new_ships_count)
+                        self.__next_unit_id += new_ships_count
+
+                self.__refresh_player(self.players[client]['id'])
+                if self.check_counters:
+                    self.verify_counters()
+
+                self.emit({
+                    'name': 'select',
+                    'selected': punits
+                })
+
+            elif event['name'] == 'add_hp':
+                planet_id = int(event['planet_id'])
+                hp_count = int(event['hp_count'])
+
+                planet = self.planets[planet_id]
+
+                if planet.owner == self.players[client]['id']:
+                    planet.units_count += hp_count
+                    self.__changed(planet)
+                    if not self.state_sync:
+                        self.emit(event)
+
+            elif event['name'] == 'damage':
+                planet_id = int(event['planet_id'])
+                unit_id = int(event['unit_id'])
+                hp_count = int(event.get('hp_count', 1))
+
+                planet = self.planets[planet_id]
+
+                if self.batch_damage:
+                    if unit_id in self.players[client]['object_ids']:
+                        self.__pending_damages.append((planet.index, self.players[client]['id'], unit_id, hp_count))
+                        self.players[client]['object_ids'].remove(unit_id)
+                        self.__refresh_player(self.players[client]['id'])
+                    return
+
+                if unit_id in self.players[client]['object_ids']:
+                    if planet.owner == self.players[client]['id']:
+                        planet.units_count += hp_count
+                    else:
+                        planet.units_count -= hp_count
+                        if planet.units_count < 0:
+                            self.__change_owner(planet, self.players[client]['id'])
+                            planet.units_count = abs(planet.units_count)
+
+                    self.players[client]['object_ids'].remove(unit_id)
+                    self.__refresh_player(self.players[client]['id'])
+                    self.__changed(planet)
+
+                    if self.state_sync:
+                        # the planet comes with the next snapshot
+                        self.emit({'name': 'damage', 'unit_id': unit_id})
+                    else:
+                        self.emit({
+                            'name': 'damage',
+                            'planet_change': {'id': planet_id,
+                                              'units_count': planet.units_count,
+                                              'owner': planet.owner},
+                            'unit_id': unit_id,
+                        })
+
+                self.__check_game_over()
@@ -1,4 +1,65 @@
-from server import Server
+import time
 
-server = Server()
-server.start()
\ No newline at end of file
+STARTED = time.perf_counter()
+
+import argparse
+
+from server import Server, ENGINES, THREADS_ENGINE, SLOW_CONSUMER_POLICIES, DISCONNECT_SLOW
+from renderer import RENDER_FORMATS
+from shard import Acceptor
+from tracing import TRACE_SLOWEST
+
+IMPORTED = time.perf_counter()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', choices=ENGINES, default=THREADS_ENGINE)
+    parser.add_argument('--tick-rate', type=float, help='coalesce move broadcasts into ticks of this rate, Hz')
+    parser.add_argument('--max-rooms', type=int, help='concurrent matches hosted by this process')
+    parser.add_argument('--workers', type=int, help='shard matches over this many worker processes')
+    parser.add_argument('--map-pool', type=int, help='maps generated ahead for every players count')
+    parser.add_argument('--map-pool-workers', type=int,
+                        help='processes generating the pooled maps, every CPU by default and 1 per sharded worker')
+    parser.add_argument('--seed-mapinit', action='store_true', help='send the map seed instead of the planets')
+    parser.add_argument('--render-maps', metavar='DIRECTORY', help='draw every generated map to a file there')
+    parser.add_argument('--render-format', choices=RENDER_FORMATS, default=RENDER_FORMATS[0])
+    parser.add_argument('--state-sync', action='store_true', help='send planet snapshots on ticks, needs a tick rate')
+    parser.add_argument('--batch-damage', action='store_true', help='resolve damage once per tick, needs a tick rate')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics, workers use the next ports')
+    parser.add_argument('--trace-sample-rate', type=float, help='trace this share of the events, 0 to 1')
+    parser.add_argument('--trace-file', help='write the slowest traced events there on exit, Chrome trace format')
+    parser.add_argument('--trace-slowest', type=int, default=TRACE_SLOWEST, help='traced events kept for the file')
+    parser.add_argument('--journal', metavar='DIRECTORY', help='record every match to a file there')
+    parser.add_argument('--client-rate', type=float, help='events a client may send per second, the rest is dropped')
+    parser.add_argument('--client-burst', type=float, help='events a client may send at once, the rate by default')
+    parser.add_argument('--handler-queue-size', type=int,
+                        help='events waiting for the handler before new ones are dropped')
+    parser.add_argument('--supersede-moves', action='store_true',
+                        help='a queued move of a unit is replaced by its later ones')
+    parser.add_argument('--max-outbound', type=int, help='unsent bytes a client may have before it is a slow consumer')
+    parser.add_argument('--slow-consumer', choices=SLOW_CONSUMER_POLICIES, default=DISCONNECT_SLOW,
+                        help='what happens to a slow consumer')
+    parser.add_argument('--fair-queue', action='store_true',
+                        help='handle queued events of the clients in turns, a flooding client cant delay the rest')
+    args = parser.parse_args()
+
+    options = {'engine': args.engine, 'tick_rate': args.tick_rate, 'max_rooms': args.max_rooms,
+               'map_pool_size': args.map_pool, 'map_pool_workers': args.map_pool_workers,
+               'seed_mapinit': args.seed_mapinit,
+               'render_maps': args.render_maps, 'render_format': args.render_format, 'state_sync': args.state_sync,
+               'batch_damage': args.batch_damage, 'metrics_port': args.metrics_port,
+               'trace_sample_rate': args.trace_sample_rate, 'trace_file': args.trace_file,
+               'trace_slowest': args.trace_slowest, 'journal_dir': args.journal, 'client_rate': args.client_rate,
+               'client_burst': args.client_burst, 'handler_queue_size': args.handler_queue_size,
+               'supersede_moves': args.supersede_moves, 'max_outbound': args.max_outbound,
+               'slow_consumer': args.slow_consumer, 'fair_queue': args.fair_queue}
+
+    if args.workers:
+        server = Acceptor(workers=args.workers, **options)
+    else:
+        server = Server(**options)
+    server.start()
+
+    print('imported in {:.0f} ms, started in {:.0f} ms'.format((IMPORTED - STARTED) * 1000,
+                                                              (time.perf_counter() - STARTED) * 1000))
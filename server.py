@@ -1,13 +1,60 @@
-import json
+import asyncio
 import select
 import socket
-import struct
-
-from map_generator import MapGenerator
-from planet import Planet
-from utils import Singleton, MaxPriorityQueue, id_generator, StoppedThread
+import time
+from operator import itemgetter
+from queue import Full
+from threading import Lock
+
+from connection import Connection
+from journal import Journal, OPEN, JOIN, LEAVE, EVENT, TICK, BROADCAST
+from map_pool import MapPool
+from metrics import Metrics, MetricsEndpoint
+from renderer import MapRenderer
+from protocol import hello, negotiate
+from room import Room, EVENT_ERRORS
+from tracing import Tracer, TracedQueue, TRACE_SLOWEST
+from utils import MaxPriorityQueue, AsyncMaxPriorityQueue, StoppedThread, TokenBucket, generate_id
 
 MAX_CLIENT_COUNT = 6
+EVENTS_BATCH_SIZE = 64
+QUEUE_TIMEOUT = 0.5
+LISTEN_BACKLOG = 128
+HANDOFF_MAX_FDS = 64
+
+THREADS_ENGINE = 'threads'
+ASYNCIO_ENGINE = 'asyncio'
+ENGINES = (THREADS_ENGINE, ASYNCIO_ENGINE)
+
+# what the sender does with a client whose unsent frames grew over max_outbound bytes
+DISCONNECT_SLOW = 'disconnect'
+# downgrade: stop sending it what the next frames make up for, disconnect it only past SLOW_CONSUMER_HARD_LIMIT
+DOWNGRADE_SLOW = 'downgrade'
+SLOW_CONSUMER_POLICIES = (DISCONNECT_SLOW, DOWNGRADE_SLOW)
+SLOW_CONSUMER_HARD_LIMIT = 4
+# a later move of the unit, or a later snapshot against the acked one, carries the same state
+DOWNGRADED_MESSAGES = frozenset(('move', 'moves', 'snapshot'))
+
+# policies shedding client events, counted in shed_events_total
+RATE_LIMITED = (('policy', 'rate_limit'),)
+QUEUE_FULL = (('policy', 'queue_full'),)
+SUPERSEDED = (('policy', 'superseded'),)
+
+# queued by the server itself, compared by identity so clients can't forge them
+JOIN_EVENT = {'name': 'join'}
+LEAVE_EVENT = {'name': 'leave'}
+
+# events are labelled by name in the metrics, anything else a client sends is counted as other
+KNOWN_EVENTS = ('join', 'leave', 'hello', 'ready', 'rendered', 'ack', 'move', 'select', 'add_hp', 'damage')
+EVENT_LABELS = {name: (('event', name),) for name in KNOWN_EVENTS}
+OTHER_EVENT_LABELS = (('event', 'other'),)
+
+TRAFFIC = (
+    ('received_bytes', 'bytes received from clients'),
+    ('received_frames', 'frames received from clients'),
+    ('sent_bytes', 'bytes written to client sockets'),
+    ('sent_frames', 'frames queued for clients'),
+)
 
 
 def create_tcp_server(server_address, backlog, blocking=False):
@@ -19,26 +66,119 @@ def create_tcp_server(server_address, backlog, blocking=False):
     return server_socket
 
 
-def request(string):
-    return struct.pack('i', len(string)) + string.encode('utf-8')
-
-
-class Server(metaclass=Singleton):
-    def __init__(self, port=10800, max_client_count=8):
-        self.server = create_tcp_server(('127.0.0.1', port), max_client_count)
+def event_labels(event):
+    name = event.get('name')
+    return EVENT_LABELS.get(name, OTHER_EVENT_LABELS) if isinstance(name, str) else OTHER_EVENT_LABELS
+
+
+class Server(object):
+    def __init__(self, port=10800, max_client_count=8, engine=THREADS_ENGINE, tick_rate=None, max_rooms=None,
+                 handoff=None, map_pool_size=None, map_pool_workers=None, seed_mapinit=False, render_maps=None,
+                 render_format='png', state_sync=False, batch_damage=False, metrics_port=None, trace_sample_rate=None,
+                 trace_file=None, trace_slowest=TRACE_SLOWEST, journal_dir=None, client_rate=None, client_burst=None,
+                 handler_queue_size=None, supersede_moves=False, max_outbound=None, slow_consumer=DISCONNECT_SLOW,
+                 fair_queue=False):
+        if engine not in ENGINES:
+            raise ValueError('unknown engine {!r}, expected one of {}'.format(engine, ENGINES))
+        if tick_rate is not None and tick_rate <= 0:
+            raise ValueError('tick rate must be positive, got {!r}'.format(tick_rate))
+        if state_sync and not tick_rate:
+            raise ValueError('state sync sends snapshots on ticks, it needs a tick rate')
+        if batch_damage and not tick_rate:
+            raise ValueError('damage is batched per tick, it needs a tick rate')
+        if client_rate is not None and client_rate <= 0:
+            raise ValueError('client rate must be positive, got {!r}'.format(client_rate))
+        if slow_consumer not in SLOW_CONSUMER_POLICIES:
+            raise ValueError('unknown slow consumer policy {!r}, expected one of {}'.format(
+                slow_consumer, SLOW_CONSUMER_POLICIES))
+
+        self.engine = engine
+        self.tick_interval = 1 / tick_rate if tick_rate else None
+        # a sharded worker gets its clients through handoff instead of listening itself
+        self.server = create_tcp_server(('127.0.0.1', port), LISTEN_BACKLOG) if port is not None else None
+        self.handoff = handoff
+        self.handoff_closed = False
         self.started = True
         self.clients = []
+        self.rooms = {}
+        self.joined_clients = 0
         self.__max_clients_count = max_client_count
-        self.players = {}
-        self.next_player_id = 0
-        self.readiness = False
-        self.game_started = False
-
-        self.__handler_queue = MaxPriorityQueue()
-        self.__sender_queue = MaxPriorityQueue()
+        self.__max_rooms = max_rooms
+        self.__room_ids = generate_id()
+        # maps for the next matches are generated ahead in other processes
+        self.map_pool = MapPool(map_pool_size, map_pool_workers) if map_pool_size else None
+        self.seed_mapinit = seed_mapinit
+        self.state_sync = state_sync
+        self.batch_damage = batch_damage
+        # headless unless asked for: maps are then drawn to files off the handler thread
+        self.renderer = MapRenderer(render_maps, render_format) if render_maps else None
+
+        queue_class = AsyncMaxPriorityQueue if engine == ASYNCIO_ENGINE else MaxPriorityQueue
+        # only client events are shed when the handler falls behind, joins and leaves always get in.
+        # A fair queue takes the events of a priority from one client after another instead of as they came
+        self.__handler_queue = queue_class(handler_queue_size, key=itemgetter(1) if fair_queue else None)
+        self.__sender_queue = queue_class()
         self.__threads = []
 
-        # self.__map = None
+        self.__loop = None
+        self.__stopping = None
+        self.__readers = {}
+
+        # overload policies, all off unless asked for
+        self.__client_rate = client_rate
+        self.__client_burst = client_burst
+        # (client, unit id) -> the latest move of a unit waiting in the handler queue, it takes the queued one's place
+        self.__pending_moves = {} if supersede_moves else None
+        self.__moves_lock = Lock()
+        self.__max_outbound = max_outbound
+        self.__slow_consumer = slow_consumer
+
+        # always collected, the endpoint only decides whether anybody can scrape them
+        self.metrics = Metrics()
+        self.__closed_traffic = dict.fromkeys((name for name, _ in TRAFFIC), 0)
+        self.__declare_metrics()
+        self.metrics_endpoint = MetricsEndpoint(self.metrics, metrics_port) if metrics_port is not None else None
+
+        # a sampled event is followed from the socket to the broadcast of what it caused
+        self.tracer = Tracer(trace_sample_rate, trace_slowest, self.metrics) if trace_sample_rate else None
+        self.trace_file = trace_file
+        self.__room_queue = self.__sender_queue if self.tracer is None else \
+            TracedQueue(self.__sender_queue, self.tracer)
+
+        # every match is recorded to its own file, replay.py plays it back
+        self.journal = Journal(journal_dir) if journal_dir else None
+
+        # wakes the receiver's select() when a client has frames waiting for a writable socket
+        self.__wakeup_reader, self.__wakeup_writer = socket.socketpair()
+        self.__wakeup_reader.setblocking(0)
+        self.__wakeup_writer.setblocking(0)
+
+    def __declare_metrics(self):
+        metrics = self.metrics
+        metrics.counter('events_total', 'events received from clients, by event')
+        metrics.counter('shed_events_total', 'events dropped before the handler, by policy and event')
+        metrics.counter('shed_messages_total', 'messages not sent to slow clients, by message')
+        metrics.counter('slow_consumers_total', 'clients disconnected for not reading their frames')
+        metrics.counter('rejected_events_total', 'events a room couldnt handle, by event')
+        metrics.histogram('handler_seconds', 'time the handler spent on an event, by event')
+        metrics.histogram('tick_seconds', 'time a tick took over all rooms')
+        metrics.histogram('map_generation_seconds', 'time a match waited for its map')
+        metrics.gauge('handler_queue_depth', 'events waiting for the handler', lambda: len(self.__handler_queue))
+        metrics.gauge('sender_queue_depth', 'messages waiting for the sender', lambda: len(self.__sender_queue))
+        metrics.gauge('clients', 'connected clients', lambda: len(self.clients))
+        metrics.gauge('rooms', 'hosted matches', lambda: len(self.rooms))
+        for name, help_text in TRAFFIC:
+            metrics.counter(name + '_total', help_text, lambda name=name: self.__traffic_total(name))
+        for name, help_text in TRAFFIC:
+            metrics.counter('client_' + name, help_text + ', by connected client',
+                            lambda name=name: self.__client_traffic(name))
+
+    def __traffic_total(self, name):
+        return self.__closed_traffic[name] + sum(client.traffic()[name] for client in tuple(self.clients))
+
+    def __client_traffic(self, name):
+        return {(('client', '{}:{}'.format(*client.address[:2])),): client.traffic()[name]
+                for client in tuple(self.clients)}
 
     def __start_thread(self, name, callback, args=None):
         self.__threads.append(StoppedThread(name=name, target=callback, args=args))
@@ -46,203 +186,496 @@ class Server(metaclass=Singleton):
         self.__threads[-1].start()
 
     def start(self):
-        self.__start_thread(name="receiver", callback=self.receiver, args=())
-        self.__start_thread(name="handler", callback=self.handle, args=())
-        self.__start_thread(name='sender', callback=self.sender, args=())
+        if self.map_pool is not None:
+            self.map_pool.start()
+        if self.renderer is not None:
+            self.renderer.start()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.start()
+        if self.journal is not None:
+            self.journal.start()
+
+        if self.engine == ASYNCIO_ENGINE:
+            self.__loop = asyncio.new_event_loop()
+            # made before the loop thread runs, stop() may be called before __serve starts
+            self.__stopping = asyncio.Event()
+            self.__start_thread(name="event loop", callback=self.__run_event_loop, args=())
+        else:
+            self.__start_thread(name="receiver", callback=self.receiver, args=())
+            self.__start_thread(name="handler", callback=self.handle, args=())
+            self.__start_thread(name='sender', callback=self.sender, args=())
 
     def stop(self):
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__stopping.set)
+        else:
+            self.__handler_queue.close()
+            self.__sender_queue.close()
+
         for thread in self.__threads:
             thread.stop()
+        self.__wakeup()
+
+        for thread in self.__threads:
             thread.join()
 
+        self.__wakeup_reader.close()
+        self.__wakeup_writer.close()
+
+        if self.map_pool is not None:
+            self.map_pool.stop()
+        if self.renderer is not None:
+            self.renderer.stop()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+        if self.tracer is not None and self.trace_file:
+            self.tracer.dump(self.trace_file)
+        if self.journal is not None:
+            self.journal.stop()
+
+    def __wakeup(self):
+        try:
+            self.__wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def __receive_handoff(self):
+        try:
+            message, fds, _, _ = socket.recv_fds(self.handoff, 1024, HANDOFF_MAX_FDS)
+        except (BlockingIOError, InterruptedError):
+            return []
+
+        if not message and not fds:
+            # the acceptor went away, no more clients will come
+            self.handoff_closed = True
+            if self.__loop is not None:
+                self.__loop.remove_reader(self.handoff)
+            return []
+
+        clients = []
+        for fd in fds:
+            sock = socket.socket(fileno=fd)
+            try:
+                address = sock.getpeername()
+            except OSError:
+                sock.close()
+                continue
+            clients.append(self.__connect(sock, address))
+        return clients
+
+    def __connect(self, sock, address):
+        print(address)
+        sock.setblocking(0)
+        # frames are already batched per flush, Nagle would only hold small ones back for the client's ack
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        bucket = TokenBucket(self.__client_rate, self.__client_burst) if self.__client_rate else None
+        client = Connection(sock, address, bucket)
+        self.clients.append(client)
+
+        self.__send_to(client, hello())
+        self.__handler_queue.insert((JOIN_EVENT, client), 1, force=True)
+
+        return client
+
+    def __disconnect(self, client):
+        if client not in self.clients:
+            return
+
+        self.clients.remove(client)
+        for name, value in client.traffic().items():
+            self.__closed_traffic[name] += value
+        if self.__loop is not None:
+            self.__loop.remove_writer(client.sock)
+            reader = self.__readers.pop(client, None)
+            if reader is not None and reader is not asyncio.current_task():
+                reader.cancel()
+        client.close()
+
+        self.__handler_queue.insert((LEAVE_EVENT, client), 1, force=True)
+
+    def __send_to(self, client, event):
+        client.send_event(event)
+        self.__flush_client(client)
+
+    def __flush_client(self, client):
+        try:
+            flushed = client.flush()
+        except OSError:
+            # the receiver sees the broken socket and disconnects the client
+            return True
+
+        if not flushed:
+            if self.__loop is not None:
+                self.__loop.add_writer(client.sock, self.__on_writable, client)
+            else:
+                self.__wakeup()
+        elif client.closing:
+            if self.__loop is not None:
+                self.__disconnect(client)
+            else:
+                self.__wakeup()
+        return flushed
+
+    def __handshake(self, event, client):
+        encoding = negotiate(event)
+        client.switch_encoding(encoding, hello(encoding))
+        self.__flush_client(client)
+
+    def __dispatch(self, event, client, received=None):
+        labels = event_labels(event)
+        self.metrics.inc('events_total', labels=labels)
+        if event['name'] == 'hello':
+            self.__handshake(event, client)
+            return
+
+        if client.bucket is not None and not client.bucket.take():
+            self.__shed(RATE_LIMITED, labels)
+            return
+        if self.tracer is not None:
+            self.tracer.sample(event, received, labels)
+
+        if event['name'] != "move":
+            self.__enqueue(event, client, 1, labels)
+            return
+
+        key = self.__move_key(event, client)
+        if key is None:
+            self.__enqueue(event, client, 0, labels)
+            return
+        with self.__moves_lock:
+            if key in self.__pending_moves:
+                self.__pending_moves[key] = event
+                self.__shed(SUPERSEDED, labels, event)
+            elif self.__enqueue(event, client, 0, labels):
+                self.__pending_moves[key] = event
+
+    def __enqueue(self, event, client, priority, labels):
+        try:
+            self.__handler_queue.insert((event, client), priority)
+        except Full:
+            self.__shed(QUEUE_FULL, labels, event)
+            return False
+        return True
+
+    def __shed(self, policy, labels, event=None):
+        self.metrics.inc('shed_events_total', labels=policy + labels)
+        if event is not None and self.tracer is not None:
+            self.tracer.discard(event)
+
+    def __move_key(self, event, client):
+        if self.__pending_moves is None:
+            return None
+        unit_id = event.get('unit_id')
+        # anything else isn't a unit, the room rejects it
+        return (client, unit_id) if isinstance(unit_id, int) else None
+
+    def __latest_move(self, event, client):
+        key = self.__move_key(event, client)
+        if key is None:
+            return event
+        with self.__moves_lock:
+            return self.__pending_moves.pop(key, event)
+
+    def __broadcast(self, data, room, clients=None):
+        frames = {}
+        for client in room.clients if clients is None else clients:
+            if client.room is not room or client.slow:
+                continue
+            if self.__max_outbound is not None and len(client.outbound) > self.__max_outbound and \
+                    self.__shed_slow(client, data):
+                continue
+            client.send_event(data, frames)
+            if data['name'] == 'gameover':
+                # the match is over: hang up once the last frames are out
+                client.closing = True
+
+    def __shed_slow(self, client, data):
+        if self.__slow_consumer == DOWNGRADE_SLOW and \
+                len(client.outbound) <= self.__max_outbound * SLOW_CONSUMER_HARD_LIMIT:
+            if data['name'] not in DOWNGRADED_MESSAGES:
+                return False
+            self.metrics.inc('shed_messages_total', labels=(('message', data['name']),))
+            return True
+
+        # what it hasn't read yet is thrown away with it, the receiver or the loop hangs up
+        client.slow = True
+        client.closing = True
+        client.outbound.clear()
+        self.metrics.inc('slow_consumers_total')
+        self.__flush_client(client)
+        return True
+
     def receiver(self, is_alive):
         while is_alive():
-            readable, *_ = select.select([self.server, *self.clients], [], [], 10)
+            clients = tuple(self.clients)
+            for client in clients:
+                if client.closing and not client.pending:
+                    self.__disconnect(client)
+
+            clients = tuple(self.clients)
+            sources = [self.server] if self.server is not None else []
+            if self.handoff is not None and not self.handoff_closed:
+                sources.append(self.handoff)
+            readable, writable, _ = select.select([*sources, self.__wakeup_reader, *clients],
+                                                  [client for client in clients if client.pending], [], 10)
+
+            for client in writable:
+                try:
+                    client.flush()
+                except OSError:
+                    self.__disconnect(client)
 
             for sock in readable:
                 if sock is self.server:
-                    if not self.game_started and not self.readiness and len(self.clients) < self.__max_clients_count:
+                    try:
                         client, address = sock.accept()
-                        print(address)
-                        client.setblocking(0)
-                        self.clients.append(client)
-                        self.next_player_id += 1
-                        player = {
-                            'id': self.next_player_id,
-                            'address': address,
-                            'ready': False,
-                            'rendered': False,
-                            'object_ids': [],
-                            'name': 'client {}'.format(self.next_player_id),
-                        }
-
-                        self.players[client] = player
-
-                        self.__sender_queue.insert({
-                            'name': 'connect',
-                            'player': {
-                                'id': player['id'],
-                                'name': player['name'],
-                                'ready': player['ready'],
-                            },
-                        }, 1)
-                else:
-                    data_size = sock.recv(struct.calcsize('i'))
-
-                    if data_size:
-                        data_size = struct.unpack('i', data_size)[0]
-                        event = sock.recv(data_size)
-
-                        if event:
-                            event = json.loads(event)
-
-                            if event['name'] == "move":
-                                self.__handler_queue.insert((event, sock), 0)
-                            else:
-                                self.__handler_queue.insert((event, sock), 1)
-                        else:
-                            self.clients.remove(sock)
-                            del self.players[sock]
-                            sock.close()
-                    else:
-                        self.clients.remove(sock)
-                        del self.players[sock]
-                        sock.close()
+                    except BlockingIOError:
+                        continue
+                    self.__connect(client, address)
+                elif sock is self.handoff:
+                    self.__receive_handoff()
+                elif sock is self.__wakeup_reader:
+                    while True:
+                        try:
+                            if not sock.recv(4096):
+                                break
+                        except BlockingIOError:
+                            break
+                elif sock in self.clients:
+                    self.__receive(sock)
+
+    def __receive(self, client):
+        try:
+            received = client.decoder.recv_into(client.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            received = 0
+
+        if received:
+            self.__dispatch_frames(client, time.monotonic_ns() if self.tracer is not None else None)
+        else:
+            self.__disconnect(client)
+
+    def __dispatch_frames(self, client, received=None):
+        try:
+            for frame in client.decoder.frames():
+                self.__dispatch(client.decode(frame), client, received)
+        except ValueError:
+            # ProtocolError or a malformed payload
+            self.__disconnect(client)
 
     def sender(self, is_alive):
         while is_alive():
-            if not self.__sender_queue.empty():
-                data = self.__sender_queue.remove()
-
-                for player in self.clients:
-                    player.send(request(json.dumps(data)))
-
-    def all_clients(self, field):
-        return all(player[field] for player in self.players.values())
+            batch = self.__sender_queue.drain(EVENTS_BATCH_SIZE, timeout=QUEUE_TIMEOUT)
+            traces = self.__broadcast_batch(batch)
+
+            if batch:
+                for client in tuple(self.clients):
+                    self.__flush_client(client)
+            if traces:
+                self.tracer.sent(traces)
+
+    def __broadcast_batch(self, batch):
+        traces = []
+        for data, room, clients in batch:
+            if self.tracer is not None:
+                traces.append(self.tracer.broadcasting(data))
+            if self.journal is not None:
+                self.__journal_broadcast(data, room, clients)
+            self.__broadcast(data, room, clients)
+        return traces
+
+    def __journal_broadcast(self, data, room, clients):
+        if clients is None:
+            self.journal.record(room.id, BROADCAST, 0, data)
+            return
+
+        for client in clients:
+            player = room.players.get(client)
+            if player is not None:
+                self.journal.record(room.id, BROADCAST, player['id'], data)
+
+    def __run_event_loop(self, is_alive):
+        asyncio.set_event_loop(self.__loop)
+        try:
+            self.__loop.run_until_complete(self.__serve())
+        finally:
+            self.__loop.close()
+
+    async def __serve(self):
+        tasks = [
+            self.__loop.create_task(self.__handle_events()),
+            self.__loop.create_task(self.__send_events()),
+        ]
+        if self.server is not None:
+            tasks.append(self.__loop.create_task(self.__accept_clients()))
+        if self.handoff is not None:
+            self.handoff.setblocking(False)
+            self.__loop.add_reader(self.handoff, self.__on_handoff)
+        if self.tick_interval:
+            tasks.append(self.__loop.create_task(self.__tick_events()))
+
+        await self.__stopping.wait()
+
+        if self.handoff is not None and not self.handoff_closed:
+            self.__loop.remove_reader(self.handoff)
+        tasks += self.__readers.values()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __accept_clients(self):
+        while True:
+            client, address = await self.__loop.sock_accept(self.server)
+            client = self.__connect(client, address)
+            self.__readers[client] = self.__loop.create_task(self.__read_events(client))
+
+    def __on_handoff(self):
+        for client in self.__receive_handoff():
+            self.__readers[client] = self.__loop.create_task(self.__read_events(client))
+
+    async def __read_events(self, client):
+        try:
+            while client in self.clients:
+                received = await self.__loop.sock_recv_into(client.sock, client.decoder.writable())
+                if not received:
+                    break
+
+                client.decoder.commit(received)
+                self.__dispatch_frames(client, time.monotonic_ns() if self.tracer is not None else None)
+        except (ConnectionError, ValueError):
+            # a broken socket, or a frame the client shouldn't have sent
+            pass
+
+        self.__disconnect(client)
+
+    async def __handle_events(self):
+        while True:
+            for event, client in await self.__handler_queue.get_batch(EVENTS_BATCH_SIZE):
+                self.handle_event(event, client)
+
+    async def __tick_events(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.tick()
+
+    def __on_writable(self, client):
+        try:
+            if client.flush():
+                self.__loop.remove_writer(client.sock)
+                if client.closing:
+                    self.__disconnect(client)
+        except OSError:
+            self.__disconnect(client)
+
+    async def __send_events(self):
+        while True:
+            traces = self.__broadcast_batch(await self.__sender_queue.get_batch(EVENTS_BATCH_SIZE))
+
+            for client in tuple(self.clients):
+                if client.pending:
+                    self.__flush_client(client)
+            if traces:
+                self.tracer.sent(traces)
 
-    # def handle(self, client, client_event):
     def handle(self, is_alive):
-        while is_alive():
-            if not self.__handler_queue.empty():
-                event, client = self.__handler_queue.remove()
-
-                if event['name'] == "ready":
-                    self.players[client]['ready'] = event['ready']
-
-                    message = {
-                        'name': 'ready',
-                        'player': self.players[client]['id'],
-                        'ready': event['ready']
-                    }
-
-                    self.__sender_queue.insert(message, 1)
-
-                    ready = self.all_clients('ready')
-
-                    if ready and len(self.players) > 1:
-                        gen = MapGenerator()
-                        map = gen.run([player['id'] for player in self.players.values()])
-                        gen.display()
-                        game_map = [planet.get_dict() for planet in map]
-
-                        self.readiness = True
-
-                        message = {
-                            'name': 'mapinit',
-                            'map': game_map,
-                        }
-
-                        self.__sender_queue.insert(message, 1)
-
-                elif event['name'] == 'rendered':
-                    self.players[client]['rendered'] = True
+        next_tick = time.monotonic() + (self.tick_interval or 0)
 
-                    if self.all_clients('rendered'):
-                        # TODO game start event
-                        self.__sender_queue.insert({'name': 'game_started'}, 1)
-                        self.game_started = True
-
-                if self.game_started:
-                    if event['name'] == 'move':
-                        if int(event['unit_id']) in self.players[client]['object_ids']:
-                            self.__sender_queue.insert(event, 0)
-
-                    elif event['name'] == 'select':
-                        planets_ids = event['from']
-                        percentage = event['percentage']
-
-                        punits = {}
-
-                        for planet_id in planets_ids:
-                            planet_id = int(planet_id)
-
-                            if Planet.cache[planet_id].owner == self.players[client]['id']:
-                                new_ships_count = round(Planet.cache[planet_id].units_count * int(percentage) / 100.0)
-                                Planet.cache[planet_id].units_count -= new_ships_count
-                                punits[planet_id] = [next(id_generator) for _ in range(new_ships_count)]
-                                self.players[client]['object_ids'] += punits[planet_id]
-
-                        self.__sender_queue.insert({
-                            'name': 'select',
-                            'selected': punits
-                        }, 1)
-
-                    elif event['name'] == 'add_hp':
-                        planet_id = int(event['planet_id'])
-                        hp_count = int(event['hp_count'])
-
-                        planet = Planet.cache[planet_id]
-
-                        if planet.owner == self.players[client]['id']:
-                            planet.units_count += hp_count
-                            self.__sender_queue.insert(event, 1)
-
-                    elif event['name'] == 'damage':
-                        planet_id = int(event['planet_id'])
-                        unit_id = int(event['unit_id'])
-                        hp_count = int(event.get('hp_count', 1))
-
-                        planet = Planet.cache[planet_id]
-
-                        if unit_id in self.players[client]['object_ids']:
-                            if planet.owner == self.players[client]['id']:
-                                planet.units_count += hp_count
-                            else:
-                                planet.units_count -= hp_count
-                                if planet.units_count < 0:
-                                    planet.owner = self.players[client]['id']
-                                    planet.units_count = abs(planet.units_count)
-
-                            self.players[client]['object_ids'].remove(unit_id)
-
-                            self.__sender_queue.insert({
-                                'name': 'damage',
-                                'planet_change': {'id': planet_id,
-                                                  'units_count': planet.units_count,
-                                                  'owner': planet.owner},
-                                'unit_id': unit_id,
-                            }, 1)
-
-                        # check game over
-
-                        active_players = []
-
-                        for player in self.players.values():
-                            if len(player["object_ids"]):
-                                for planet in Planet.cache.values():
-                                    if planet.owner == player['id']:
-                                        active_players.append(player['id'])
-                                        break
-                            if len(active_players) >= 2:
-                                break
-                        else:
-                            self.__sender_queue.insert({
-                                'name': 'gameover',
-                                'winner': active_players[0]
-                            }, 1)
-
-                            self.readiness = False
-                            self.game_started = False
-
-                            self.players = {}
-                            self.clients = []
+        while is_alive():
+            timeout = QUEUE_TIMEOUT
+            if self.tick_interval:
+                timeout = max(0, next_tick - time.monotonic())
+
+            for event, client in self.__handler_queue.drain(EVENTS_BATCH_SIZE, timeout=timeout):
+                self.handle_event(event, client)
+
+            if self.tick_interval and time.monotonic() >= next_tick:
+                self.tick()
+                # a slow tick skips the missed ones instead of running them back to back
+                next_tick = max(next_tick + self.tick_interval, time.monotonic())
+
+    def tick(self):
+        start = time.perf_counter()
+        for room in tuple(self.rooms.values()):
+            if self.journal is not None:
+                self.journal.record(room.id, TICK)
+            room.tick()
+        self.metrics.observe('tick_seconds', time.perf_counter() - start)
+
+    def __join_room(self, client):
+        if client not in self.clients:
+            return
+
+        room = next((room for room in self.rooms.values() if room.is_open()), None)
+
+        if room is None:
+            if self.__max_rooms is not None and len(self.rooms) >= self.__max_rooms:
+                client.closing = True
+                self.__send_to(client, {'name': 'server_full'})
+                return
+
+            # everything a replay needs to set the room up the same way
+            options = {'max_players': self.__max_clients_count, 'coalesce_moves': bool(self.tick_interval),
+                       'seed_mapinit': self.seed_mapinit, 'state_sync': self.state_sync,
+                       'batch_damage': self.batch_damage}
+            room = Room(next(self.__room_ids), self.__room_queue, map_pool=self.map_pool, renderer=self.renderer,
+                        metrics=self.metrics, **options)
+            self.rooms[room.id] = room
+            if self.journal is not None:
+                self.journal.record(room.id, OPEN, payload=dict(options, name='options'))
+
+        client.room = room
+        player = room.join(client)
+        self.joined_clients += 1
+        if self.journal is not None:
+            self.journal.record(room.id, JOIN, player['id'])
+
+    def room_stats(self):
+        rooms = tuple(self.rooms.values())
+        return {
+            'rooms': len(rooms),
+            'open_rooms': sum(room.is_open() for room in rooms),
+            'joined': self.joined_clients,
+        }
+
+    def __leave_room(self, client):
+        room = client.room
+        if room is None:
+            return
+
+        client.room = None
+        if self.journal is not None and client in room.players:
+            self.journal.record(room.id, LEAVE, room.players[client]['id'])
+        room.leave(client)
+        if room.empty():
+            self.rooms.pop(room.id, None)
+            if self.journal is not None:
+                self.journal.close(room.id)
+
+    def handle_event(self, event, client):
+        start = time.perf_counter()
+        trace = self.tracer.handling(event) if self.tracer is not None else None
+        if event is JOIN_EVENT:
+            self.__join_room(client)
+        elif event is LEAVE_EVENT:
+            self.__leave_room(client)
+        else:
+            if self.__pending_moves is not None and event['name'] == 'move':
+                # the queued move stands for the unit's latest one, taken out even when its client has left
+                event = self.__latest_move(event, client)
+            room = client.room
+            if room is not None:
+                if self.journal is not None and client in room.players:
+                    self.journal.record(room.id, EVENT, room.players[client]['id'], event)
+                try:
+                    room.handle_event(event, client)
+                except EVENT_ERRORS:
+                    # the handler serves every room, one client's bad event mustn't stop it
+                    self.metrics.inc('rejected_events_total', labels=event_labels(event))
+                if self.journal is not None:
+                    self.journal.seed(room)
+        self.metrics.observe('handler_seconds', time.perf_counter() - start, event_labels(event))
+        if trace is not None:
+            self.tracer.handled(trace)
@@ -0,0 +1,155 @@
+import json
+import multiprocessing
+import os
+import select
+import socket
+import time
+
+from server import Server, create_tcp_server, LISTEN_BACKLOG, QUEUE_TIMEOUT
+from utils import StoppedThread
+
+STATS_INTERVAL = 0.1
+# generator processes of a worker's map pool, workers * cpu_count of them would take the cores from the matches
+WORKER_MAP_POOL_WORKERS = 1
+HANDOFF_MESSAGE = b'client'
+
+
+def run_worker(handoff, server_options):
+    server = Server(port=None, handoff=handoff, **server_options)
+    server.start()
+
+    reported = None
+    try:
+        while not server.handoff_closed:
+            stats = server.room_stats()
+            if stats != reported:
+                try:
+                    handoff.sendall(json.dumps(stats).encode('utf-8') + b'\n')
+                    reported = stats
+                except BlockingIOError:
+                    pass
+            time.sleep(STATS_INTERVAL)
+    except (OSError, KeyboardInterrupt):
+        pass
+    finally:
+        server.stop()
+
+
+class Worker(object):
+    def __init__(self, index, process, control):
+        self.index = index
+        self.process = process
+        self.control = control
+        self.alive = True
+        self.sent = 0
+        self.stats = {'rooms': 0, 'open_rooms': 0, 'joined': 0}
+        self.__buffer = b''
+
+    def fileno(self):
+        return self.control.fileno()
+
+    def handoff(self, client):
+        socket.send_fds(self.control, [HANDOFF_MESSAGE], [client.fileno()])
+        self.sent += 1
+
+        # until the worker reports back, assume the client opened a room there
+        if not self.stats['open_rooms']:
+            self.stats = dict(self.stats, rooms=self.stats['rooms'] + 1, open_rooms=1)
+
+    def receive_stats(self):
+        try:
+            data = self.control.recv(4096)
+        except OSError:
+            data = b''
+
+        if not data:
+            self.alive = False
+            return
+
+        *lines, self.__buffer = (self.__buffer + data).split(b'\n')
+        for line in lines:
+            stats = json.loads(line)
+            # a report that hasn't seen every handed off client is older than our own estimate
+            if stats['joined'] >= self.sent:
+                self.stats = stats
+
+
+class Acceptor(object):
+    def __init__(self, port=10800, workers=None, **server_options):
+        self.server = create_tcp_server(('127.0.0.1', port), LISTEN_BACKLOG)
+        self.workers_count = workers or os.cpu_count()
+        self.server_options = server_options
+        self.workers = []
+        self.__thread = None
+
+    def start(self):
+        # spawn, so a worker doesn't inherit the listener and the other workers' control sockets
+        context = multiprocessing.get_context('spawn')
+
+        for index in range(self.workers_count):
+            control, handoff = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            # not daemonic, so a worker can run its own map pool; it exits once its control socket closes
+            process = context.Process(target=run_worker, args=(handoff, self.worker_options(index)),
+                                      name='worker {}'.format(index))
+            process.start()
+            handoff.close()
+            self.workers.append(Worker(index, process, control))
+
+        self.__thread = StoppedThread(name='acceptor', target=self.accept, args=())
+        self.__thread.start()
+
+    def worker_options(self, index):
+        options = dict(self.server_options)
+        if options.get('metrics_port') is not None:
+            # every worker is scraped on its own port, counting up from the given one
+            options['metrics_port'] += index
+        if options.get('trace_file'):
+            root, extension = os.path.splitext(options['trace_file'])
+            options['trace_file'] = '{}-{}{}'.format(root, index, extension)
+        if options.get('map_pool_size') and options.get('map_pool_workers') is None:
+            options['map_pool_workers'] = WORKER_MAP_POOL_WORKERS
+        return options
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__thread.stop()
+            self.__thread.join()
+
+        for worker in self.workers:
+            worker.control.close()
+        for worker in self.workers:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def choose_worker(self):
+        alive = [worker for worker in self.workers if worker.alive]
+        if not alive:
+            return None
+
+        # keep filling a room that waits for players, otherwise open one on the least loaded worker
+        filling = [worker for worker in alive if worker.stats['open_rooms']]
+        return min(filling or alive, key=lambda worker: (worker.stats['rooms'], worker.index))
+
+    def accept(self, is_alive):
+        while is_alive():
+            workers = [worker for worker in self.workers if worker.alive]
+            readable, _, _ = select.select([self.server, *workers], [], [], QUEUE_TIMEOUT)
+
+            for sock in readable:
+                if sock is self.server:
+                    try:
+                        client, address = sock.accept()
+                    except BlockingIOError:
+                        continue
+
+                    worker = self.choose_worker()
+                    try:
+                        if worker is not None:
+                            worker.handoff(client)
+                    except OSError:
+                        worker.alive = False
+                    finally:
+                        client.close()
+                else:
+                    sock.receive_stats()
@@ -0,0 +1,170 @@
+import heapq
+import json
+import random
+import time
+from itertools import count
+from threading import Lock
+
+TRACE_SLOWEST = 100
+
+# spans of a traced event, each one ends with the stamp of the same name
+DECODE = 'decode'
+HANDLER_QUEUE = 'handler_queue'
+HANDLE = 'handle'
+SENDER_QUEUE = 'sender_queue'
+SEND = 'send'
+
+
+class Trace(object):
+    __slots__ = ('name', 'labels', 'start', 'stamps', 'pending', 'handled')
+
+    def __init__(self, name, labels, start):
+        self.name = name
+        self.labels = labels
+        self.start = start
+        # (span, monotonic ns at its end)
+        self.stamps = []
+        # messages emitted for the event that haven't been sent yet
+        self.pending = 0
+        self.handled = False
+
+    def stamp(self, span):
+        self.stamps.append((span, time.monotonic_ns()))
+
+    @property
+    def duration(self):
+        return (self.stamps[-1][1] if self.stamps else self.start) - self.start
+
+    def spans(self):
+        begin = self.start
+        for span, end in self.stamps:
+            yield span, begin, end
+            begin = end
+
+
+class Tracer(object):
+    def __init__(self, sample_rate, slowest=TRACE_SLOWEST, metrics=None):
+        if not 0 < sample_rate <= 1:
+            raise ValueError('sample rate must be in (0, 1], got {!r}'.format(sample_rate))
+
+        self.sample_rate = sample_rate
+        self.slowest_count = slowest
+        self.finished = 0
+        # the trace of the event the handler is busy with, messages emitted meanwhile belong to it
+        self.current = None
+        self.__metrics = metrics
+        # id(event or message) -> (event or message, trace), the object is kept so its id can't be reused
+        self.__following = {}
+        self.__slowest = []
+        self.__sequence = count()
+        self.__lock = Lock()
+
+        if metrics is not None:
+            metrics.histogram('trace_span_seconds', 'sampled events time per span, by event and span')
+
+    def sample(self, event, received, labels=()):
+        if random.random() >= self.sample_rate:
+            return None
+
+        trace = Trace(event.get('name'), labels, received)
+        trace.stamp(DECODE)
+        self.__following[id(event)] = (event, trace)
+        return trace
+
+    def discard(self, event):
+        # the event was shed and never reaches the handler
+        self.__following.pop(id(event), None)
+
+    def handling(self, event):
+        followed = self.__following.pop(id(event), None)
+        if followed is None:
+            return None
+
+        trace = followed[1]
+        trace.stamp(HANDLER_QUEUE)
+        self.current = trace
+        return trace
+
+    def follow(self, message):
+        trace = self.current
+        with self.__lock:
+            trace.pending += 1
+        self.__following[id(message)] = (message, trace)
+
+    def handled(self, trace):
+        trace.stamp(HANDLE)
+        self.current = None
+        with self.__lock:
+            trace.handled = True
+            done = not trace.pending
+        if done:
+            # nothing to broadcast, or a tick broadcasts it later
+            self.__finish(trace)
+
+    def broadcasting(self, message):
+        followed = self.__following.pop(id(message), None)
+        if followed is None:
+            return None
+
+        trace = followed[1]
+        trace.stamp(SENDER_QUEUE)
+        return trace
+
+    def sent(self, traces):
+        for trace in traces:
+            if trace is None:
+                continue
+            trace.stamp(SEND)
+            with self.__lock:
+                trace.pending -= 1
+                done = trace.handled and not trace.pending
+            if done:
+                self.__finish(trace)
+
+    def __finish(self, trace):
+        # traces finish on the handler and on the sender thread, the lock keeps the histogram to one writer at a time
+        with self.__lock:
+            if self.__metrics is not None:
+                for span, begin, end in trace.spans():
+                    self.__metrics.observe('trace_span_seconds', (end - begin) / 1e9, trace.labels + (('span', span),))
+
+            self.finished += 1
+            item = (trace.duration, next(self.__sequence), trace)
+            if len(self.__slowest) < self.slowest_count:
+                heapq.heappush(self.__slowest, item)
+            elif item > self.__slowest[0]:
+                heapq.heapreplace(self.__slowest, item)
+
+    def slowest(self):
+        with self.__lock:
+            return [trace for _, _, trace in sorted(self.__slowest, reverse=True)]
+
+    def chrome_trace(self):
+        # trace event format, chrome://tracing and Perfetto load it as is
+        traces = self.slowest()
+        origin = min((trace.start for trace in traces), default=0)
+        events = []
+        for rank, trace in enumerate(traces):
+            events.append({'name': trace.name, 'cat': 'event', 'ph': 'X', 'pid': 1, 'tid': rank,
+                           'ts': (trace.start - origin) / 1000, 'dur': trace.duration / 1000,
+                           'args': {'rank': rank}})
+            for span, begin, end in trace.spans():
+                events.append({'name': span, 'cat': 'span', 'ph': 'X', 'pid': 1, 'tid': rank,
+                               'ts': (begin - origin) / 1000, 'dur': (end - begin) / 1000})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+class TracedQueue(object):
+    # the rooms emit through it, so what they send while a sampled event is handled is followed to the sender
+    def __init__(self, queue, tracer):
+        self.__queue = queue
+        self.__tracer = tracer
+
+    def insert(self, item, priority=0):
+        if self.__tracer.current is not None:
+            self.__tracer.follow(item[0])
+        self.__queue.insert(item, priority)
@@ -1,6 +1,10 @@
+import asyncio
 import math
-from queue import PriorityQueue
-from threading import Thread, Event, Lock
+import time
+from bisect import bisect_right
+from collections import deque
+from queue import Empty, Full
+from threading import Thread, Event, Lock, Condition
 
 
 def generate_id():
@@ -14,6 +18,8 @@ id_generator = generate_id()
 
 
 class Coords(object):
+    __slots__ = ('x', 'y')
+
     def __init__(self, x=0, y=0):
         self.x = x
         self.y = y
@@ -35,6 +41,72 @@ class Coords(object):
         return math.pow(math.pow(self.x - point.x, 2) + math.pow(self.y - point.y, 2), 1 / 2)
 
 
+class UnitRanges(object):
+    # disjoint, sorted [start, end) ranges of unit ids
+    def __init__(self):
+        self.__starts = []
+        self.__ends = []
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def __find(self, unit_id):
+        i = bisect_right(self.__starts, unit_id) - 1
+        if i >= 0 and unit_id < self.__ends[i]:
+            return i
+        return -1
+
+    def __contains__(self, unit_id):
+        return self.__find(unit_id) >= 0
+
+    def add(self, start, count):
+        if count <= 0:
+            return
+
+        end = start + count
+        i = bisect_right(self.__starts, start)
+        if (i and self.__ends[i - 1] > start) or (i < len(self.__starts) and self.__starts[i] < end):
+            raise ValueError('units {}..{} overlap owned units'.format(start, end - 1))
+
+        merge_left = i and self.__ends[i - 1] == start
+        merge_right = i < len(self.__starts) and self.__starts[i] == end
+        if merge_left and merge_right:
+            self.__ends[i - 1] = self.__ends[i]
+            del self.__starts[i]
+            del self.__ends[i]
+        elif merge_left:
+            self.__ends[i - 1] = end
+        elif merge_right:
+            self.__starts[i] = start
+        else:
+            self.__starts.insert(i, start)
+            self.__ends.insert(i, end)
+        self.__count += count
+
+    def remove(self, unit_id):
+        i = self.__find(unit_id)
+        if i < 0:
+            raise ValueError('unit {} is not owned'.format(unit_id))
+
+        start, end = self.__starts[i], self.__ends[i]
+        if start == unit_id and end == unit_id + 1:
+            del self.__starts[i]
+            del self.__ends[i]
+        elif start == unit_id:
+            self.__starts[i] = unit_id + 1
+        elif end == unit_id + 1:
+            self.__ends[i] = unit_id
+        else:
+            self.__ends[i] = unit_id
+            self.__starts.insert(i + 1, unit_id + 1)
+            self.__ends.insert(i + 1, end)
+        self.__count -= 1
+
+    def ranges(self):
+        return [(start, end - start) for start, end in zip(self.__starts, self.__ends)]
+
+
 class Singleton(type):
     _instances = {}
 
@@ -44,36 +116,170 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-class MaxPriorityItem(object):
-    def __init__(self, item, priority):
-        self.item = item
-        self.priority = priority
+class FairLevel(object):
+    # a priority level taking turns between the keys of its items, FIFO among the items of one key
+    __slots__ = ('key', 'queues', 'turns', 'size')
+
+    def __init__(self, key):
+        self.key = key
+        self.queues = {}
+        # keys with queued items, the next one to be served first
+        self.turns = deque()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
 
-    def __lt__(self, other):
-        return self.priority > other.priority
+    def append(self, item):
+        key = self.key(item)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            self.turns.append(key)
+        queue.append(item)
+        self.size += 1
+
+    def popleft(self):
+        key = self.turns.popleft()
+        queue = self.queues[key]
+        item = queue.popleft()
+        if queue:
+            self.turns.append(key)
+        else:
+            del self.queues[key]
+        self.size -= 1
+        return item
 
 
 class MaxPriorityQueue(object):
-    def __init__(self):
-        self.__queue = PriorityQueue()
+    # one FIFO per priority level, the highest level is served first.
+    # With a key every level takes turns between the keys of its items, see FairLevel
+    def __init__(self, maxsize=None, key=None):
+        self.__levels = {}
+        # the levels from the highest priority down, there are as many as priorities ever used
+        self.__ordered = []
+        self.__size = 0
+        self.__key = key
         self.__mutex = Lock()
+        self.__not_empty = Condition(self.__mutex)
+        self.__closed = False
+        self.maxsize = maxsize
+
+    def insert(self, item, priority=0, force=False):
+        # a full queue rejects items instead of blocking the producer, force is for what must never be lost
+        with self.__not_empty:
+            if not force and self.maxsize is not None and self.__size >= self.maxsize:
+                raise Full
+            level = self.__levels.get(priority)
+            if level is None:
+                level = self.__add_level(priority)
+            level.append(item)
+            self.__size += 1
+            self.__not_empty.notify()
+
+    def __add_level(self, priority):
+        level = self.__levels[priority] = deque() if self.__key is None else FairLevel(self.__key)
+        self.__ordered = [self.__levels[key] for key in sorted(self.__levels, reverse=True)]
+        return level
 
-    def insert(self, item, priority=0):
-        self.__mutex.acquire()
-        self.__queue.put(MaxPriorityItem(item, priority))
-        self.__mutex.release()
+    def __pop(self, count):
+        items = []
+        for level in self.__ordered:
+            while level and len(items) < count:
+                items.append(level.popleft())
+        self.__size -= len(items)
+        return items
+
+    def __wait(self, timeout):
+        self.__not_empty.wait_for(lambda: self.__size or self.__closed, timeout)
+        return bool(self.__size)
+
+    def get(self, timeout=None):
+        with self.__not_empty:
+            if not self.__wait(timeout):
+                raise Empty
+            for level in self.__ordered:
+                if level:
+                    self.__size -= 1
+                    return level.popleft()
 
     def remove(self):
-        self.__mutex.acquire()
-        item = self.__queue.get()
-        self.__mutex.release()
-        return item.item if item else None
+        return self.get()
+
+    def drain(self, max_items=None, timeout=0):
+        with self.__not_empty:
+            if not self.__wait(timeout):
+                return []
+            return self.__pop(self.__size if max_items is None else max_items)
 
     def empty(self):
-        self.__mutex.acquire()
-        is_empty = self.__queue.empty()
-        self.__mutex.release()
-        return is_empty
+        with self.__mutex:
+            return not self.__size
+
+    def __len__(self):
+        return self.__size
+
+    def close(self):
+        with self.__not_empty:
+            self.__closed = True
+            self.__not_empty.notify_all()
+
+    @property
+    def closed(self):
+        return self.__closed
+
+
+class AsyncMaxPriorityQueue(MaxPriorityQueue):
+    # insert() and close() must be called from the thread running the event loop
+    def __init__(self, maxsize=None, key=None):
+        super().__init__(maxsize, key)
+        self.__not_empty = asyncio.Event()
+
+    def insert(self, item, priority=0, force=False):
+        super().insert(item, priority, force)
+        self.__not_empty.set()
+
+    def close(self):
+        super().close()
+        self.__not_empty.set()
+
+    async def __wait(self):
+        while self.empty() and not self.closed:
+            self.__not_empty.clear()
+            await self.__not_empty.wait()
+
+    def remove(self):
+        # never blocks, waiting would stop the loop that inserts
+        items = self.drain(1)
+        if not items:
+            raise Empty
+        return items[0]
+
+    async def get(self):
+        await self.__wait()
+        return self.remove()
+
+    async def get_batch(self, max_items=None):
+        await self.__wait()
+        return self.drain(max_items)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.__clock = clock
+        self.__tokens = self.burst
+        self.__updated = clock()
+
+    def take(self, tokens=1):
+        now = self.__clock()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+        if self.__tokens < tokens:
+            return False
+        self.__tokens -= tokens
+        return True
 
 
 class StoppedThread(Thread):